@@ -1,26 +1,41 @@
-from dotenv import load_dotenv
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_for_futures
+from functools import partial
+import json
 import logging
 from pydantic import BaseModel
 import os
 import random
+import threading
 import time
-from typing import Optional, List, Dict, Union, Literal
+from typing import Callable, Deque, Optional, List, Dict, Tuple, Union, Literal
 
+from helpers import compute_hash
+from providers import ProviderConfig, create_openai_client
+from routing import ModelRouter, RequestFeatures
 
-# load env variables from .env
-load_dotenv()
 
 # init logger
 logger = logging.getLogger(__name__)
 
-# initialize client
-api_key = os.getenv("OPENAI_API_KEY")
 
-if not api_key:
-    raise EnvironmentError(
-        "The environment variable OPENAI_API_KEY is not set. "
-        "Please set it to your OpenAI API key before running this script."
-    )
+def get_api_key(env_var: str = "OPENAI_API_KEY") -> str:
+    """
+    Return the OpenAI API key from the environment, loading env
+    variables from .env first.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    api_key = os.getenv(env_var)
+
+    if not api_key:
+        raise EnvironmentError(
+            f"The environment variable {env_var} is not set. "
+            "Please set it to your OpenAI API key before running this script."
+        )
+
+    return api_key
 
 class PromptContent(BaseModel):
     type: Union[Literal['input_text'], Literal['input_image']]
@@ -48,25 +63,223 @@ class Prompt(BaseModel):
         return messages
 
 
+def to_chat_completions_kwargs(request_kwargs: Dict) -> Dict:
+    """
+    Convert Responses API request arguments to Chat Completions ones.
+    """
+    messages = []
+    for message in request_kwargs['input']:
+        content = message['content']
+        if isinstance(content, list):
+            content = [
+                {'type': 'text', 'text': c['text']} if c['type'] == 'input_text'
+                else {'type': 'image_url', 'image_url': {k: v for k, v in (('url', c.get('image_url')), ('detail', c.get('detail'))) if v}}
+                for c in content
+            ]
+        messages.append({'role': message['role'], 'content': content})
+
+    chat_kwargs = {
+        'model': request_kwargs['model'],
+        'messages': messages,
+        'timeout': request_kwargs.get('timeout'),
+    }
+    if text_format := request_kwargs.get('text', {}).get('format'):
+        chat_kwargs['response_format'] = text_format
+
+    return chat_kwargs
+
+
+ErrorClass = Literal['retryable', 'non_retryable', 'shrink']
+
+
+def classify_error(e: Exception) -> ErrorClass:
+    """
+    Classify an error from the AI service as:
+    - 'retryable': rate limits, server errors, timeouts, connection errors
+    - 'shrink': prompt exceeds the model's context length; retryable
+      only with a smaller prompt
+    - 'non_retryable': other client errors (e.g., bad request, auth)
+    """
+    message = str(e).lower()
+    if 'context_length_exceeded' in message or 'maximum context length' in message:
+        return 'shrink'
+
+    status_code = getattr(e, 'status_code', None)
+    if status_code is not None:
+        if status_code in (408, 409, 429) or status_code >= 500:
+            return 'retryable'
+        return 'non_retryable'
+
+    # timeouts and connection errors carry no status code
+    if type(e).__name__ in ('APITimeoutError', 'APIConnectionError', 'TimeoutError', 'ConnectionError'):
+        return 'retryable'
+
+    return 'non_retryable'
+
+
+def get_retry_after(e: Exception) -> Optional[float]:
+    """
+    Return the wait time (in seconds) requested in a Retry-After header
+    of an error response, if any.
+    """
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class StreamAbortedError(Exception):
+    """Raised when a streamed response is aborted for failing a check."""
+    pass
+
+
+class LatencyTracker:
+    """
+    Track latencies of recent successful calls.
+    """
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.latencies = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            self.latencies.append(latency)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """
+        Return the pct percentile of recent latencies, or None if there
+        are too few samples.
+        """
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class RateLimiter:
+    """
+    Limit requests and (estimated) tokens per minute across all callers
+    sharing the limiter, over a sliding one-minute window.
+    """
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests: Deque[Tuple[float, int]] = deque()
+        self._lock = threading.Lock()
+
+    def _get_wait(self, tokens: int, now: float) -> float:
+        while self._requests and now - self._requests[0][0] >= 60:
+            self._requests.popleft()
+
+        waits = [0.0]
+        if self.requests_per_minute and len(self._requests) >= self.requests_per_minute:
+            waits.append(60 - (now - self._requests[-self.requests_per_minute][0]))
+        if self.tokens_per_minute and self._requests:
+            # wait for the oldest requests to leave the window until there's room
+            excess = sum(t for _, t in self._requests) + tokens - self.tokens_per_minute
+            for timestamp, request_tokens in self._requests:
+                if excess <= 0:
+                    break
+                excess -= request_tokens
+                waits.append(60 - (now - timestamp))
+        return max(waits)
+
+    def acquire(self, tokens: int = 0):
+        """
+        Block until a request of tokens can be sent within the limits.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._get_wait(tokens, now)
+                if wait <= 0:
+                    self._requests.append((now, tokens))
+                    return
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """
+    In-memory cache of AI service responses, keyed by model and prompt,
+    so identical requests (e.g., the same passage in several projects)
+    are sent once.
+    """
+    def __init__(self):
+        self._responses: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(request_kwargs: Dict) -> str:
+        return compute_hash(json.dumps(
+            {k: request_kwargs.get(k) for k in ('model', 'input', 'text')},
+            sort_keys=True
+        ))
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._responses.get(key)
+
+    def set(self, key: str, output_text: str):
+        with self._lock:
+            self._responses[key] = output_text
+
+
 class AIServiceCaller:
     def __init__(
             self, 
             responses_model="gpt-4o",
-            openai_embedding_model='text-embedding-3-small',
-            st_embedding_model='BAAI/bge-small-en-v1.5'
+            api_key: Optional[str] = None,
+            model_router: Optional[ModelRouter] = None,
+            hedge_requests: bool = False,
+            provider: Optional[ProviderConfig] = None,
+            observer: Optional[Callable[[Optional[float], int, bool], None]] = None,
+            rate_limiter: Optional[RateLimiter] = None,
+            response_cache: Optional[ResponseCache] = None
             ):
-        from sentence_transformers import SentenceTransformer
+        self.api_key = api_key
         self.responses_model = responses_model
-        self.openai_embedding_model = openai_embedding_model
-        self.st_embedding_model = SentenceTransformer(st_embedding_model)
+        self.model_router = model_router
+        self.hedge_requests = hedge_requests
+        self.provider = provider or ProviderConfig()
+        self.use_chat_completions = self.provider.api == 'chat_completions'
+        # called with (latency, total tokens, rate limited) after each request, e.g. by an autotuner
+        self.observer = observer
+        self.rate_limiter = rate_limiter
+        self.response_cache = response_cache
+        self.latency_tracker = LatencyTracker()
+        self._hedge_executor = ThreadPoolExecutor(thread_name_prefix="ai-service-call") if hedge_requests else None
         self._openai_client = None
+        self._openai_client_lock = threading.Lock()
 
     def _get_openai_client(self):
-        if self._openai_client is None:
-            import openai
-            self._openai_client = openai.OpenAI(api_key=api_key)
+        """
+        OpenAI client, created on the first AI service call.
+        """
+        with self._openai_client_lock:
+            if self._openai_client is None:
+                self._openai_client = create_openai_client(self.provider, self.api_key)
         return self._openai_client
 
+    def route_model(self, features: RequestFeatures) -> str:
+        """
+        Select the model for a request, using the model router if set.
+        """
+        if self.model_router:
+            return self.model_router.route(features)
+        return self.responses_model
+
+    def escalate_model(self, model: str) -> Optional[str]:
+        """
+        Return a stronger model to retry a request with, if any.
+        """
+        if self.model_router:
+            return self.model_router.escalate(model)
+        return None
+
     def create_prompt_object(
             self, 
             user_role_text_content: str,
@@ -104,52 +317,235 @@ class AIServiceCaller:
                 user_role=UserRole(content=prompt_user_content)
             )
 
-    def call_ai_service(self, prompt: Prompt, delay: float = 0.5, max_retries: int = 5):
+    def estimate_prompt_tokens(self, prompt: Prompt) -> int:
+        prompt_chars = sum(len(c.text or '') for c in prompt.user_role.content)
+        if prompt.system_role:
+            prompt_chars += len(prompt.system_role.content)
+        # estimate ~4 characters per token
+        return prompt_chars // 4
+
+    def get_request_timeout(self, prompt: Prompt) -> float:
+        """
+        Derive a timeout (in seconds) for a request from the size of its
+        prompt, as the response is expected to scale with it.
+        """
+        return self.provider.timeout_base + self.provider.timeout_per_1k_tokens * self.estimate_prompt_tokens(prompt) / 1000
+
+    def _create_response(self, client, request_kwargs: Dict) -> str:
+        start = time.monotonic()
+
+        if self.use_chat_completions:
+            response = client.chat.completions.create(**to_chat_completions_kwargs(request_kwargs))
+            output_text = response.choices[0].message.content
+        else:
+            response = client.responses.create(**request_kwargs)
+            output_text = response.output_text
+
+        latency = time.monotonic() - start
+        self.latency_tracker.record(latency)
+
+        if self.observer:
+            usage = getattr(response, 'usage', None)
+            self.observer(latency, getattr(usage, 'total_tokens', 0) or 0, False)
+
+        return output_text
+
+    def _create_streamed_response(
+            self,
+            client,
+            request_kwargs: Dict,
+            stream_check: Callable[[str], Optional[str]],
+            check_interval: int = 200 # characters
+        ) -> str:
+        """
+        Stream the response, passing the output received so far to
+        stream_check every check_interval characters. If stream_check
+        returns a violation, the stream is closed (ending generation)
+        and StreamAbortedError is raised.
+        """
+        start = time.monotonic()
+        chunks = []
+        received = checked = 0
+        usage = None
+
+        if self.use_chat_completions:
+            stream = client.chat.completions.create(
+                **to_chat_completions_kwargs(request_kwargs),
+                stream=True,
+                stream_options={'include_usage': True}
+            )
+        else:
+            stream = client.responses.create(**request_kwargs, stream=True)
+
+        try:
+            for event in stream:
+                if self.use_chat_completions:
+                    usage = getattr(event, 'usage', None) or usage
+                    delta = event.choices[0].delta.content if event.choices else None
+                elif event.type == 'response.output_text.delta':
+                    delta = event.delta
+                else:
+                    if event.type == 'response.completed':
+                        usage = getattr(event.response, 'usage', None)
+                    delta = None
+
+                if not delta:
+                    continue
+
+                chunks.append(delta)
+                received += len(delta)
+
+                if received - checked >= check_interval:
+                    checked = received
+                    if violation := stream_check(''.join(chunks)):
+                        raise StreamAbortedError(f"Aborted streamed response after {received} characters: {violation}")
+        finally:
+            stream.close()
+
+        output_text = ''.join(chunks)
+        if violation := stream_check(output_text):
+            raise StreamAbortedError(f"Rejected streamed response: {violation}")
+
+        latency = time.monotonic() - start
+        self.latency_tracker.record(latency)
+
+        if self.observer:
+            self.observer(latency, getattr(usage, 'total_tokens', 0) or 0, False)
+
+        return output_text
+
+    def _create_hedged_response(self, client, request_kwargs: Dict, create: Optional[Callable[..., str]] = None) -> str:
+        """
+        Send the request, and send a duplicate if no response arrives
+        within the p95 latency of recent calls. Return whichever
+        succeeds first.
+        """
+        create = create or self._create_response
+        hedge_after = self.latency_tracker.percentile(95)
+        primary = self._hedge_executor.submit(create, client, request_kwargs)
+
+        if hedge_after is None:
+            return primary.result()
+
+        done, _ = wait_for_futures([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        logger.info(f"No response after {hedge_after:.1f}s (p95 latency). Sending hedged request...")
+        pending = {primary, self._hedge_executor.submit(create, client, request_kwargs)}
+        error = None
+
+        while pending:
+            done, pending = wait_for_futures(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+
+        raise error
+
+    def call_ai_service(
+            self,
+            prompt: Prompt,
+            delay: float = 0.5,
+            max_retries: int = 5,
+            text_format: Optional[Dict] = None,
+            model: Optional[str] = None,
+            shrink_prompt: Optional[Callable[[Prompt], Optional[Prompt]]] = None,
+            stream_check: Optional[Callable[[str], Optional[str]]] = None,
+            max_stream_aborts: int = 2
+        ):
+        """
+        Call the AI service with a prompt and return the output text.
+
+        Pass text_format (e.g., `{"type": "json_object"}`) to constrain
+        the output format, and model to override the default model.
+
+        Only retryable errors (see classify_error) are retried, with
+        exponential backoff. If the prompt exceeds the model's context
+        length, it's replaced with the output of shrink_prompt (if given)
+        and retried. Each request times out after a period derived from
+        the prompt size.
+
+        Requests wait for the rate limiter, if set, and responses are
+        reused from the response cache, if set.
+
+        If stream_check is given, the response is streamed, and the output
+        received so far is passed to it as it arrives. If it returns a
+        violation (e.g., see helpers.find_output_violation), the stream is
+        aborted and the request retried at once. After max_stream_aborts
+        aborts, the response is streamed without checks, leaving the
+        caller to handle the output.
+        """
         client = self._get_openai_client()
+        stream_aborts = 0
+
+        request_kwargs = {}
+        if text_format:
+            request_kwargs["text"] = {"format": text_format}
 
         for attempt in range(max_retries):
             try:
-                response = client.responses.create(
-                    model=self.responses_model,
-                    input=prompt.as_messages()
+                request_kwargs.update(
+                    model=self.provider.resolve_model(model or self.responses_model),
+                    input=prompt.as_messages(),
+                    timeout=self.get_request_timeout(prompt)
                 )
+
+                cache_key = self.response_cache.make_key(request_kwargs) if self.response_cache else None
+                if cache_key and (cached_output_text := self.response_cache.get(cache_key)) is not None:
+                    return cached_output_text
+
+                if self.rate_limiter:
+                    self.rate_limiter.acquire(self.estimate_prompt_tokens(prompt))
+
+                create = self._create_response
+                if stream_check:
+                    check = stream_check if stream_aborts < max_stream_aborts else lambda output_text: None
+                    create = partial(self._create_streamed_response, stream_check=check)
+
+                if self.hedge_requests:
+                    output_text = self._create_hedged_response(client, request_kwargs, create)
+                else:
+                    output_text = create(client, request_kwargs)
+                if cache_key and output_text:
+                    self.response_cache.set(cache_key, output_text)
                 time.sleep(delay)
-                return response.output_text
+                return output_text
+
+            except StreamAbortedError as e:
+                stream_aborts += 1
+                logger.warning(f"{e}. Retrying...")
 
             except Exception as e:
-                wait = delay * (2 ** attempt)
+                if (
+                    self.provider.api == 'auto'
+                    and not self.use_chat_completions
+                    and getattr(e, 'status_code', None) in (404, 405)
+                ):
+                    logger.warning(f"Responses API not supported by {self.provider.name}. Falling back to Chat Completions...")
+                    self.use_chat_completions = True
+                    continue
+
+                error_class = classify_error(e)
+
+                if self.observer and getattr(e, 'status_code', None) == 429:
+                    self.observer(None, 0, True)
+
+                if error_class == 'shrink' and shrink_prompt and (smaller_prompt := shrink_prompt(prompt)):
+                    logger.warning("Prompt exceeds model context length. Retrying with smaller prompt...")
+                    prompt = smaller_prompt
+                    continue
+
+                if error_class != 'retryable':
+                    logger.error(f"Not retrying due to non-retryable error: {e}")
+                    return None
+
+                wait = get_retry_after(e) or delay * (2 ** attempt)
                 jittered_wait = wait * random.uniform(0.8, 1.2)
-                logging.warning(f"Retrying after {jittered_wait:.1f}s due to error...")
+                logging.warning(f"Retrying after {jittered_wait:.1f}s due to error: {e}")
                 time.sleep(jittered_wait)
 
         logging.error("Max retries exceeded.")
         return None
-
-    def generate_openai_embedding(
-        self,
-        input_text: str,
-    ):
-        """
-        Generate text embedding
-        """
-        try:
-            response = openai.embeddings.create(model=self.openai_embedding_model, input=input_text)
-            return response.data[0].embedding
-        except Exception as e:
-            logger.error(f"Error calling AI service or parsing response: {e}")
-            return None
-
-    def generate_st_embedding(
-        self,
-        input_text: str,
-        normalize_embeddings: bool = True
-    ):
-        """
-        Generate text embedding
-        """
-        try:
-            embedding = self.st_embedding_model.encode(input_text, normalize_embeddings=normalize_embeddings)
-            return embedding
-        except Exception as e:
-            logger.error(f"Error generating embedding: {e}")
-            return None
\ No newline at end of file
@@ -0,0 +1,58 @@
+import json
+import logging
+from pathlib import Path
+from pydantic import BaseModel
+from typing import List, Optional, Union
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchProject(BaseModel):
+    """
+    A project in a batch manifest. input_paths are as for a single run
+    (e.g., the project's atlas.json), relative to the manifest. Backups,
+    global review notes, and state are written to output_dir (default: a
+    directory named for the project under `batch` in the current
+    directory).
+
+    Options left as None take the value given on the command line.
+    """
+    name: str
+    input_paths: List[str]
+    output_dir: Optional[str] = None
+    disable_qa_pass: Optional[bool] = None
+    incremental: Optional[bool] = None
+    previous_state: Optional[str] = None
+    since: Optional[str] = None
+    emit_patch: Optional[str] = None
+
+
+class BatchManifest(BaseModel):
+    projects: List[BatchProject]
+
+
+def load_batch_manifest(path: Union[str, Path]) -> BatchManifest:
+    """
+    Load a batch manifest, resolving paths relative to the manifest's
+    directory.
+    """
+    path = Path(path)
+    with open(str(path), 'r', encoding='utf-8') as f:
+        manifest = BatchManifest.model_validate(json.load(f))
+
+    names = [p.name for p in manifest.projects]
+    if len(set(names)) != len(names):
+        raise ValueError("Project names in batch manifest must be unique.")
+
+    base_dir = path.resolve().parent
+    for project in manifest.projects:
+        project.input_paths = [str(base_dir / p) for p in project.input_paths]
+        if project.output_dir:
+            project.output_dir = str(base_dir / project.output_dir)
+        if project.previous_state:
+            project.previous_state = str(base_dir / project.previous_state)
+        if project.emit_patch:
+            project.emit_patch = str(base_dir / project.emit_patch)
+
+    return manifest
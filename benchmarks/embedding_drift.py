@@ -0,0 +1,88 @@
+"""
+Compare an embedding backend against the fp32 SentenceTransformer
+vectors cached in style_guides/wordlist_w_embeddings.npz: embedding
+throughput, cosine similarity of each term's vectors, and overlap of
+the word list terms retrieved for sample passages.
+
+Run from the repo root:
+
+    python benchmarks/embedding_drift.py --backend st-int8 --threads 4 [path/to/book]
+
+Fails if the mean cosine similarity or mean retrieval overlap falls
+below its minimum.
+"""
+import click
+from pathlib import Path
+import statistics
+import sys
+import time
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from embedding_backends import EMBEDDING_BACKEND_NAMES, get_embedding_backend
+from embeddings import cosine_similarity, filter_by_vector_similarity, read_npz_embeddings
+from main import resolve_input_paths
+from read_files import read_files
+
+
+@click.command()
+@click.argument("input_paths", nargs=-1)
+@click.option("--backend", "backend_name", type=click.Choice(EMBEDDING_BACKEND_NAMES), default="st-int8", show_default=True, help="Backend to compare with the cached fp32 vectors.")
+@click.option("--threads", "num_threads", type=int, default=None, help="Number of threads used by the model.")
+@click.option("--cache-file", default=str(REPO_DIR / 'style_guides' / 'wordlist_w_embeddings.npz'), show_default=True, help="Cache of fp32 reference vectors.")
+@click.option("--max-passages", type=int, default=200, show_default=True, help="Max number of passages from input_paths used to compare retrieval.")
+@click.option("--min-similarity", type=float, default=0.98, show_default=True, help="Min mean cosine similarity to the reference vectors.")
+@click.option("--min-overlap", type=float, default=0.90, show_default=True, help="Min mean Jaccard overlap of retrieved terms.")
+def cli(input_paths, backend_name="st-int8", num_threads=None, cache_file=None, max_passages=200, min_similarity=0.98, min_overlap=0.90):
+    reference = read_npz_embeddings(cache_file)
+    texts = [e.content for e in reference]
+
+    backend = get_embedding_backend(backend_name, reference[0].model, num_threads=num_threads)
+    backend.embed(texts[0]) # load model outside timing
+
+    start = time.perf_counter()
+    vectors = backend.embed_batch(texts)
+    elapsed = time.perf_counter() - start
+    click.echo(f"Throughput: {len(texts) / elapsed:.1f} texts/s ({len(texts)} texts in {elapsed:.2f}s)")
+
+    failed = False
+
+    comparable = len(vectors[0]) == len(reference[0].embedding)
+    if comparable:
+        similarities = [cosine_similarity(ref.embedding, list(vec)) for ref, vec in zip(reference, vectors)]
+        mean_similarity = statistics.mean(similarities)
+        click.echo(f"Cosine similarity to reference: mean {mean_similarity:.4f}, min {min(similarities):.4f}")
+        if mean_similarity < min_similarity:
+            click.echo(f"FAIL: mean similarity below {min_similarity}")
+            failed = True
+    else:
+        click.echo("Vectors not comparable with reference (different dimensions). Skipping similarity check.")
+
+    # compare terms retrieved for sample passages (or, without input
+    # files, for the terms themselves)
+    passages = texts
+    if input_paths:
+        passages = [b.original_content for f in read_files(resolve_input_paths(input_paths), 'gpt-4o') for b in f.text_blocks]
+    passages = passages[:max_passages]
+
+    reference_backend = get_embedding_backend('st', reference[0].model, num_threads=num_threads)
+    candidate = [e.model_copy(update={'embedding': list(v)}) for e, v in zip(reference, vectors)]
+
+    overlaps = []
+    for passage in passages:
+        expected = set(filter_by_vector_similarity(reference, reference_backend.embed(passage), reference_backend.similarity_threshold))
+        actual = set(filter_by_vector_similarity(candidate, backend.embed(passage), backend.similarity_threshold))
+        overlaps.append(len(expected & actual) / len(expected | actual) if expected | actual else 1.0)
+
+    mean_overlap = statistics.mean(overlaps)
+    click.echo(f"Retrieval overlap over {len(passages)} passages: mean {mean_overlap:.4f}, min {min(overlaps):.4f}")
+    if mean_overlap < min_overlap:
+        click.echo(f"FAIL: mean retrieval overlap below {min_overlap}")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    cli()
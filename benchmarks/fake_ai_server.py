@@ -0,0 +1,206 @@
+"""
+Fake OpenAI-compatible AI service, for running the script (e.g.,
+several worker.py processes) locally without calling a real one.
+
+Serves the Responses API (POST /v1/responses) and Chat Completions
+(POST /v1/chat/completions), without streaming. Passages sent for
+editing are returned with runs of spaces after sentences collapsed
+(so some passages change, and go through the QA pass); QA and global
+review requests get NO_ISSUE, and edit list requests an empty list.
+
+Run from the repo root:
+
+    python benchmarks/fake_ai_server.py --port 8765 [--latency 0.05] [--error-rate 0.1]
+
+and point a provider config's base_url at http://127.0.0.1:8765/v1.
+"""
+import click
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+from uuid import uuid4
+
+
+PASSAGE_PATTERN = re.compile(r'\[BEGIN PASSAGE TO EDIT\]\n(.*?)\n\[END PASSAGE TO EDIT\]', re.DOTALL)
+
+PACKED_PASSAGES_PATTERN = re.compile(r'\[BEGIN PASSAGES TO EDIT\]\n(.*?)\n\[END PASSAGES TO EDIT\]', re.DOTALL)
+
+EDIT_LIST_MARKER = '{"edits": []}'
+
+NO_ISSUE_STR = 'NO_ISSUE'
+
+
+def copyedit(text: str) -> str:
+    return re.sub(r'([.!?])  +(?=\S)', r'\1 ', text)
+
+
+def make_output_text(prompt_text: str) -> str:
+    """
+    Respond to a prompt of the script, by the kind of request.
+    """
+    if EDIT_LIST_MARKER in prompt_text:
+        return EDIT_LIST_MARKER
+    if match := PACKED_PASSAGES_PATTERN.search(prompt_text):
+        return copyedit(match.group(1))
+    if match := PASSAGE_PATTERN.search(prompt_text):
+        return copyedit(match.group(1))
+    return NO_ISSUE_STR
+
+
+def get_prompt_text(messages) -> str:
+    """
+    Return the text of the messages of a Responses API or Chat
+    Completions request.
+    """
+    if isinstance(messages, str):
+        return messages
+    texts = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        texts.extend(c.get('text', '') for c in content or [] if c.get('type') in ('input_text', 'text'))
+    return '\n'.join(texts)
+
+
+def make_usage(prompt_text: str, output_text: str, chat_completions: bool = False) -> dict:
+    # estimate ~4 characters per token
+    input_tokens, output_tokens = len(prompt_text) // 4, len(output_text) // 4
+    if chat_completions:
+        return {'prompt_tokens': input_tokens, 'completion_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens}
+    return {
+        'input_tokens': input_tokens,
+        'input_tokens_details': {'cached_tokens': 0},
+        'output_tokens': output_tokens,
+        'output_tokens_details': {'reasoning_tokens': 0},
+        'total_tokens': input_tokens + output_tokens
+    }
+
+
+def make_response(request: dict, chat_completions: bool = False) -> dict:
+    model = request.get('model', 'fake')
+
+    if chat_completions:
+        prompt_text = get_prompt_text(request.get('messages', []))
+        output_text = make_output_text(prompt_text)
+        return {
+            'id': f"chatcmpl-{uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': output_text}, 'finish_reason': 'stop'}],
+            'usage': make_usage(prompt_text, output_text, chat_completions=True)
+        }
+
+    prompt_text = get_prompt_text(request.get('input', []))
+    output_text = make_output_text(prompt_text)
+    return {
+        'id': f"resp_{uuid4().hex}",
+        'object': 'response',
+        'created_at': int(time.time()),
+        'model': model,
+        'status': 'completed',
+        'output': [{
+            'type': 'message',
+            'id': f"msg_{uuid4().hex}",
+            'status': 'completed',
+            'role': 'assistant',
+            'content': [{'type': 'output_text', 'text': output_text, 'annotations': []}]
+        }],
+        'parallel_tool_calls': False,
+        'tool_choice': 'auto',
+        'tools': [],
+        'usage': make_usage(prompt_text, output_text)
+    }
+
+
+class FakeAIServer(ThreadingHTTPServer):
+    """
+    Fake AI service, answering each request after latency seconds, and
+    failing a share of them (error_rate) with a server error, to
+    exercise retries.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, error_rate: float = 0.0):
+        super().__init__(address, FakeAIRequestHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.num_requests = 0
+        self.num_errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+class FakeAIRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server: FakeAIServer = self.server
+        path = self.path.rstrip('/')
+
+        if path not in ('/v1/responses', '/v1/chat/completions'):
+            return self.send_json(404, {'error': {'message': f"Unknown endpoint: {self.path}", 'type': 'invalid_request_error'}})
+
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+        if request.get('stream'):
+            return self.send_json(400, {'error': {'message': "Streaming is not supported by the fake server.", 'type': 'invalid_request_error'}})
+
+        time.sleep(server.latency)
+
+        with server._lock:
+            server.num_requests += 1
+            fail = random.random() < server.error_rate
+            if fail:
+                server.num_errors += 1
+
+        if fail:
+            return self.send_json(500, {'error': {'message': "Fake server error.", 'type': 'server_error'}})
+
+        self.send_json(200, make_response(request, chat_completions=path.endswith('chat/completions')))
+
+    def send_json(self, status: int, data: dict):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_server(host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, error_rate: float = 0.0) -> FakeAIServer:
+    """
+    Start a fake server in a background thread (on a free port, if port
+    is 0).
+    """
+    server = FakeAIServer((host, port), latency, error_rate)
+    threading.Thread(target=server.serve_forever, name="fake-ai-server", daemon=True).start()
+    return server
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True, help="Host to listen on.")
+@click.option("--port", type=int, default=8765, show_default=True, help="Port to listen on.")
+@click.option("--latency", type=float, default=0.0, show_default=True, help="Delay (in seconds) before each response.")
+@click.option("--error-rate", type=float, default=0.0, show_default=True, help="Share of requests failed with a server error.")
+def cli(host="127.0.0.1", port=8765, latency=0.0, error_rate=0.0):
+    server = FakeAIServer((host, port), latency, error_rate)
+    click.echo(f"Fake AI service listening at {server.base_url}...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        click.echo(f"Served {server.num_requests} requests ({server.num_errors} failed).")
+
+
+if __name__ == '__main__':
+    cli()
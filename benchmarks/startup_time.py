@@ -0,0 +1,87 @@
+"""
+Measure startup time of the no-cache-miss path: loading the pass context
+and retrieving style guide text for every passage of the input files,
+with the word list, style rule, and passage embeddings all cached.
+
+The first run warms the caches (and may load the embedding model); the
+measured runs must then finish within the budget without importing
+torch or sentence_transformers, or creating an OpenAI client.
+
+Run from the repo root:
+
+    python benchmarks/startup_time.py path/to/book
+"""
+import click
+import json
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+MEASURE_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {repo_dir!r})
+import main
+from main import resolve_input_paths
+from passes import load_pass_context
+from read_files import read_files
+import_time = time.perf_counter() - start
+
+filepaths = resolve_input_paths({input_paths!r})
+ctx = load_pass_context({style_guide_dir!r}, 'gpt-4o')
+for text_file in read_files(filepaths, 'gpt-4o'):
+    for text_block in text_file.text_blocks:
+        ctx.get_local_style_guide_text(text_block.original_content)
+ctx.embedding_backend.save()
+
+print(json.dumps({{
+    'import_time': import_time,
+    'total_time': time.perf_counter() - start,
+    'heavy_modules': [m for m in ('torch', 'sentence_transformers', 'openai') if m in sys.modules],
+}}))
+"""
+
+
+def run_measurement(input_paths, style_guide_dir) -> dict:
+    script = MEASURE_SCRIPT.format(repo_dir=str(REPO_DIR), input_paths=list(input_paths), style_guide_dir=str(style_guide_dir))
+    result = subprocess.run(
+        [sys.executable, '-c', script],
+        check=True, capture_output=True, text=True, cwd=str(REPO_DIR)
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@click.command()
+@click.argument("input_paths", nargs=-1, required=True)
+@click.option("--style-guide-dir", default=str(REPO_DIR / 'style_guides'), show_default=True, help="Style guide directory holding the embedding caches.")
+@click.option("--runs", type=int, default=5, show_default=True, help="Number of measured runs.")
+@click.option("--budget", type=float, default=3.0, show_default=True, help="Max median time (in seconds) of the no-miss path.")
+def cli(input_paths, style_guide_dir, runs=5, budget=3.0):
+    click.echo("Warming caches...")
+    run_measurement(input_paths, style_guide_dir)
+
+    measurements = [run_measurement(input_paths, style_guide_dir) for _ in range(runs)]
+    median_import_time = statistics.median(m['import_time'] for m in measurements)
+    median_total_time = statistics.median(m['total_time'] for m in measurements)
+    heavy_modules = sorted({mod for m in measurements for mod in m['heavy_modules']})
+
+    click.echo(f"Median import time: {median_import_time:.3f}s")
+    click.echo(f"Median no-miss startup time: {median_total_time:.3f}s (budget: {budget:.3f}s)")
+
+    failed = False
+    if heavy_modules:
+        click.echo(f"FAIL: no-miss path imported {', '.join(heavy_modules)}")
+        failed = True
+    if median_total_time > budget:
+        click.echo("FAIL: no-miss path exceeded budget")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,119 @@
+"""
+Run several worker.py processes against the fake AI service (see
+fake_ai_server.py), on a copy of a project, then coordinate: throughput,
+and a check that every text passage is processed and the edited files
+are written.
+
+Run from the repo root:
+
+    python benchmarks/worker_processes.py --workers 4 path/to/book
+
+Use --error-rate to have the fake service fail a share of requests, so
+passages are retried. Fails if any passage isn't done, or coordinate
+fails.
+"""
+import click
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from embedding_backends import EMBEDDING_BACKEND_NAMES
+from fake_ai_server import start_fake_server
+from main import resolve_input_paths
+from providers import ProviderConfig
+from work_queue import WorkQueue
+
+
+WORKER_SCRIPT = str(REPO_DIR / 'worker.py')
+
+
+@click.command()
+@click.argument("input_paths", nargs=-1, required=True)
+@click.option("--workers", "num_workers", type=int, default=4, show_default=True, help="Number of worker processes.")
+@click.option("--latency", type=float, default=0.05, show_default=True, help="Delay (in seconds) of the fake service's responses.")
+@click.option("--error-rate", type=float, default=0.0, show_default=True, help="Share of requests failed by the fake service.")
+@click.option("--embedding-backend", type=click.Choice(EMBEDDING_BACKEND_NAMES), default="hashing", show_default=True, help="Embedding backend of the workers.")
+@click.option("--disable-qa-pass", "-q", is_flag=True, help="Disable QA pass.")
+def cli(input_paths, num_workers=4, latency=0.05, error_rate=0.0, embedding_backend="hashing", disable_qa_pass=False):
+    chapter_filepaths = resolve_input_paths(input_paths)
+    project_dir = chapter_filepaths[0].parent
+
+    server = start_fake_server(latency=latency, error_rate=error_rate)
+    click.echo(f"Fake AI service listening at {server.base_url}...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+
+        # work on a copy, as coordinate writes the edited files
+        shutil.copytree(project_dir, tmp_dir / 'project')
+        filepaths = [str(tmp_dir / 'project' / f.relative_to(project_dir)) for f in chapter_filepaths]
+
+        provider_config_filepath = tmp_dir / 'provider_config.json'
+        provider_config_filepath.write_text(
+            ProviderConfig(name='fake', base_url=server.base_url, api='responses').model_dump_json(),
+            encoding='utf-8'
+        )
+
+        db_path = str(tmp_dir / 'state.db')
+
+        # init from the repo root, so the workers use its style guides
+        subprocess.run(
+            [
+                sys.executable, WORKER_SCRIPT, 'init', *filepaths,
+                '--db', db_path,
+                '--provider-config', str(provider_config_filepath),
+                '--embedding-backend', embedding_backend,
+                *(['--disable-qa-pass'] if disable_qa_pass else [])
+            ],
+            check=True, cwd=str(REPO_DIR)
+        )
+
+        start = time.perf_counter()
+        workers = [
+            subprocess.Popen(
+                [sys.executable, WORKER_SCRIPT, 'work', '--db', db_path, '--worker-id', f"worker-{i}"],
+                cwd=str(tmp_dir)
+            )
+            for i in range(num_workers)
+        ]
+        failed_workers = sum(1 for w in workers if w.wait() != 0)
+        elapsed = time.perf_counter() - start
+
+        work_queue = WorkQueue(db_path)
+        counts = work_queue.get_stage_counts()
+        work_queue.close()
+
+        coordinate = subprocess.run(
+            [sys.executable, WORKER_SCRIPT, 'coordinate', '--db', db_path],
+            cwd=str(tmp_dir)
+        )
+
+    num_passages = sum(counts.values())
+    click.echo(f"Text passages by stage: {counts}")
+    click.echo(f"Processed {num_passages} text passages with {num_workers} workers in {elapsed:.2f}s ({num_passages / elapsed:.1f} passages/s)")
+    click.echo(f"Fake AI service served {server.num_requests} requests ({server.num_errors} failed).")
+    server.shutdown()
+
+    failed = False
+    if failed_workers:
+        click.echo(f"FAIL: {failed_workers} workers exited with an error")
+        failed = True
+    if counts.get('done', 0) != num_passages:
+        click.echo("FAIL: not all text passages were processed")
+        failed = True
+    if coordinate.returncode != 0:
+        click.echo("FAIL: coordinate failed")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,347 @@
+from collections import Counter, defaultdict
+import logging
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from embedding_backends import EmbeddingBackend
+from embeddings import filter_by_vector_similarity
+from masking import NON_PROSE_LINE_PATTERN, find_code_segments
+from models import ConsistencyCheck, Embedding, StyleGuide, TextFile
+from read_files import is_section_heading
+
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9]*(?:[-'][A-Za-z0-9]+)*")
+
+# inline code, passthroughs, URLs, cross-references, and attribute references
+INLINE_NON_PROSE_PATTERN = re.compile(r'`[^`\n]*`|\+[^+\n]+\+|\b\w+://\S+|<<[^>\n]*>>|\{[\w-]+\}|\w+:[^\s\[]*\[[^\]\n]*\]')
+
+# labels of admonition paragraphs (e.g., "NOTE: Keep this short.")
+ADMONITION_LABEL_PATTERN = re.compile(r'^(NOTE|TIP|IMPORTANT|WARNING|CAUTION):\s*')
+
+COMMENT_LINE_PATTERN = re.compile(r'^//(?!/)')
+
+# stands in for code blocks and block macros in the text checked by style rules
+CODE_PLACEHOLDER = '@@CODE@@'
+
+SENTENCE_START_PATTERN = re.compile(r'(?:^|[.!?:]["\')\]]*\s+|^\W+)$')
+
+# words not capitalized in title case
+MINOR_WORDS = {
+    'a', 'an', 'and', 'as', 'at', 'but', 'by', 'for', 'from', 'in', 'into', 'nor', 'of',
+    'on', 'onto', 'or', 'over', 'per', 'so', 'than', 'the', 'to', 'up', 'via', 'vs', 'with', 'yet'
+}
+
+# similarity of a variant to a word list term, above which the term is cited
+WORD_LIST_SIMILARITY_THRESHOLD = 0.85
+
+
+class Finding:
+    def __init__(self, title: str, explanation: str, occurrences: List[Tuple[str, str]]):
+        self.title = title
+        self.explanation = explanation
+        self.occurrences = occurrences # (text, file name) pairs
+
+    def to_markdown(self, number: int, max_occurrences: int = 5) -> str:
+        lines = [f"{number}. **{self.title}**", f"   {self.explanation}", "   Original Text:"]
+        for text, filename in self.occurrences[:max_occurrences]:
+            lines.append(f"   - \"{text}\" ({filename})")
+        if len(self.occurrences) > max_occurrences:
+            lines.append(f"   - ...and {len(self.occurrences) - max_occurrences} more")
+        return '\n'.join(lines)
+
+
+def normalize_term(term: str) -> str:
+    """
+    Normalize a term for comparing variants: lowercase, with hyphens
+    and spaces removed (e.g., "E-mail", "email", and "e mail" match).
+    """
+    return re.sub(r"[-\s]", '', term.lower())
+
+
+def get_prose_lines(text: str) -> Tuple[List[str], List[Tuple[int, str]]]:
+    """
+    Split text into prose lines (with admonition labels, inline code,
+    URLs, etc. removed) and headings (as (level, title) tuples),
+    skipping code blocks, block macros, and attribute, anchor, and
+    comment lines.
+    """
+    lines = text.split('\n')
+    code_lines = {i for start, end in find_code_segments(lines) for i in range(start, end)}
+    prose_lines: List[str] = []
+    headings: List[Tuple[int, str]] = []
+
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if i in code_lines or not stripped or NON_PROSE_LINE_PATTERN.match(stripped):
+            continue
+        if is_section_heading(stripped):
+            markers, title = stripped.split(' ', 1)
+            headings.append((len(markers), INLINE_NON_PROSE_PATTERN.sub(' ', title).strip()))
+            continue
+        prose_lines.append(INLINE_NON_PROSE_PATTERN.sub(' ', ADMONITION_LABEL_PATTERN.sub('', stripped)))
+
+    return prose_lines, headings
+
+
+def get_check_text(text: str) -> str:
+    """
+    Return text for the style rules' consistency checks: with each code
+    block and block macro replaced by a placeholder line, comment lines
+    blanked, and inline code, URLs, etc. replaced with spaces, keeping
+    the other lines (e.g., headings and block attributes) as they are.
+    """
+    lines = text.split('\n')
+    segments = find_code_segments(lines)
+    starts = {start for start, _ in segments}
+    code_lines = {i for start, end in segments for i in range(start, end)}
+    check_lines: List[str] = []
+
+    for i, line in enumerate(lines):
+        if i in starts:
+            check_lines.append(CODE_PLACEHOLDER)
+        elif i in code_lines:
+            continue
+        elif COMMENT_LINE_PATTERN.match(line.strip()):
+            check_lines.append('')
+        else:
+            check_lines.append(INLINE_NON_PROSE_PATTERN.sub(' ', line))
+
+    return '\n'.join(check_lines)
+
+
+class TermIndex:
+    """
+    Index of the surface forms of words (and two-word phrases) by
+    normalized form, across all files.
+    """
+    def __init__(self):
+        self.forms: Dict[str, Counter] = defaultdict(Counter)
+        self.files: Dict[Tuple[str, str], Set[str]] = defaultdict(set)
+        self.phrases: Dict[str, Counter] = defaultdict(Counter)
+        self.phrase_files: Dict[Tuple[str, str], Set[str]] = defaultdict(set)
+
+    def add_line(self, line: str, filename: str):
+        previous = None
+        for match in WORD_PATTERN.finditer(line):
+            word = match.group().strip("'")
+            at_sentence_start = bool(SENTENCE_START_PATTERN.search(line[:match.start()]))
+
+            # capitalization at the start of a sentence isn't a variant
+            if len(word) >= 3 and not (at_sentence_start and word[1:] == word[1:].lower()):
+                key = normalize_term(word)
+                self.forms[key][word] += 1
+                self.files[(key, word)].add(filename)
+
+            if previous and not at_sentence_start and line[previous.end():match.start()] == ' ':
+                phrase = f"{previous.group()} {word}"
+                key = normalize_term(phrase)
+                self.phrases[key][phrase] += 1
+                self.phrase_files[(key, phrase)].add(filename)
+
+            previous = match
+
+    def get_variants(self) -> Dict[str, Counter]:
+        """
+        Return the forms of each normalized term with more than one form.
+        Two-word phrases are included only where the term is also written
+        as one word (e.g., "back end" and "backend").
+        """
+        variants: Dict[str, Counter] = {}
+
+        for key, forms in self.forms.items():
+            forms = forms.copy()
+            for phrase, count in self.phrases.get(key, {}).items():
+                forms[phrase] += count
+                self.files[(key, phrase)] |= self.phrase_files[(key, phrase)]
+            if len(forms) > 1:
+                variants[key] = forms
+
+        return variants
+
+
+def classify_heading_case(title: str) -> Optional[str]:
+    """
+    Classify a heading as 'title' or 'sentence' case, from its words
+    after the first, ignoring minor words, acronyms, and words with
+    digits. Returns None if there are no words to tell from.
+    """
+    words = [w for w in WORD_PATTERN.findall(title)[1:] if w.lower() not in MINOR_WORDS and w.isalpha() and not w.isupper()]
+    if not words:
+        return None
+    if all(w[0].isupper() for w in words):
+        return 'title'
+    if all(w[0].islower() for w in words):
+        return 'sentence'
+    return None
+
+
+def parse_word_list_term(content: str) -> Optional[str]:
+    """
+    Return the single preferred form given by a word list entry, or None
+    if the entry gives alternatives or conditions (e.g., "a.m. or A.M.").
+    """
+    if '(' in content or ' or ' in content or ',' in content:
+        return None
+    return content.strip()
+
+
+class ConsistencyAnalyzer:
+    """
+    Find inconsistencies across all files of a project locally, without
+    the AI service: variant spellings, hyphenation, and capitalization of
+    terms; heading case that differs from other headings of the same
+    level; and violations of the style rules with consistency checks.
+    """
+    def __init__(
+        self,
+        global_style_guide: Optional[StyleGuide] = None,
+        word_list_embeddings: Optional[List[Embedding]] = None,
+        embedding_backend: Optional[EmbeddingBackend] = None
+    ):
+        self.global_style_guide = global_style_guide
+        self.word_list_embeddings = word_list_embeddings or []
+        self.embedding_backend = embedding_backend
+        self.word_list_terms = {
+            normalize_term(term): term
+            for e in self.word_list_embeddings
+            if (term := parse_word_list_term(e.content))
+        }
+
+    def find_word_list_entries(self, term: str) -> List[str]:
+        """
+        Find word list entries for term: by normalized form, or failing
+        that, by embedding similarity.
+        """
+        if (key := normalize_term(term)) in self.word_list_terms:
+            return [self.word_list_terms[key]]
+
+        if not self.embedding_backend or not self.word_list_embeddings:
+            return []
+
+        try:
+            term_embedding = self.embedding_backend.embed(term)
+            if term_embedding is None:
+                return []
+            return filter_by_vector_similarity(self.word_list_embeddings, term_embedding, WORD_LIST_SIMILARITY_THRESHOLD)[:2]
+        except Exception as e:
+            logger.warning(f"Unable to look up word list entries for '{term}': {e}")
+            return []
+
+    def find_term_variants(self, index: TermIndex) -> List[Finding]:
+        findings = []
+
+        for key, forms in sorted(index.get_variants().items(), key=lambda item: -sum(item[1].values())):
+            counts = ', '.join(f"\"{form}\" ({count})" for form, count in forms.most_common())
+            explanation = f"This term is written in more than one way across the files: {counts}."
+
+            entries = self.find_word_list_entries(forms.most_common(1)[0][0])
+            if entries:
+                explanation += f" Word list: {'; '.join(entries)}."
+
+            minority_forms = [form for form, _ in forms.most_common()[1:]]
+            findings.append(Finding(
+                title="Inconsistent spelling, hyphenation, or capitalization",
+                explanation=explanation,
+                occurrences=[(form, filename) for form in minority_forms for filename in sorted(index.files[(key, form)])]
+            ))
+
+        # consistent use of a form other than the word list's
+        for key, forms in index.forms.items():
+            preferred = self.word_list_terms.get(key)
+            if not preferred or len(forms) > 1 or not forms:
+                continue
+            form = next(iter(forms))
+            if form != preferred and form.lower() != preferred:
+                findings.append(Finding(
+                    title="Spelling differs from word list",
+                    explanation=f"The word list spells this term \"{preferred}\".",
+                    occurrences=[(form, filename) for filename in sorted(index.files[(key, form)])]
+                ))
+
+        return findings
+
+    def find_heading_case_mismatches(self, headings: List[Tuple[int, str, str]]) -> List[Finding]:
+        findings = []
+        by_level: Dict[int, List[Tuple[str, str, str]]] = defaultdict(list)
+
+        for level, title, filename in headings:
+            if case := classify_heading_case(title):
+                by_level[level].append((case, title, filename))
+
+        for level, classified in sorted(by_level.items()):
+            cases = Counter(case for case, _, _ in classified)
+            if len(cases) < 2:
+                continue
+            majority_case = cases.most_common(1)[0][0]
+            findings.append(Finding(
+                title=f"Inconsistent case of level {level - 1} headings",
+                explanation=f"Most headings at this level ({'=' * level}) use {majority_case} case, but these don't.",
+                occurrences=[(title, filename) for case, title, filename in classified if case != majority_case]
+            ))
+
+        return findings
+
+    def run_check(self, rule_content: str, check: ConsistencyCheck, texts: List[Tuple[str, str]]) -> Optional[Finding]:
+        """
+        Run a style rule's consistency check over texts (see
+        get_check_text), as (text, file name) pairs.
+        """
+        flags = re.MULTILINE | (re.IGNORECASE if check.ignore_case else 0)
+        patterns = [re.compile(v, flags) for v in check.variants]
+        matches: List[List[Tuple[str, str]]] = [[] for _ in patterns]
+
+        for text, filename in texts:
+            for pattern, pattern_matches in zip(patterns, matches):
+                pattern_matches.extend((m.group().strip().split('\n')[0], filename) for m in pattern.finditer(text))
+
+        if check.type == 'forbidden':
+            occurrences = [occurrence for pattern_matches in matches for occurrence in pattern_matches]
+            if occurrences:
+                return Finding(title="Style rule not followed", explanation=rule_content, occurrences=occurrences)
+            return None
+
+        used = [pattern_matches for pattern_matches in matches if pattern_matches]
+        if len(used) < 2:
+            return None
+
+        # report all but the most used variant
+        used.sort(key=len, reverse=True)
+        return Finding(
+            title="Inconsistent style",
+            explanation=f"{rule_content} Most often used: \"{used[0][0][0]}\".",
+            occurrences=[occurrence for pattern_matches in used[1:] for occurrence in pattern_matches]
+        )
+
+    def analyze(self, text_files: List[TextFile]) -> List[Finding]:
+        """
+        Analyze the edited content of text_files together.
+        """
+        index = TermIndex()
+        headings: List[Tuple[int, str, str]] = []
+        texts: List[Tuple[str, str]] = []
+
+        for text_file in text_files:
+            filename = text_file.filepath.name
+            text = text_file.get_qaed_edited_content()
+            texts.append((get_check_text(text), filename))
+
+            prose_lines, file_headings = get_prose_lines(text)
+            for line in prose_lines:
+                index.add_line(line, filename)
+            headings.extend((level, title, filename) for level, title in file_headings)
+
+        findings = self.find_term_variants(index) + self.find_heading_case_mismatches(headings)
+
+        if self.global_style_guide:
+            for category in self.global_style_guide.categories:
+                for rule in category.rules:
+                    if rule.consistency_check and (finding := self.run_check(rule.content, rule.consistency_check, texts)):
+                        findings.append(finding)
+
+        return findings
+
+
+def format_findings(findings: List[Finding]) -> str:
+    return '\n\n'.join(finding.to_markdown(i) for i, finding in enumerate(findings, start=1))
@@ -0,0 +1,66 @@
+import json
+import logging
+from typing import List, Optional
+
+from helpers import clean_response
+from models import TextEdit, TextEditList
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_edit_list(response: str) -> Optional[List[TextEdit]]:
+    """
+    Parse a model response into a list of TextEdits.
+
+    Expects a JSON object with an `edits` list. Returns None if the
+    response can't be parsed.
+    """
+    try:
+        data = json.loads(clean_response(response.strip()))
+        return TextEditList.model_validate(data).edits
+    except Exception as e:
+        logger.warning(f"Failed to parse edit list from response: {e}")
+        return None
+
+
+def apply_edit_list(text: str, edits: List[TextEdit]) -> Optional[str]:
+    """
+    Apply a list of TextEdits to text.
+
+    Edits are expected in order of appearance. Each edit's original
+    span, together with its anchor context, must match the text exactly
+    and unambiguously, after the end of the previous edit.
+
+    Returns:
+        edited text, or None if any edit does not match
+    """
+    pieces: List[str] = []
+    cursor = 0
+
+    for n, edit in enumerate(edits, start=1):
+        if not edit.original:
+            logger.warning(f"Rejecting edit {n}: empty original span.")
+            return None
+
+        anchored = edit.context_before + edit.original + edit.context_after
+        match_pos = text.find(anchored, cursor)
+
+        if match_pos == -1:
+            logger.warning(f"Rejecting edit {n}: original span not found in text.")
+            return None
+
+        if text.find(anchored, match_pos + 1) != -1:
+            logger.warning(f"Rejecting edit {n}: original span matches more than once.")
+            return None
+
+        start = match_pos + len(edit.context_before)
+        end = start + len(edit.original)
+
+        pieces.append(text[cursor:start])
+        pieces.append(edit.replacement)
+        cursor = end
+
+    pieces.append(text[cursor:])
+
+    return ''.join(pieces)
@@ -0,0 +1,265 @@
+from difflib import SequenceMatcher
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from helpers import compute_hash
+from incremental import get_final_content
+from masking import is_prose_free
+from models import TextFile, keep_outer_whitespace
+from read_files import split_into_sentences
+
+
+logger = logging.getLogger(__name__)
+
+# (sentence, whitespace following it, memoized edited sentence or None)
+Segment = Tuple[str, str, Optional[str]]
+
+
+def make_style_version(*texts: str) -> str:
+    """
+    Hash the texts that determine how passages are edited (e.g., the
+    style guide, word list, and prompts), so edits memoized under one
+    version aren't reused under another.
+    """
+    return compute_hash('\x1f'.join(texts))[:16]
+
+
+def get_sentence_similarity(a: str, b: str) -> float:
+    if not a or not b or max(len(a), len(b)) > 2 * min(len(a), len(b)):
+        return 0.0
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    if matcher.real_quick_ratio() < 0.5:
+        return 0.0
+    return matcher.ratio()
+
+
+def align_sentences(original: List[str], final: List[str], min_similarity: float = 0.5) -> List[Tuple[int, int]]:
+    """
+    Align original sentences with their final (edited) forms, maximizing
+    total similarity, with sentences added or removed in editing left
+    unaligned.
+
+    Alignments next to a sentence removed with none added in its place
+    (or added with none removed) are left out, as the sentence may have
+    been merged into (or split from) the aligned one in editing.
+
+    Returns:
+        list of (original index, final index) tuples, in order
+    """
+    n, m = len(original), len(final)
+    scores = [[0.0] * (m + 1) for _ in range(n + 1)]
+    moves = [[''] * (m + 1) for _ in range(n + 1)]
+
+    for i in range(1, n + 1):
+        moves[i][0] = 'up'
+    for j in range(1, m + 1):
+        moves[0][j] = 'left'
+
+    for i in range(1, n + 1):
+        for j in range(1, m + 1):
+            scores[i][j], moves[i][j] = max((scores[i - 1][j], 'up'), (scores[i][j - 1], 'left'))
+            similarity = get_sentence_similarity(original[i - 1], final[j - 1])
+            if similarity >= min_similarity and scores[i - 1][j - 1] + similarity > scores[i][j]:
+                scores[i][j], moves[i][j] = scores[i - 1][j - 1] + similarity, 'diag'
+
+    pairs: List[Tuple[int, int]] = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        move = moves[i][j]
+        if move == 'diag':
+            pairs.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif move == 'up':
+            i -= 1
+        else:
+            j -= 1
+    pairs.reverse()
+
+    aligned_original = {i for i, _ in pairs}
+    aligned_final = {j for _, j in pairs}
+
+    def is_gap(index: int, length: int, aligned: set) -> bool:
+        return 0 <= index < length and index not in aligned
+
+    return [
+        (i, j) for i, j in pairs
+        if is_gap(i - 1, n, aligned_original) == is_gap(j - 1, m, aligned_final)
+        and is_gap(i + 1, n, aligned_original) == is_gap(j + 1, m, aligned_final)
+    ]
+
+
+def get_unseen_runs(segments: List[Segment]) -> List[Tuple[int, int]]:
+    """
+    Return the (start, end) indexes of the runs of consecutive segments
+    not in the edit memory.
+    """
+    runs = []
+    start = None
+    for i, (_, _, edited) in enumerate(segments):
+        if edited is None and start is None:
+            start = i
+        elif edited is not None and start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(segments)))
+    return runs
+
+
+def get_run_text(segments: List[Segment], start: int, end: int) -> str:
+    """
+    Return the original text of segments start to end.
+    """
+    return ''.join(sentence + separator for sentence, separator, _ in segments[start:end - 1]) + segments[end - 1][0]
+
+
+def assemble_segments(segments: List[Segment], edited_runs: Optional[Dict[int, Tuple[int, str]]] = None) -> str:
+    """
+    Assemble edited text from memoized segments and the edited text of
+    the runs of unseen segments (mapping run start to run end and edited
+    text), keeping the original whitespace around and between sentences.
+    """
+    edited_runs = edited_runs or {}
+    parts = []
+    i = 0
+    while i < len(segments):
+        if i in edited_runs:
+            end, edited_text = edited_runs[i]
+            parts.append(keep_outer_whitespace(get_run_text(segments, i, end), edited_text) + segments[end - 1][1])
+            i = end
+            continue
+        sentence, separator, edited = segments[i]
+        parts.append(keep_outer_whitespace(sentence, edited) + separator)
+        i += 1
+    return ''.join(parts)
+
+
+class EditMemory:
+    """
+    On-disk memory of sentence-level edits: the final (QAed or edited)
+    form of each sentence of the passages edited in previous runs, keyed
+    by the sentence and the style version, so sentences seen before
+    needn't be sent to the AI service again, however they're grouped
+    into passages.
+
+    The keys of entries recorded from QAed text are kept in qaed_keys,
+    so passages assembled from other entries (e.g., recorded with the QA
+    pass disabled) are still QAed.
+    """
+    def __init__(self, filepath: Union[str, Path], style_version: str):
+        self.filepath = Path(filepath)
+        self.style_version = style_version
+        self.entries: Dict[str, str] = {}
+        self.qaed_keys: Set[str] = set()
+        self.is_dirty = False
+        self._lock = threading.Lock()
+
+        if self.filepath.exists():
+            try:
+                with open(str(self.filepath), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.entries = data.get('entries', {})
+                self.qaed_keys = set(data.get('qaed', []))
+            except Exception as e:
+                logger.warning(f"Failed to read edit memory: {e}, ignoring.")
+
+    def make_key(self, sentence: str) -> str:
+        return compute_hash(f"{self.style_version}\x1f{sentence.strip()}")
+
+    def lookup(self, text: str) -> List[Segment]:
+        """
+        Split text into sentences, with the memoized edited form of each,
+        if any.
+        """
+        with self._lock:
+            return [
+                (sentence, separator, self.entries.get(self.make_key(sentence)) if sentence.strip() else sentence)
+                for sentence, separator in split_into_sentences(text)
+            ]
+
+    def is_qaed(self, text: str) -> bool:
+        """
+        Check whether the entries of all sentences of text were recorded
+        from QAed text.
+        """
+        with self._lock:
+            return all(
+                self.make_key(sentence) in self.qaed_keys
+                for sentence, _ in split_into_sentences(text) if sentence.strip()
+            )
+
+    def record(self, original_text: str, final_text: str, is_qaed: bool = True) -> int:
+        """
+        Align the sentences of original_text and final_text, and memoize
+        the final form of each aligned sentence, noting whether
+        final_text was QAed.
+
+        Nothing is memoized unless assembling the text from the aligned
+        sentences (see assemble_segments) gives final_text exactly, as
+        it wouldn't if sentences were merged or split, or the whitespace
+        between them changed, in editing.
+
+        Returns:
+            number of sentences memoized
+        """
+        original = [s.strip() for s, _ in split_into_sentences(original_text) if s.strip()]
+        final = [s.strip() for s, _ in split_into_sentences(final_text) if s.strip()]
+        pairs = align_sentences(original, final)
+
+        final_by_original = {original[i]: final[j] for i, j in pairs}
+        segments = [
+            (sentence, separator, final_by_original.get(sentence.strip()) if sentence.strip() else sentence)
+            for sentence, separator in split_into_sentences(original_text)
+        ]
+        if (
+            get_unseen_runs(segments)
+            or keep_outer_whitespace(original_text, assemble_segments(segments)) != keep_outer_whitespace(original_text, final_text)
+        ):
+            return 0
+
+        with self._lock:
+            for i, j in pairs:
+                key = self.make_key(original[i])
+                if self.entries.get(key) != final[j]:
+                    self.entries[key] = final[j]
+                    self.qaed_keys.discard(key)
+                    self.is_dirty = True
+                if is_qaed and key not in self.qaed_keys:
+                    self.qaed_keys.add(key)
+                    self.is_dirty = True
+
+        return len(pairs)
+
+    def save(self):
+        with self._lock:
+            if not self.is_dirty:
+                return
+            tmp_path = self.filepath.with_suffix('.json.tmp')
+            with open(str(tmp_path), 'w', encoding='utf-8') as f:
+                json.dump({'entries': self.entries, 'qaed': sorted(self.qaed_keys)}, f)
+            os.replace(tmp_path, self.filepath)
+            self.is_dirty = False
+
+
+def record_text_files(edit_memory: EditMemory, text_files: List[TextFile], disable_qa_pass: bool = False) -> int:
+    """
+    Memoize the sentence-level edits of the blocks of text_files that
+    have been fully processed (edited, and QAed unless disabled), noting
+    which were QAed.
+
+    Returns:
+        number of sentences memoized
+    """
+    num_sentences = 0
+    for text_file in text_files:
+        for text_block in text_file.text_blocks:
+            if not text_block.is_edited or not (disable_qa_pass or text_block.is_qaed):
+                continue
+            if is_prose_free(text_block.original_content):
+                continue
+            num_sentences += edit_memory.record(text_block.original_content, get_final_content(text_block), text_block.is_qaed)
+    return num_sentences
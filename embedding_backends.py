@@ -0,0 +1,185 @@
+from abc import ABC, abstractmethod
+import logging
+import threading
+from typing import List, Optional
+
+from embedding_daemon import EmbeddingClient, connect_embedding_daemon
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = 'BAAI/bge-small-en-v1.5'
+
+EMBEDDING_BACKEND_NAMES = ['st', 'st-int8', 'hashing']
+
+
+def load_sentence_transformer(model_name: str, num_threads: Optional[int] = None):
+    """
+    Load a SentenceTransformer model for CPU inference, setting torch's
+    intra-op thread count if num_threads is given.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    model = SentenceTransformer(model_name, device='cpu')
+
+    if not getattr(model.tokenizer, 'is_fast', False):
+        logger.warning(f"No fast tokenizer available for {model_name}. Embedding will be slower.")
+
+    return model
+
+
+def quantize_model(model):
+    """
+    Dynamically quantize the linear layers of a model to int8.
+    """
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class EmbeddingBackend(ABC):
+    """
+    Interface for generating text embeddings.
+
+    backend_id identifies the backend and its settings, and is recorded
+    with cached embeddings, so caches generated by a different backend
+    are invalidated. similarity_threshold is the cosine similarity above
+    which a style rule or word list term is considered relevant to a
+    passage, which depends on the backend.
+    """
+    backend_id: str
+    similarity_threshold: float = 0.60
+
+    @abstractmethod
+    def embed_batch(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """
+        Return the embeddings of texts, or None if they couldn't be
+        generated.
+        """
+
+    def embed(self, text: str) -> Optional[List[float]]:
+        embeddings = self.embed_batch([text])
+        return embeddings[0] if embeddings else None
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """
+    Embeddings from a SentenceTransformer model, loaded on first use, or
+    from an embedding daemon serving the same model, if one is given.
+    """
+    def __init__(
+        self,
+        model_name: str = DEFAULT_EMBEDDING_MODEL,
+        embedding_client: Optional[EmbeddingClient] = None,
+        num_threads: Optional[int] = None,
+        batch_size: int = 64
+    ):
+        self.model_name = model_name
+        self.backend_id = model_name
+        self.embedding_client = embedding_client
+        self.num_threads = num_threads
+        self.batch_size = batch_size
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    def load_model(self):
+        return load_sentence_transformer(self.model_name, self.num_threads)
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                self._model = self.load_model()
+        return self._model
+
+    def _encode_with_embedding_client(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """
+        Encode texts with the embedding daemon, if any. On failure, stop
+        using the daemon for the rest of the run.
+        """
+        if self.embedding_client is None:
+            return None
+        try:
+            return self.embedding_client.encode(texts, normalize_embeddings=True)
+        except Exception as e:
+            logger.warning(f"Embedding daemon unavailable ({e}). Loading embedding model in process...")
+            self.embedding_client = None
+            return None
+
+    def embed_batch(self, texts: List[str]) -> Optional[List[List[float]]]:
+        if (embeddings := self._encode_with_embedding_client(texts)) is not None:
+            return embeddings
+
+        try:
+            return list(self.model.encode(texts, normalize_embeddings=True, batch_size=self.batch_size))
+        except Exception as e:
+            logger.error(f"Error generating embedding: {e}")
+            return None
+
+
+class QuantizedSentenceTransformerBackend(SentenceTransformerBackend):
+    """
+    SentenceTransformer model with its linear layers dynamically
+    quantized to int8, for faster inference on CPU.
+    """
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, num_threads: Optional[int] = None, batch_size: int = 64):
+        super().__init__(model_name, num_threads=num_threads, batch_size=batch_size)
+        self.backend_id = f"{model_name}+int8"
+
+    def load_model(self):
+        return quantize_model(super().load_model())
+
+
+class HashingBackend(EmbeddingBackend):
+    """
+    Lexical embeddings (hashed word unigrams and bigrams, with sublinear
+    term frequencies) from scikit-learn's HashingVectorizer. No model to
+    load, so cheap to run on CPU, but matches only on shared words.
+    """
+    similarity_threshold = 0.25
+
+    def __init__(self, n_features: int = 2 ** 12):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        self.backend_id = f"hashing-{n_features}"
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features,
+            ngram_range=(1, 2),
+            alternate_sign=False,
+            norm=None
+        )
+
+    def embed_batch(self, texts: List[str]) -> Optional[List[List[float]]]:
+        import numpy as np
+        from sklearn.preprocessing import normalize
+
+        counts = self.vectorizer.transform(texts)
+        counts.data = np.log1p(counts.data)
+        return [row.tolist() for row in normalize(counts).toarray()]
+
+
+def get_embedding_backend(
+    backend_name: str = 'st',
+    model_name: str = DEFAULT_EMBEDDING_MODEL,
+    start_embedding_daemon: bool = False,
+    num_threads: Optional[int] = None
+) -> EmbeddingBackend:
+    """
+    Build the named embedding backend. The 'st' backend uses a running
+    embedding daemon for model_name, if there is one (started first, if
+    start_embedding_daemon is True). num_threads sets the number of
+    threads used by the model, if it's loaded in process.
+    """
+    if backend_name == 'st':
+        return SentenceTransformerBackend(
+            model_name,
+            connect_embedding_daemon(model_name, start=start_embedding_daemon, num_threads=num_threads),
+            num_threads=num_threads
+        )
+    if backend_name == 'st-int8':
+        return QuantizedSentenceTransformerBackend(model_name, num_threads=num_threads)
+    if backend_name == 'hashing':
+        return HashingBackend()
+    raise ValueError(f"Unknown embedding backend: '{backend_name}'. Supported backends: {EMBEDDING_BACKEND_NAMES}")
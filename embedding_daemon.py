@@ -0,0 +1,243 @@
+import click
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Optional, Union
+
+from helpers import compute_hash
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_TIMEOUT = 900.0 # seconds
+DEFAULT_START_TIMEOUT = 60.0 # seconds
+SOCKET_PATH_ENV_VAR = "AI_TEXT_EDITOR_EMBEDDING_SOCKET"
+
+
+def get_default_socket_path(model: str) -> Path:
+    """
+    Return the socket path for a daemon serving model: the path in the
+    AI_TEXT_EDITOR_EMBEDDING_SOCKET environment variable, if set, or a
+    per-user, per-model path in the temp directory.
+    """
+    if env_path := os.getenv(SOCKET_PATH_ENV_VAR):
+        return Path(env_path)
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return Path(tempfile.gettempdir()) / f"ai-text-editor-embeddings-{uid}-{compute_hash(model)[:8]}.sock"
+
+
+class EmbeddingClient:
+    """
+    Client for an embedding daemon. Requests and responses are single
+    lines of JSON.
+    """
+    def __init__(self, socket_path: Union[str, Path], timeout: float = 60.0):
+        self.socket_path = Path(socket_path)
+        self.timeout = timeout
+
+    def _request(self, request: dict) -> dict:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(str(self.socket_path))
+            with sock.makefile('rw', encoding='utf-8') as f:
+                f.write(json.dumps(request) + '\n')
+                f.flush()
+                response = json.loads(f.readline())
+
+        if 'error' in response:
+            raise RuntimeError(f"Embedding daemon error: {response['error']}")
+        return response
+
+    def ping(self) -> Optional[str]:
+        """
+        Return the model served by the daemon, or None if it's not
+        reachable.
+        """
+        try:
+            return self._request({'command': 'ping'}).get('model')
+        except (OSError, ValueError, RuntimeError):
+            return None
+
+    def shutdown(self):
+        self._request({'command': 'shutdown'})
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True) -> List[List[float]]:
+        response = self._request({'command': 'encode', 'texts': texts, 'normalize_embeddings': normalize_embeddings})
+        return response['embeddings']
+
+
+def start_daemon(
+    model: str,
+    socket_path: Union[str, Path],
+    idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+    start_timeout: float = DEFAULT_START_TIMEOUT,
+    num_threads: Optional[int] = None
+) -> bool:
+    """
+    Start an embedding daemon in the background, detached from this
+    process, and wait until it accepts requests.
+    """
+    socket_path = Path(socket_path)
+    logger.info(f"Starting embedding daemon for {model} on {socket_path}...")
+
+    subprocess.Popen(
+        [
+            sys.executable, str(Path(__file__).resolve()), 'serve',
+            '--model', model,
+            '--socket', str(socket_path),
+            '--idle-timeout', str(idle_timeout),
+        ] + (['--threads', str(num_threads)] if num_threads else []),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+    client = EmbeddingClient(socket_path)
+    deadline = time.monotonic() + start_timeout
+    while time.monotonic() < deadline:
+        if client.ping() == model:
+            return True
+        time.sleep(0.25)
+
+    logger.warning(f"Embedding daemon did not start within {start_timeout} seconds.")
+    return False
+
+
+def connect_embedding_daemon(
+    model: str,
+    socket_path: Optional[Union[str, Path]] = None,
+    start: bool = False,
+    idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+    num_threads: Optional[int] = None
+) -> Optional[EmbeddingClient]:
+    """
+    Return a client for a running embedding daemon serving model,
+    starting one first if start is True and none is running.
+
+    Returns None if no daemon is available, in which case callers
+    should load the embedding model in process.
+    """
+    socket_path = Path(socket_path) if socket_path else get_default_socket_path(model)
+    client = EmbeddingClient(socket_path)
+
+    served_model = client.ping() if socket_path.exists() else None
+    if served_model == model:
+        return client
+    if served_model is not None:
+        logger.warning(f"Embedding daemon on {socket_path} serves {served_model}, not {model}. Not using it.")
+        return None
+
+    if start and start_daemon(model, socket_path, idle_timeout, num_threads=num_threads):
+        return client
+
+    return None
+
+
+class _EmbeddingRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server: "EmbeddingServer" = self.server
+        server.touch()
+
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get('command') == 'ping':
+                response = {'model': server.model_name}
+            elif request.get('command') == 'encode':
+                with server.encode_lock:
+                    embeddings = server.model.encode(
+                        request['texts'],
+                        normalize_embeddings=request.get('normalize_embeddings', True),
+                        batch_size=64
+                    )
+                response = {'embeddings': [e.tolist() for e in embeddings]}
+            elif request.get('command') == 'shutdown':
+                response = {'model': server.model_name}
+                threading.Thread(target=server.shutdown, daemon=True).start()
+            else:
+                response = {'error': f"Unknown command: {request.get('command')}"}
+        except Exception as e:
+            response = {'error': str(e)}
+
+        server.touch()
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, model_name: str, idle_timeout: float, num_threads: Optional[int] = None):
+        from embedding_backends import load_sentence_transformer
+        self.model_name = model_name
+        self.model = load_sentence_transformer(model_name, num_threads)
+        self.encode_lock = threading.Lock()
+        self.idle_timeout = idle_timeout
+        self.last_request_time = time.monotonic()
+        super().__init__(str(socket_path), _EmbeddingRequestHandler)
+
+    def touch(self):
+        self.last_request_time = time.monotonic()
+
+    def shut_down_when_idle(self):
+        while time.monotonic() - self.last_request_time < self.idle_timeout:
+            time.sleep(min(5.0, self.idle_timeout))
+        logger.info(f"No requests for {self.idle_timeout} seconds. Shutting down.")
+        self.shutdown()
+
+
+@click.group(help="Long-lived local service that keeps an embedding model loaded between runs.")
+def cli():
+    pass
+
+
+@cli.command(help="Serve embedding requests on a Unix socket until idle.")
+@click.option("--model", default="BAAI/bge-small-en-v1.5", show_default=True, help="SentenceTransformer model to serve.")
+@click.option("--socket", "socket_path", default=None, help="Path of the Unix socket (default: per-user, per-model path in the temp directory).")
+@click.option("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT, show_default=True, help="Seconds without requests after which the service shuts down.")
+@click.option("--threads", "num_threads", type=int, default=None, help="Number of threads used by the model (default: torch's default).")
+def serve(model, socket_path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT, num_threads=None):
+    socket_path = Path(socket_path) if socket_path else get_default_socket_path(model)
+
+    if socket_path.exists():
+        if EmbeddingClient(socket_path).ping() is not None:
+            click.echo(f"An embedding daemon is already running on {socket_path}. Exiting.")
+            sys.exit(1)
+        socket_path.unlink() # stale socket from a daemon that didn't exit cleanly
+
+    server = EmbeddingServer(socket_path, model, idle_timeout, num_threads)
+    os.chmod(str(socket_path), 0o600)
+    threading.Thread(target=server.shut_down_when_idle, daemon=True).start()
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
+
+
+@cli.command(help="Stop a running embedding daemon.")
+@click.option("--model", default="BAAI/bge-small-en-v1.5", show_default=True, help="Model served by the daemon.")
+@click.option("--socket", "socket_path", default=None, help="Path of the Unix socket.")
+def stop(model, socket_path=None):
+    socket_path = Path(socket_path) if socket_path else get_default_socket_path(model)
+    client = EmbeddingClient(socket_path)
+
+    if client.ping() is None:
+        click.echo(f"No embedding daemon running on {socket_path}.")
+        return
+
+    client.shutdown()
+    click.echo("Embedding daemon stopped.")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    cli()
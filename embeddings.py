@@ -1,17 +1,21 @@
+from collections import OrderedDict
 import logging
 import math
 import os
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Union
+import re
+import threading
+from typing import Any, Callable, Dict, List, Literal, Optional, Union
 
-from helpers import compute_hash
+from embedding_backends import EmbeddingBackend
+from helpers import compute_hash, count_token_length
 from models import Embedding
 
 
 logger = logging.getLogger(__name__)
 
-# disable parallelism to avoid deadlocks
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
+# disable parallelism to avoid deadlocks, unless explicitly enabled
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
 
 
 def write_npz_embeddings(filepath: Union[str, Path], items: List[Embedding]) -> None:
@@ -43,31 +47,53 @@ def read_npz_embeddings(filepath: Union[str, Path]) -> List[Dict[str, Any]]:
     ]
 
 
+def get_backend_cache_filepath(filepath: Union[str, Path], backend_id: str) -> Path:
+    """
+    Return filepath with backend_id in its name (e.g.,
+    wordlist_w_embeddings.hashing-4096.npz), so that each backend's
+    embeddings are cached in a file of their own.
+    """
+    filepath = Path(filepath)
+    safe_backend_id = re.sub(r'[^\w.+-]', '_', backend_id)
+    return filepath.with_name(f"{filepath.stem}.{safe_backend_id}{filepath.suffix}")
+
+
 def check_and_update_embedding_items(
     raw_items: List[str],
     filepath: Union[str, Path],
-    model: str,
-    embed_func: Callable[[str], List[float]],
+    embedding_backend: EmbeddingBackend
 ) -> List[Embedding]:
+    """
+    Return embeddings for raw_items, from the cache file if it's up to
+    date and was generated by the same backend, or else generated in one
+    batch and cached.
+    """
     filepath = Path(filepath)
+    model = embedding_backend.backend_id
 
     def compute_hashes(texts):
         return [compute_hash(text) for text in texts]
 
-    if not filepath.exists():
-        logger.info("No cached embeddings found. Generating embeddings...")
+    def generate_embeddings(texts):
+        vectors = embedding_backend.embed_batch(texts)
+        if vectors is None:
+            raise RuntimeError(f"Failed to generate embeddings for {filepath.name}.")
         embeddings = [
             Embedding(
 				content=text,
-				embedding=embed_func(text),
+				embedding=vector,
 				hash_val=compute_hash(text),
 				model=model
 			)
-            for text in raw_items
+            for text, vector in zip(texts, vectors)
         ]
         write_npz_embeddings(filepath, embeddings)
         return embeddings
 
+    if not filepath.exists():
+        logger.info("No cached embeddings found. Generating embeddings...")
+        return generate_embeddings(raw_items)
+
     try:
         cached = read_npz_embeddings(filepath)
         if (
@@ -77,31 +103,129 @@ def check_and_update_embedding_items(
             or any(not e.embedding for e in cached)
         ):
             logger.info("Detected changes or inconsistencies, regenerating embeddings.")
-            embeddings = [
-				Embedding(
-					content=text,
-					embedding=embed_func(text),
-					hash_val=compute_hash(text),
-					model=model
-				)
-				for text in raw_items
-            ]
-            write_npz_embeddings(filepath, embeddings)
-            return embeddings
+            return generate_embeddings(raw_items)
         return cached
     except Exception as e:
         logger.warning(f"Failed to read embedding cache: {e}, regenerating.")
-        embeddings = [
-            Embedding(
-				content=text,
-				embedding=embed_func(text),
-				hash_val=compute_hash(text),
-				model=model
-			)
-            for text in raw_items
-        ]
-        write_npz_embeddings(filepath, embeddings)
-        return embeddings
+        return generate_embeddings(raw_items)
+
+
+class CachedEmbeddingBackend(EmbeddingBackend):
+    """
+    Wraps an embedding backend with an on-disk cache of text passage
+    embeddings, keyed by content hash, so passages embedded in a previous
+    run needn't be embedded again (and the embedding model needn't be
+    loaded, if every passage is cached).
+
+    The cache holds at most max_entries embeddings, evicting the least
+    recently used.
+    """
+    def __init__(self, embedding_backend: EmbeddingBackend, filepath: Union[str, Path], max_entries: int = 50000):
+        self.embedding_backend = embedding_backend
+        self.backend_id = embedding_backend.backend_id
+        self.similarity_threshold = embedding_backend.similarity_threshold
+        self.filepath = Path(filepath)
+        self.max_entries = max_entries
+        self.embeddings_by_hash: Dict[str, List[float]] = OrderedDict()
+        self.is_dirty = False
+        self._lock = threading.Lock()
+
+        if self.filepath.exists():
+            try:
+                self.embeddings_by_hash = OrderedDict(
+                    (e.hash_val, e.embedding) for e in read_npz_embeddings(self.filepath) if e.model == self.backend_id
+                )
+                self._evict()
+            except Exception as e:
+                logger.warning(f"Failed to read passage embedding cache: {e}, ignoring.")
+
+    def embed_batch(self, texts: List[str]) -> Optional[List[List[float]]]:
+        hash_vals = [compute_hash(text) for text in texts]
+
+        with self._lock:
+            found = {h: self.embeddings_by_hash[h] for h in hash_vals if h in self.embeddings_by_hash}
+            for hash_val in found:
+                self.embeddings_by_hash.move_to_end(hash_val)
+            missing = [(h, t) for h, t in zip(hash_vals, texts) if h not in found]
+
+        if missing:
+            vectors = self.embedding_backend.embed_batch([t for _, t in missing])
+            if vectors is None:
+                return None
+            with self._lock:
+                for (hash_val, _), vector in zip(missing, vectors):
+                    found[hash_val] = self.embeddings_by_hash[hash_val] = vector
+                    self.embeddings_by_hash.move_to_end(hash_val)
+                self._evict()
+                self.is_dirty = True
+
+        return [found[h] for h in hash_vals]
+
+    def _evict(self):
+        while len(self.embeddings_by_hash) > self.max_entries:
+            self.embeddings_by_hash.popitem(last=False)
+            self.is_dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self.is_dirty:
+                return
+            write_npz_embeddings(self.filepath, [
+                Embedding(content='', embedding=embedding, hash_val=hash_val, model=self.backend_id)
+                for hash_val, embedding in self.embeddings_by_hash.items()
+            ])
+            self.is_dirty = False
+
+
+SENTENCE_BOUNDARY_PATTERN = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def split_into_windows(text: str, max_window_tokens: int = 320, overlap_sentences: int = 1) -> List[str]:
+    """
+    Split text into windows of whole sentences of at most
+    max_window_tokens tokens (or a single longer sentence), overlapping
+    by overlap_sentences sentences, so that no part of a long passage is
+    lost to the embedding model's input length limit (512 tokens for
+    bge-small).
+    """
+    sentences = [s.strip() for s in SENTENCE_BOUNDARY_PATTERN.split(text) if s.strip()]
+
+    if not sentences:
+        return [text]
+
+    sentence_tokens = [count_token_length(s) for s in sentences]
+    windows: List[str] = []
+    start = 0
+
+    while start < len(sentences):
+        end = start + 1
+        window_tokens = sentence_tokens[start]
+        while end < len(sentences) and window_tokens + sentence_tokens[end] <= max_window_tokens:
+            window_tokens += sentence_tokens[end]
+            end += 1
+
+        windows.append(' '.join(sentences[start:end]))
+
+        if end >= len(sentences):
+            break
+        start = max(start + 1, end - overlap_sentences)
+
+    return windows
+
+
+def aggregate_similarities(similarities, aggregation: Literal['max', 'top_n_mean'] = 'max', top_n: int = 2):
+    """
+    Aggregate a (candidates x windows) similarity matrix into one
+    similarity per candidate: the max over windows, or the mean of the
+    top_n windows.
+    """
+    import numpy as np
+
+    if aggregation == 'max' or similarities.shape[1] <= 1:
+        return similarities.max(axis=1)
+
+    n = min(top_n, similarities.shape[1])
+    return np.sort(similarities, axis=1)[:, -n:].mean(axis=1)
 
 
 def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
@@ -143,3 +267,63 @@ def filter_by_vector_similarity(
         if similarity >= similarity_threshold:
             matching_content.append(embedding.content)
     return matching_content
+
+
+def select_by_mmr(
+    embeddings: List[Embedding],
+    text_passage_embeddings: List[List[float]],
+    similarity_threshold: float = 0.60,
+    token_budget: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+    mmr_lambda: float = 0.7,
+    aggregation: Literal['max', 'top_n_mean'] = 'max',
+    top_n: int = 2
+) -> List[str]:
+    """
+    Return content of embeddings with cosine similarity to the text
+    passage of at least similarity_threshold, selected by maximal
+    marginal relevance (MMR), until token_budget (if given) is filled.
+
+    text_passage_embeddings are the embeddings of the passage's windows
+    (see split_into_windows), whose similarities to each candidate are
+    aggregated by aggregate_similarities.
+
+    Each step selects the candidate maximizing
+    mmr_lambda * (similarity to passage)
+    - (1 - mmr_lambda) * (max similarity to already selected content),
+    so near-duplicates of selected content are passed over in favor of
+    other relevant content. Candidates that don't fit in the remaining
+    budget are skipped.
+    """
+    import numpy as np
+
+    if not embeddings or not len(text_passage_embeddings):
+        return []
+
+    vectors = np.array([e.embedding for e in embeddings], dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    queries = np.array(text_passage_embeddings, dtype=np.float32).reshape(-1, vectors.shape[1])
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    relevance = aggregate_similarities(vectors @ queries.T, aggregation, top_n)
+    candidates = [int(i) for i in np.flatnonzero(relevance >= similarity_threshold)]
+    redundancy = np.zeros(len(embeddings), dtype=np.float32)
+
+    selected: List[str] = []
+    remaining_budget = token_budget
+
+    while candidates:
+        scores = mmr_lambda * relevance[candidates] - (1 - mmr_lambda) * redundancy[candidates]
+        best = candidates.pop(int(np.argmax(scores)))
+        content = embeddings[best].content
+
+        if remaining_budget is not None and count_tokens is not None:
+            tokens = count_tokens(content)
+            if tokens > remaining_budget:
+                continue
+            remaining_budget -= tokens
+
+        selected.append(content)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+
+    return selected
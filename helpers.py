@@ -3,7 +3,7 @@ import json
 import logging
 from pathlib import Path
 import re
-from typing import Union
+from typing import Optional, Union
 
 from models import TextFileFormat
 
@@ -61,6 +61,18 @@ def count_token_length(text: str, model: str = "gpt-4o", encoding: str = "cl100k
         enc = tiktoken.get_encoding(encoding)
     return len(enc.encode(text))
 
+def get_last_tokens(text: str, max_tokens: int, model: str = "gpt-4o", encoding: str = "cl100k_base") -> str:
+    """
+    Return the end of text, up to max_tokens tokens long.
+    """
+    import tiktoken
+    try:
+        enc = tiktoken.encoding_for_model(model)
+    except:
+        enc = tiktoken.get_encoding(encoding)
+    tokens = enc.encode(text)
+    return enc.decode(tokens[-max_tokens:]) if len(tokens) > max_tokens else text
+
 def compute_hash(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
@@ -79,3 +91,48 @@ def clean_response(response: str, original_text: str = ""):
         cleaned = re.sub(r'\s*```$', '', cleaned)
 
     return cleaned
+
+LEADING_PROSE_PATTERN = r"^\s*(?:Here(?:'s| is| are)\b|Sure\b|Certainly\b|Of course\b|Below is\b|I(?:'ve| have) (?:edited|corrected|made|reviewed)\b)"
+
+MARKDOWN_HEADING_PATTERN = r'^#{1,6} '
+
+def find_output_violation(output_text: str, original_text: str, max_length_ratio: float = 2.0) -> Optional[str]:
+    """
+    Check model output, complete or partial (e.g., while streaming),
+    against invariants that no continuation can repair: no leading
+    commentary (e.g., "Here is the edited text:"), length within
+    max_length_ratio of the original's, and no Markdown code fences or
+    headings where the original has none.
+
+    Returns:
+        description of the first violation found, or None
+    """
+    if re.match(LEADING_PROSE_PATTERN, output_text, flags=re.IGNORECASE) and not re.match(LEADING_PROSE_PATTERN, original_text, flags=re.IGNORECASE):
+        return "leading commentary"
+
+    original_length = len(original_text.strip())
+    if original_length and len(output_text.strip()) / original_length > max_length_ratio:
+        return f"longer than {max_length_ratio}x the original"
+
+    if '```' in output_text and '```' not in original_text:
+        return "Markdown code fence"
+
+    if re.search(MARKDOWN_HEADING_PATTERN, output_text, flags=re.MULTILINE) and not re.search(MARKDOWN_HEADING_PATTERN, original_text, flags=re.MULTILINE):
+        return "Markdown heading"
+
+    return None
+
+def validate_edited_text(edited_text: str, original_text: str, min_length_ratio: float = 0.5, max_length_ratio: float = 2.0) -> bool:
+    """
+    Cheap sanity checks on edited text returned by the model: that it
+    isn't empty or shorter than min_length_ratio of the original, and
+    has none of the violations checked by find_output_violation.
+    """
+    if not edited_text.strip():
+        return False
+
+    original_length = len(original_text.strip())
+    if original_length and len(edited_text.strip()) / original_length < min_length_ratio:
+        return False
+
+    return find_output_violation(edited_text, original_text, max_length_ratio) is None
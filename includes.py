@@ -0,0 +1,141 @@
+import logging
+from pathlib import Path
+import re
+from typing import Dict, List, Optional, Set
+
+from helpers import get_text_file_content
+from masking import is_prose_free
+
+
+logger = logging.getLogger(__name__)
+
+INCLUDE_DIRECTIVE_PATTERN = re.compile(r'^include::([^\[\s][^\[]*)\[[^\]]*\]\s*$')
+
+ATTRIBUTE_ENTRY_PATTERN = re.compile(r'^:([\w-]+):[ \t]*(.*?)\s*$')
+
+ATTRIBUTE_REFERENCE_PATTERN = re.compile(r'\{([\w-]+)\}')
+
+COMMENT_BLOCK_DELIMITER_PATTERN = re.compile(r'^/{4,}$')
+
+INCLUDABLE_FILE_EXT = [".adoc", ".asciidoc"]
+
+
+def find_include_targets(filepath: Path, text: str, attributes: Optional[Dict[str, str]] = None) -> List[Path]:
+    """
+    Return the AsciiDoc files included by the include directives in text
+    (the content of filepath), in order, resolved relative to filepath's
+    directory.
+
+    Attribute references in targets (e.g., {includedir}) are resolved
+    from attributes and the attribute entries above the directive, which
+    are added to attributes (so they can be passed on to the included
+    files). Directives in comment blocks, or with unresolved attributes
+    or URL targets, are skipped, as are includes of other kinds of files
+    (e.g., code listings).
+    """
+    attributes = attributes if attributes is not None else {}
+    targets: List[Path] = []
+    in_comment_block = False
+
+    for line in text.splitlines():
+        stripped = line.strip()
+
+        if COMMENT_BLOCK_DELIMITER_PATTERN.match(stripped):
+            in_comment_block = not in_comment_block
+            continue
+        if in_comment_block:
+            continue
+
+        if match := ATTRIBUTE_ENTRY_PATTERN.match(stripped):
+            attributes[match.group(1)] = match.group(2)
+            continue
+
+        if not (match := INCLUDE_DIRECTIVE_PATTERN.match(stripped)):
+            continue
+
+        target = ATTRIBUTE_REFERENCE_PATTERN.sub(lambda m: attributes.get(m.group(1), m.group()), match.group(1).strip())
+
+        if ATTRIBUTE_REFERENCE_PATTERN.search(target) or '://' in target:
+            logger.debug(f"Skipping unresolved include target in {filepath}: {target}")
+            continue
+
+        target_path = Path(target)
+        if target_path.suffix.lower() in INCLUDABLE_FILE_EXT:
+            targets.append(target_path if target_path.is_absolute() else filepath.parent / target_path)
+
+    return targets
+
+
+class IncludeGraph:
+    """
+    The input files of a project and the AsciiDoc files they include,
+    directly or indirectly.
+
+    filepaths lists each physical file once, in order: each input file
+    followed by the files it includes (depth first), skipping files
+    already listed (e.g., fragments included by several chapters, or
+    both listed as input and included).
+    """
+    def __init__(self):
+        self.filepaths: List[Path] = []
+        self.includes: Dict[Path, List[Path]] = {}
+        self.included_by: Dict[Path, List[Path]] = {}
+        self._seen: Set[Path] = set()
+
+    @property
+    def fragments(self) -> List[Path]:
+        """
+        Files included by other files, in order.
+        """
+        return [f for f in self.filepaths if self.included_by.get(f.resolve())]
+
+    @property
+    def prose_free_fragments(self) -> List[Path]:
+        """
+        Fragments with no prose to edit (e.g., only attribute entries or
+        code listings).
+        """
+        prose_free_fragments = []
+        for filepath in self.fragments:
+            try:
+                if is_prose_free(get_text_file_content(filepath)):
+                    prose_free_fragments.append(filepath)
+            except (OSError, UnicodeDecodeError):
+                pass # reported when the file is read for editing
+        return prose_free_fragments
+
+    def add(self, filepath: Path, attributes: Optional[Dict[str, str]] = None):
+        resolved_path = filepath.resolve()
+        if resolved_path in self._seen:
+            return
+        self._seen.add(resolved_path)
+        self.filepaths.append(filepath)
+
+        try:
+            text = get_text_file_content(filepath)
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning(f"Unable to read {filepath} for include directives: {e}")
+            return
+
+        # included files inherit the attributes set in the including file
+        attributes = dict(attributes or {})
+        targets = find_include_targets(filepath, text, attributes)
+        self.includes[resolved_path] = [t.resolve() for t in targets]
+
+        for target in targets:
+            if not target.is_file():
+                logger.warning(f"Included file not found: {target} (included by {filepath})")
+                continue
+            self.included_by.setdefault(target.resolve(), []).append(resolved_path)
+            self.add(target, attributes)
+
+
+def build_include_graph(filepaths: List[Path]) -> IncludeGraph:
+    """
+    Build the include graph of filepaths (see IncludeGraph), keeping
+    their order.
+    """
+    graph = IncludeGraph()
+    for filepath in filepaths:
+        graph.add(Path(filepath))
+    return graph
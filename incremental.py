@@ -0,0 +1,103 @@
+import logging
+from pathlib import Path
+import subprocess
+from typing import Dict, List, Optional, Set, Union
+
+from helpers import compute_hash
+from models import TextBlock, TextFile
+
+
+logger = logging.getLogger(__name__)
+
+
+def find_latest_backup(directory: Union[str, Path]) -> Optional[Path]:
+    """
+    Return the most recent backup_<timestamp>.json file in directory, if any.
+    """
+    backups = sorted(
+        Path(directory).glob('backup_*.json'),
+        key=lambda p: int(p.stem.split('_', 1)[1]) if p.stem.split('_', 1)[1].isdigit() else -1
+    )
+    return backups[-1] if backups else None
+
+
+def get_final_content(text_block: TextBlock) -> str:
+    return text_block.ai_qaed_content or text_block.ai_edited_content or text_block.original_content
+
+
+def apply_previous_edits(text_blocks: List[TextBlock], previous_text_files: List[TextFile]) -> int:
+    """
+    Reuse the edit state of blocks from a previous run.
+
+    A block matches a previous block if it has the same block ID (i.e.,
+    same file, section, and content) and the same original content. A
+    block whose content matches the final content of a previous block
+    (e.g., because the previous run's edits were written back to the
+    file) is marked as edited and QAed, with no changes.
+
+    Returns:
+        number of blocks reused
+    """
+    previous_blocks_by_id: Dict[str, TextBlock] = {}
+    previous_blocks_by_final_hash: Dict[str, TextBlock] = {}
+
+    for previous_text_file in previous_text_files:
+        for previous_block in previous_text_file.text_blocks:
+            previous_blocks_by_id[previous_block.block_id] = previous_block
+            if previous_block.is_edited:
+                previous_blocks_by_final_hash[compute_hash(get_final_content(previous_block).strip())] = previous_block
+
+    num_reused = 0
+
+    for text_block in text_blocks:
+        previous_block = previous_blocks_by_id.get(text_block.block_id)
+
+        if previous_block and previous_block.original_content == text_block.original_content:
+            text_block.ai_edited_content = previous_block.ai_edited_content
+            text_block.ai_qaed_content = previous_block.ai_qaed_content
+            text_block.is_edited = previous_block.is_edited
+            text_block.is_qaed = previous_block.is_qaed
+            num_reused += 1
+            continue
+
+        if compute_hash(text_block.original_content.strip()) in previous_blocks_by_final_hash:
+            text_block.ai_edited_content = text_block.original_content
+            text_block.is_edited = True
+            text_block.is_qaed = True
+            num_reused += 1
+
+    return num_reused
+
+
+def get_files_changed_since(ref: str, filepaths: List[Path]) -> Set[Path]:
+    """
+    Return those of filepaths that have changed since git ref (including
+    uncommitted changes), or that are untracked.
+    """
+    filepaths = [Path(fp).resolve() for fp in filepaths]
+    if not filepaths:
+        return set()
+
+    repo_dir = filepaths[0].parent
+
+    try:
+        repo_root = Path(subprocess.run(
+            ['git', '-C', str(repo_dir), 'rev-parse', '--show-toplevel'],
+            check=True, capture_output=True, text=True
+        ).stdout.strip())
+
+        changed = subprocess.run(
+            ['git', '-C', str(repo_root), 'diff', '--name-only', ref, '--'] + [str(fp) for fp in filepaths],
+            check=True, capture_output=True, text=True
+        ).stdout.splitlines()
+
+        untracked = subprocess.run(
+            ['git', '-C', str(repo_root), 'ls-files', '--others', '--exclude-standard', '--'] + [str(fp) for fp in filepaths],
+            check=True, capture_output=True, text=True
+        ).stdout.splitlines()
+    except subprocess.CalledProcessError as e:
+        raise ValueError(f"Unable to compare files with git ref '{ref}': {e.stderr.strip()}")
+
+    changed_paths = {(repo_root / p).resolve() for p in changed + untracked}
+
+    return {fp for fp in filepaths if fp in changed_paths}
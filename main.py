@@ -4,16 +4,35 @@ import logging
 import os
 from pathlib import Path
 import sys
+import threading
 import time
-from typing import List, Union
-
-from ai_service import AIServiceCaller
-from embeddings import check_and_update_embedding_items
-from helpers import clean_response, get_text_file_content, get_json_file_content, write_text_to_file
-from models import AsciiFile, load_style_guide
-from prompts import ASCII_QA_PROMPT_BASE_TEXT, COPYEDIT_PROMPT_BASE_TEXT, GLOBAL_REVIEW_PROMPT_BASE_TEXT, generate_prompt_text, generate_style_guide_text
-from read_files import read_files
-from write_files import write_files
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from ai_service import RateLimiter, ResponseCache
+from batch import BatchManifest, load_batch_manifest
+from consistency import ConsistencyAnalyzer, format_findings
+from edit_memory import record_text_files
+from embedding_backends import EMBEDDING_BACKEND_NAMES
+from helpers import write_text_to_file
+from includes import build_include_graph
+from incremental import find_latest_backup, get_files_changed_since
+from models import AsciiFile, ContextPolicy, TextFile
+from passes import SUPPORTED_MODELS, PassContext, edit_text_file, get_context_policy, load_pass_context, qa_text_block, review_text_file, summarize_prompt_stats
+from pipeline import is_text_file_complete, run_pipeline
+from providers import ProviderConfig, get_provider_api_key, load_provider_config
+from read_files import ParseCache, read_files
+from routing import ModelRouter, load_routing_table
+from scheduler import (
+    DEFAULT_AUTOTUNE_FILENAME,
+    Autotuner,
+    estimate_block_cost,
+    estimate_file_cost,
+    load_tuned_settings,
+    order_longest_first,
+    run_concurrently
+)
+from streaming import run_streaming
+from write_files import make_file_diff, write_files, write_patch
 
 
 # config root logger
@@ -25,6 +44,8 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("openai").setLevel(logging.WARNING)
 
+logger = logging.getLogger(__name__)
+
 SUPPORTED_FILE_EXT = [".adoc", ".asciidoc"]
 
 def read_json_file_list(filepath: Path) -> list[Path]:
@@ -127,6 +148,44 @@ def write_backup_to_json_file(input_data: list[AsciiFile], output_filepath: Unio
         json.dump([i.model_dump(mode="json") for i in input_data], f)
 
 
+def write_global_review_notes(global_issues: List[Tuple[Path, str]], output_filepath: Union[str, Path], consistency_notes: Optional[str] = None):
+    """
+    Write global review notes for each file, and any book-wide
+    consistency notes, to a Markdown file.
+    """
+    if consistency_notes:
+        global_issues = global_issues + [("Book-wide consistency", consistency_notes)]
+
+    if global_issues:
+        global_issues_str = '\n\n'.join([f"## {f}\n\n{i}" for f, i in global_issues])
+        write_text_to_file(output_filepath, global_issues_str)
+        click.echo(f"Global review notes written to {output_filepath}...")
+    else:
+        click.echo("No global issues noted. Global review notes not written to file.")
+
+
+def analyze_project_consistency(pass_context: PassContext, text_files: List[TextFile]) -> Optional[str]:
+    """
+    Run the local consistency analyzer over all files, if enabled.
+
+    Returns:
+        consistency notes, or None if disabled or nothing was found
+    """
+    if not pass_context.local_consistency:
+        return None
+
+    click.echo("Checking consistency across files...")
+    analyzer = ConsistencyAnalyzer(
+        pass_context.global_style_guide,
+        pass_context.word_list_embeddings,
+        pass_context.embedding_backend
+    )
+    findings = analyzer.analyze(text_files)
+    click.echo(f"{len(findings)} consistency issues found...")
+
+    return format_findings(findings) or None
+
+
 def read_backup_from_json_file(input_filepath: Union[str, Path]) -> List[AsciiFile]:
     """ 
     Read JSON file and and validate data as AsciiFile model data.
@@ -136,65 +195,73 @@ def read_backup_from_json_file(input_filepath: Union[str, Path]) -> List[AsciiFi
         return [AsciiFile.model_validate(fd) for fd in file_data]
     
 
-@click.command(help="""
-Provide one of the following:
-(1) path to a directory containing Asciidoc files,
-(2) space-delimited paths to such files,
-(3) path to a JSON file with a 'files' list of such files.
-""")
-@click.version_option(version='1.0.0')
-@click.argument("input_paths", nargs=-1)
-@click.option("--load-data-from-json", "-l", default=None, help="Provide the path to an optional JSON file of data backed up from a previous session. Useful for continuing your progress after a session is interrupted, without having to send all data back to the AI service. NOTE: Do not use this option if you've made changes in the repo since the backup file was produced, as it may overwrite your changes.")
-@click.option("--disable-qa-pass", "-q", is_flag=True, help="Disable QA pass of AI service calls designed to clean up any formatting errors introduced by the model. Model tends sporadically to convert some AsciiDoc formatting to Markdown during editing pass, likely due to large and complex prompting.")
-@click.option(
-    "--model", "-m",
-    type=click.Choice(["gpt-4o", "gpt-4.1", "o3"], case_sensitive=True),
-    default="gpt-4o",
-    help="Select your voice of AI model (default: gpt-4o)."
-)
-def cli(input_paths, load_data_from_json=None, disable_qa_pass=False, model="gpt-4o"):
-    """Script for using AI to edit documents in alignment with an editorial stylesheet."""    
-    
-    if not input_paths:
-        click.echo("`input_paths` argument is required. Exiting.")
-        sys.exit(1)
+def add_included_files(filepaths: List[Path]) -> List[Path]:
+    """
+    Add the files that filepaths include, each physical file once, after
+    the first file including it, leaving out included files with no
+    prose (e.g., attribute definitions), which have nothing to edit.
+    """
+    include_graph = build_include_graph(filepaths)
+    filepaths = include_graph.filepaths
 
-    chapter_filepaths = resolve_input_paths(input_paths)  
-    project_dir = chapter_filepaths[0].parent
-    cwd = Path(os.getcwd())
-    style_guide_dir = Path(cwd / 'style_guides')
-    backup_data_filepath = Path(cwd / f"{'backup_' + str(int(time.time())) + '.json'}")
-    word_list_filepath = Path(style_guide_dir / 'wordlist.txt')
-    word_list_w_embeddings_filepath = Path(style_guide_dir / 'wordlist_w_embeddings.npz')
-    local_style_rules_filepath = Path(style_guide_dir / 'style_guide_local.json')
-    local_style_rules_w_embeddings_filepath = Path(style_guide_dir / 'style_local_w_embeddings.npz')
-    global_style_rules_filepath = Path(style_guide_dir / 'style_guide_global.json')
-    global_review_output_filepath = Path(cwd / f"{'global_review_' + str(int(time.time())) + '.md'}")
+    if fragments := include_graph.fragments:
+        click.echo(f"Found {len(fragments)} included files, each to be processed once, in its own source file...")
 
-    embedding_model = 'BAAI/bge-small-en-v1.5'
+    if prose_free_fragments := {f.resolve() for f in include_graph.prose_free_fragments}:
+        click.echo(f"Skipping {len(prose_free_fragments)} included files with no prose...")
+        filepaths = [f for f in filepaths if f.resolve() not in prose_free_fragments]
 
-    # handle user model selection
-    supported_models = ["gpt-4o", "gpt-4.1", "o3"]
-    
-    if model not in supported_models:
-        click.echo(f"Model {model} is not among supported models: {supported_models}. Exiting.")
-        sys.exit(1)
-    
-    max_token_dict = {
-        'gpt-4o': { 'editing': 20000, 'qa': 10000, 'global_review': 100000 },
-        'gpt-4.1': { 'editing': 20000, 'qa': 10000, 'global_review': 100000 },
-        'o3': { 'editing': 20000, 'qa': 10000, 'global_review': 100000 }
-    }
+    return filepaths
+
+
+def run_project(
+    input_paths: List[str],
+    get_pass_context: Callable[[], PassContext],
+    output_dir: Union[str, Path],
+    model: str = "gpt-4o",
+    load_data_from_json: Optional[str] = None,
+    disable_qa_pass: bool = False,
+    pipeline: bool = False,
+    pipeline_queue_size: int = 8,
+    incremental: bool = False,
+    previous_state: Optional[str] = None,
+    since: Optional[str] = None,
+    streaming: bool = False,
+    streaming_window: int = 4,
+    state_dir: Optional[str] = None,
+    block_tokens: int = 1500,
+    concurrency: Union[int, Autotuner] = 1,
+    emit_patch: Optional[str] = None,
+    yes: bool = False,
+    parse_cache: Optional[ParseCache] = None
+) -> Optional[bool]:
+    """
+    Edit, QA, and review the files of one project, and write the edited
+    text back (or to a patch, with emit_patch). Backups, global review
+    notes, and streaming state are written to output_dir.
 
-    max_tokens_editing = max_token_dict[model]['editing']
-    max_tokens_qa = max_token_dict[model]['qa']
-    max_tokens_global_review = max_token_dict[model]['global_review']
+    get_pass_context is called once the files to process are known, so
+    the pass context can be loaded lazily (or shared across projects).
+    Likewise, parse_cache can be shared across projects.
+
+    Files included by the input files (e.g., shared fragments) are
+    processed along with them, each once.
+
+    Returns:
+        True if all files were processed, False if not, or None if the
+        run was cancelled or there was nothing to process
+    """
+    chapter_filepaths = resolve_input_paths(input_paths)  
+    project_dir = chapter_filepaths[0].parent
+    output_dir = Path(output_dir)
+    backup_data_filepath = Path(output_dir / f"{'backup_' + str(int(time.time())) + '.json'}")
+    global_review_output_filepath = Path(output_dir / f"{'global_review_' + str(int(time.time())) + '.md'}")
 
     # look for JSON filelist for sorting chapter files
     speculative_atlas_json_filepath = Path(project_dir / "atlas.json")
     atlas_filepaths = None
 
-    if speculative_atlas_json_filepath.exists:
+    if speculative_atlas_json_filepath.exists():
         atlas_filepaths = read_json_file_list(speculative_atlas_json_filepath)
 
     # validate load file
@@ -207,13 +274,76 @@ def cli(input_paths, load_data_from_json=None, disable_qa_pass=False, model="gpt
     # sort by filelist or alpha
     sorted_filepaths = sort_chapter_files_by_json_file_list(chapter_filepaths, atlas_filepaths)
 
+    sorted_filepaths = add_included_files(sorted_filepaths)
+
+    # limit to files changed since git ref
+    if since:
+        changed_filepaths = get_files_changed_since(since, sorted_filepaths)
+        sorted_filepaths = [f for f in sorted_filepaths if f.resolve() in changed_filepaths]
+
+        if not sorted_filepaths:
+            click.echo(f"No files changed since {since}.")
+            return None
+
+    # load previous run state for reuse of edits
+    previous_text_files = None
+
+    if (incremental or previous_state) and not streaming:
+        previous_state_filepath = Path(previous_state) if previous_state else find_latest_backup(output_dir)
+
+        if previous_state_filepath:
+            click.echo(f"Reusing edits from previous run state in {previous_state_filepath}...")
+            previous_text_files = read_backup_from_json_file(previous_state_filepath)
+        else:
+            click.echo("No previous run state found. Processing all text passages...")
+
     filelist_str = '\n'.join([str(f) for f in sorted_filepaths])
 
     click.echo(f"Files to be processed include:\n{filelist_str}")
     
-    if not click.prompt("Do you wish to continue? (y/n)").strip().lower() in ['y', 'yes']:
+    if not yes and not click.prompt("Do you wish to continue? (y/n)").strip().lower() in ['y', 'yes']:
         click.echo("Exiting.")
-        sys.exit(0)
+        return None
+
+    pass_context = get_pass_context()
+
+    # diffs of edited files by file index, with --emit-patch
+    file_diffs = {}
+
+    def write_text_file(text_file):
+        if emit_patch:
+            file_diffs[text_file.index] = make_file_diff(text_file, project_dir)
+        else:
+            write_files([text_file])
+
+    def finish_writing():
+        if emit_patch:
+            write_patch([file_diffs[i] for i in sorted(file_diffs)], emit_patch)
+            click.echo(f"Patch of {sum(1 for d in file_diffs.values() if d)} changed files written to {emit_patch}...")
+
+    if streaming:
+        state_dir = Path(state_dir) if state_dir else Path(output_dir / 'state')
+        click.echo(f"\nProcessing files {streaming_window} at a time, saving state to {state_dir}...\n")
+
+        incomplete_filepaths = run_streaming(
+            pass_context,
+            sorted_filepaths,
+            model,
+            state_dir,
+            write_text_file=write_text_file,
+            review_notes_filepath=global_review_output_filepath,
+            base_dir=project_dir,
+            disable_qa_pass=disable_qa_pass,
+            window_size=streaming_window,
+            max_tokens_per_block=block_tokens
+        )
+
+        if global_review_output_filepath.exists():
+            click.echo(f"Global review notes written to {global_review_output_filepath}...")
+        if incomplete_filepaths:
+            click.echo(f"Unable to update {len(incomplete_filepaths)} source files: editing or QA pass not completed. Rerun with --streaming to resume.")
+        finish_writing()
+        return not incomplete_filepaths
 
     if json_input_path:
         # load from JSON file
@@ -227,95 +357,79 @@ def cli(input_paths, load_data_from_json=None, disable_qa_pass=False, model="gpt
 
         # collect text file data
         click.echo("\nExtracting data from text files...\n")
-        all_text_files: List[AsciiFile] = read_files(sorted_filepaths, model)
+        all_text_files: List[AsciiFile] = read_files(sorted_filepaths, model, base_dir=project_dir, previous_text_files=previous_text_files, max_tokens_per_block=block_tokens, parse_cache=parse_cache)
 
         write_backup_to_json_file(all_text_files, backup_data_filepath)
         click.echo(f"\nText files data backed up to {backup_data_filepath}...\n")
 
-    ai_service_caller = AIServiceCaller(st_embedding_model=embedding_model)
-
-    click.echo("Loading word list embeddings...")
-
-    word_list = get_text_file_content(word_list_filepath).split('\n')
-
-    local_style_guide = load_style_guide(local_style_rules_filepath)
-    global_style_guide = load_style_guide(global_style_rules_filepath)
+    backup_lock = threading.Lock()
 
-    word_list_embeddings = check_and_update_embedding_items(word_list, word_list_w_embeddings_filepath, embedding_model, ai_service_caller.generate_st_embedding)
-
-    local_styles_list = [r["content"] for i in get_json_file_content(local_style_rules_filepath).get('categories', []) for r in i["rules"]]
+    def backup():
+        with backup_lock:
+            write_backup_to_json_file(all_text_files, backup_data_filepath)
+        click.echo(f"\nText files data backed up to {backup_data_filepath}...\n")
 
-    local_style_embeddings = check_and_update_embedding_items(local_styles_list, local_style_rules_w_embeddings_filepath, embedding_model, ai_service_caller.generate_st_embedding)
+    if pipeline:
+        click.echo("Sending text passages to AI service for copyediting, QA, and global review as a pipeline...")
+
+        global_issues = run_pipeline(
+            pass_context,
+            all_text_files,
+            checkpoint=backup,
+            write_text_file=write_text_file,
+            disable_qa_pass=disable_qa_pass,
+            queue_size=pipeline_queue_size
+        )
+
+        consistency_notes = analyze_project_consistency(pass_context, all_text_files)
+        write_global_review_notes(global_issues, global_review_output_filepath, consistency_notes)
+        if prompt_stats_summary := summarize_prompt_stats(all_text_files):
+            click.echo(prompt_stats_summary)
+        if pass_context.edit_memory:
+            record_text_files(pass_context.edit_memory, all_text_files, disable_qa_pass)
+        finish_writing()
+        return all(is_text_file_complete(f, disable_qa_pass) for f in all_text_files)
 
     click.echo("Sending text passages to AI service for copyediting...")
 
-    num_text_blocks = len([tb for f in all_text_files for tb in f.text_blocks])
-    block_counter = 0
-
-    # send text to AI service for block-level copyediting
-    for i, text_file in enumerate(all_text_files):
-        preceding_text_block = ""
-        for text_block in text_file.text_blocks:
-            block_counter += 1
-            base_msg = f"text passage {block_counter} of {num_text_blocks} passages (file {i+1} of {len(all_text_files)})"
-
-            if text_block.is_edited or text_block.ai_edited_content:
-                click.echo(f"Skipping {base_msg} (already edited)...")
-                continue
-
-            click.echo(f"Sending {base_msg} for editing...")
-            
-            original_content = text_block.original_content
-
-            deterministically_matched_local_style_rules = local_style_guide.get_matching_rule_contents(original_content, 'asciidoc')
-
-            local_style_guide_text = generate_style_guide_text(
-                text_passage=original_content,
-                word_list_embeddings=(word_list_embeddings if word_list_embeddings else None),
-                local_style_rules_embeddings=(local_style_embeddings if local_style_embeddings else None),
-                embed_function=ai_service_caller.generate_st_embedding,
-                other_style_rules_to_inject=(deterministically_matched_local_style_rules if deterministically_matched_local_style_rules else None)
-            )
-
-            prompt_text = generate_prompt_text(
-                prompt_template=COPYEDIT_PROMPT_BASE_TEXT,
-                model=model,
-                max_tokens_per_prompt=max_tokens_editing,
-                template_kwargs={
-                    "style_guide": local_style_guide_text,
-                    "preceding_passage": preceding_text_block,
-                    "format_type": 'asciidoc',
-                    "passage_to_be_edited": original_content,
-                }
-            )
+    # send text to AI service for block-level copyediting, longest files first
+    # (blocks within a file are edited in order, each following the previous edited block,
+    # unless the file's context is taken from the original text, in which case they're edited concurrently)
+    def edit_file(text_file, block_concurrency=1):
+        click.echo(f"Editing file {text_file.index+1} of {len(all_text_files)}...")
+        edit_text_file(
+            pass_context,
+            text_file,
+            on_block_done=lambda text_block, changed: backup() if changed else None,
+            concurrency=block_concurrency
+        )
 
-            if not prompt_text:
-                click.echo("Unable to generate prompt text. Skipping...")
-                continue
+    ordered_text_files = order_longest_first(all_text_files, lambda f: estimate_file_cost(f, model))
 
-            prompt = ai_service_caller.create_prompt_object(prompt_text)
-            edited_text = ai_service_caller.call_ai_service(prompt)
+    # schedule by each file's own policy, which resumed runs take from the file's state
+    context_sources = {f.index: get_context_policy(pass_context, f).source for f in all_text_files}
 
-            if edited_text:
-                edited_text = clean_response(edited_text, text_block.original_content)
+    # files whose blocks are edited concurrently, one file at a time
+    for text_file in ordered_text_files:
+        if context_sources[text_file.index] == 'original':
+            edit_file(text_file, concurrency)
 
-                text_block.ai_edited_content = edited_text
-                text_block.is_edited = True
+    # files whose blocks are edited in order, several files at a time
+    run_concurrently([f for f in ordered_text_files if context_sources[f.index] != 'original'], edit_file, concurrency)
 
-            # set preceding block for next block
-            preceding_text_block = edited_text or text_block.original_content
+    if prompt_stats_summary := summarize_prompt_stats(all_text_files):
+        click.echo(prompt_stats_summary)
 
-            write_backup_to_json_file(all_text_files, backup_data_filepath)
-            click.echo(f"\nText files data backed up to {backup_data_filepath}...\n")
+    num_text_blocks = len([tb for f in all_text_files for tb in f.text_blocks])
 
-    # if all edited, send original text and edited to AI service for QA
+    # if all edited, send original text and edited to AI service for QA, longest passages first
     if (
         all(b.is_edited for f in all_text_files for b in f.text_blocks)
         and not disable_qa_pass
     ):
         click.echo("Sending edited text to AI service for QA...")
+        qa_items = []
         block_counter = 0
-        no_issue_str = 'NO_ISSUE'
         for i, text_file in enumerate(all_text_files):
             for text_block in text_file.text_blocks:
                 block_counter += 1
@@ -325,96 +439,318 @@ def cli(input_paths, load_data_from_json=None, disable_qa_pass=False, model="gpt
                     click.echo(f"Skipping {base_msg} (already QAed)...")
                     continue
 
-                if text_block.original_content == text_block.ai_edited_content:
-                    click.echo(f"Skipping {base_msg} (no changes in edited text)...")
-                    continue
+                qa_items.append((text_block, base_msg))
 
-                click.echo(f"Sending {base_msg} for QA...")
-                
-                prompt_text = generate_prompt_text(
-                    prompt_template=ASCII_QA_PROMPT_BASE_TEXT,
-                    model=model,
-                    max_tokens_per_prompt=max_tokens_qa,
-                    template_kwargs={
-                        'no_issue_str': no_issue_str,
-                        'original_text': text_block.original_content,
-                        'edited_text': text_block.ai_edited_content
-                    }
-                )
-
-                if not prompt_text:
-                    click.echo("Unable to generate prompt text. Skipping...")
-                    continue
+        def qa_block(item):
+            text_block, base_msg = item
 
-                prompt = ai_service_caller.create_prompt_object(prompt_text)
-                response = ai_service_caller.call_ai_service(prompt)
+            if text_block.original_content == text_block.ai_edited_content:
+                click.echo(f"Skipping {base_msg} (no changes in edited text)...")
+            else:
+                click.echo(f"Sending {base_msg} for QA...")
 
-                if response:
-                    response = clean_response(response, text_block.original_content)
+            qa_text_block(pass_context, text_block)
 
-                    if response.strip().lower() != no_issue_str.lower():
-                        text_block.ai_qaed_content = response
-                    text_block.is_qaed = True
+            backup()
 
-                write_backup_to_json_file(all_text_files, backup_data_filepath)
-                click.echo(f"\nText files data backed up to {backup_data_filepath}...\n")     
+        run_concurrently(
+            order_longest_first(qa_items, lambda item: estimate_block_cost(item[0], model, 'qa')),
+            qa_block,
+            concurrency
+        )
 
     # send chapters to ai service for global review
     if all(b.is_edited and (disable_qa_pass or b.is_qaed) for f in all_text_files for b in f.text_blocks):
         global_issues = []
         click.echo("Sending edited text to AI service for global review...")
-        for i, text_file in enumerate(all_text_files):
-            edited_text = text_file.get_qaed_edited_content()
-            click.echo(f"Sending {i+1} of {len(all_text_files)} text files for global review...")
-            
-            # we can update this to incorporate embedding comparison if/as needed,
-            # but for now all global rules are set to always_insert
-            deterministically_matched_global_style_rules = global_style_guide.get_matching_rule_contents(edited_text, 'asciidoc')
-
-            prompt_text = generate_prompt_text(
-                prompt_template=GLOBAL_REVIEW_PROMPT_BASE_TEXT,
-                model=model,
-                max_tokens_per_prompt=max_tokens_global_review,
-                template_kwargs={
-                    'style_guide': deterministically_matched_global_style_rules,
-                    'no_issue_str': no_issue_str,
-                    'passage_to_be_reviewed': edited_text,
-                }
-            )
 
-            if not prompt_text:
-                click.echo("Unable to generate prompt text. Skipping...")
-                continue
-
-            prompt = ai_service_caller.create_prompt_object(prompt_text)
-            response = ai_service_caller.call_ai_service(prompt)
-
-            if response:
-                response = clean_response(response, text_block.original_content)
-                
-                if response.strip().lower() != no_issue_str.lower():
-                    global_issues.append((text_file.filepath, response))
-                else:
-                    global_issues.append((text_file.filepath, "No issues noted."))
-        if global_issues:
-            # write issues to file
-            global_issues_str = '\n\n'.join([f"## {f}\n\n{i}" for f, i in global_issues])
-            write_text_to_file(global_review_output_filepath, global_issues_str)
-            click.echo(f"Global review notes written to {global_review_output_filepath}...")
-        else:
-            click.echo("No global issues noted. Global review notes not written to file.")
+        def review_file(text_file):
+            click.echo(f"Sending {text_file.index+1} of {len(all_text_files)} text files for global review...")
+
+            review_notes = review_text_file(pass_context, text_file)
+
+            if review_notes:
+                global_issues.append((text_file.index, text_file.filepath, review_notes))
+
+        run_concurrently(
+            order_longest_first(all_text_files, lambda f: estimate_file_cost(f, model, 'global_review')),
+            review_file,
+            concurrency
+        )
+
+        consistency_notes = analyze_project_consistency(pass_context, all_text_files)
+        write_global_review_notes(
+            [(f, notes) for _, f, notes in sorted(global_issues, key=lambda i: i[0])],
+            global_review_output_filepath,
+            consistency_notes
+        )
     else:
         click.echo("Unable to send text to AI service for global review: editing or QA pass not completed.")        
 
     # if all processed and QAed, save edited text to files
     if all(b.is_edited and (disable_qa_pass or b.is_qaed) for f in all_text_files for b in f.text_blocks):
-        click.echo("Writing edited text to source files...")
-        write_files(all_text_files)
+        if pass_context.edit_memory:
+            num_sentences = record_text_files(pass_context.edit_memory, all_text_files, disable_qa_pass)
+            click.echo(f"{num_sentences} sentence edits saved to edit memory...")
+
+        if emit_patch:
+            for text_file in all_text_files:
+                write_text_file(text_file)
+            finish_writing()
+        else:
+            click.echo("Writing edited text to source files...")
+            num_written = write_files(all_text_files)
+            click.echo(f"{num_written} of {len(all_text_files)} files changed...")
+        return True
+
+    click.echo("Unable to update source files: editing or QA pass not completed.")
+    return False
+
+
+def run_batch(
+    manifest: BatchManifest,
+    get_pass_context: Callable[[], PassContext],
+    base_output_dir: Union[str, Path],
+    **kwargs
+) -> Dict[str, Optional[bool]]:
+    """
+    Run each project in manifest (see run_project), in order, with
+    kwargs as defaults for the projects' options. Each project's
+    backups, review notes, state, and patch (with emit_patch, by the
+    same filename) are kept in its output directory. A project that
+    fails is logged, and the batch continues with the next.
+
+    Returns:
+        map of project names to the results of run_project (False for
+        projects that failed)
+    """
+    results: Dict[str, Optional[bool]] = {}
+
+    for i, project in enumerate(manifest.projects):
+        click.echo(f"\nProcessing project {i+1} of {len(manifest.projects)} ({project.name})...\n")
+
+        output_dir = Path(project.output_dir) if project.output_dir else Path(base_output_dir) / 'batch' / project.name
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        overrides = project.model_dump(exclude={'name', 'input_paths', 'output_dir'}, exclude_none=True)
+
+        # keep state and patches of projects apart, in their output directories
+        overrides['state_dir'] = None
+        if kwargs.get('emit_patch') and not project.emit_patch:
+            overrides['emit_patch'] = str(output_dir / Path(kwargs['emit_patch']).name)
+
+        try:
+            results[project.name] = run_project(project.input_paths, get_pass_context, output_dir, **{**kwargs, **overrides})
+        except Exception as e:
+            logger.exception(f"Project {project.name} failed: {e}")
+            results[project.name] = False
+
+    return results
+
+
+@click.command(help="""
+Provide one of the following:
+(1) path to a directory containing Asciidoc files,
+(2) space-delimited paths to such files,
+(3) path to a JSON file with a 'files' list of such files.
+""")
+@click.version_option(version='1.0.0')
+@click.argument("input_paths", nargs=-1)
+@click.option("--batch", "-b", default=None, help="Provide the path to a JSON batch manifest (see batch_manifest.json) to process several projects in one run, sharing the embedding model, style guide, response cache, and rate limits. Can't be combined with `input_paths`.")
+@click.option("--yes", "-y", is_flag=True, help="Don't ask for confirmation before processing files.")
+@click.option("--load-data-from-json", "-l", default=None, help="Provide the path to an optional JSON file of data backed up from a previous session. Useful for continuing your progress after a session is interrupted, without having to send all data back to the AI service. NOTE: Do not use this option if you've made changes in the repo since the backup file was produced, as it may overwrite your changes.")
+@click.option("--disable-qa-pass", "-q", is_flag=True, help="Disable QA pass of AI service calls designed to clean up any formatting errors introduced by the model. Model tends sporadically to convert some AsciiDoc formatting to Markdown during editing pass, likely due to large and complex prompting.")
+@click.option(
+    "--model", "-m",
+    type=click.Choice(["gpt-4o", "gpt-4.1", "o3"], case_sensitive=True),
+    default="gpt-4o",
+    help="Select your voice of AI model (default: gpt-4o)."
+)
+@click.option("--pack-small-blocks", "-p", is_flag=True, help="Combine small adjacent text passages from the same file into a single AI service request during the editing pass. Passages are split back out of the response, falling back to one request per passage if the response can't be split.")
+@click.option("--pack-block-max-tokens", type=int, default=300, show_default=True, help="Max token length of a text passage eligible for packing with --pack-small-blocks.")
+@click.option(
+    "--output-format", "-f",
+    type=click.Choice(["full", "edits"], case_sensitive=True),
+    default="full",
+    help="Response format for the editing and QA passes: 'full' to have the model return the entire rewritten passage, or 'edits' to have it return a list of edits that are applied locally, falling back to a full rewrite for passages where the edits can't be applied (default: full)."
+)
+@click.option("--pipeline", is_flag=True, help="Run the editing, QA, global review, and file-writing stages concurrently, rather than one after another. Each passage is QAed as soon as it's edited, and each file is reviewed and written as soon as all its passages are QAed.")
+@click.option("--pipeline-queue-size", type=int, default=8, show_default=True, help="Max number of passages or files waiting between stages with --pipeline.")
+@click.option("--incremental", "-i", is_flag=True, help="Reuse edits from the most recent backup file in the current directory for text passages that haven't changed, and skip parsing files that haven't changed.")
+@click.option("--previous-state", default=None, help="Provide the path to a backup file from a previous session to reuse edits from, as with --incremental.")
+@click.option("--since", default=None, help="Provide a git ref (e.g., a commit or branch) to process only those files that have changed since that ref.")
+@click.option("--routing-table", "-r", default=None, help="Provide the path to a JSON routing table (e.g., routing_table.json) to select a model per request, based on passage size, share of prose, number of matched style rules, and pass type. Requests whose output fails validation are retried with a stronger model, per the table's escalation map. The model selected with --model is the default for requests matching no rule.")
+@click.option("--hedge-requests", is_flag=True, help="If an AI service call takes longer than the 95th percentile of recent calls, send a duplicate request and use whichever response arrives first. Reduces the impact of occasional very slow responses, at the cost of some extra requests.")
+@click.option("--streaming", is_flag=True, help="Read, process, and write files a few at a time, saving each file's state to its own file in the state directory, rather than loading the whole project into memory. Useful for very large projects. Files written in a previous streaming run and unchanged since are skipped.")
+@click.option("--streaming-window", type=int, default=4, show_default=True, help="Max number of files in memory (and processed concurrently) at once with --streaming.")
+@click.option("--state-dir", default=None, help="Provide the directory in which to save per-file state with --streaming (default: a `state` directory in the current directory).")
+@click.option("--embedding-daemon", is_flag=True, help="Start a background service that keeps the embedding model loaded between runs, if one isn't already running, and use it to generate embeddings. Later runs use a running service automatically, with or without this flag. The service shuts down after 15 minutes without requests.")
+@click.option(
+    "--embedding-backend",
+    type=click.Choice(EMBEDDING_BACKEND_NAMES, case_sensitive=True),
+    default="st",
+    help="Backend for the embeddings used to select the style rules and word list terms relevant to each passage: 'st' for the SentenceTransformer model, 'st-int8' for the same model quantized to int8 (faster on CPU), or 'hashing' for lightweight lexical embeddings that need no model (default: st)."
+)
+@click.option("--embedding-threads", type=int, default=None, help="Number of CPU threads used by the embedding model (default: torch's default).")
+@click.option("--provider-config", default=None, help="Provide the path to a JSON provider config (e.g., provider_config.json) to use an OpenAI-compatible AI service other than OpenAI's, such as a local inference server. Sets the base URL, API key variable, endpoint, timeouts, connection pool, and model names.")
+@click.option("--style-rules-token-budget", type=int, default=1500, show_default=True, help="Max tokens of style rules in each editing prompt. Rules matched deterministically are always included; the remaining budget is filled with the most relevant rules, skipping near-duplicates.")
+@click.option("--word-list-token-budget", type=int, default=500, show_default=True, help="Max tokens of word list terms in each editing prompt, filled with the most relevant terms, skipping near-duplicates.")
+@click.option("--mmr-lambda", type=float, default=0.7, show_default=True, help="Trade-off between relevance (1.0) and diversity (0.0) when selecting style rules and word list terms.")
+@click.option(
+    "--similarity-aggregation",
+    type=click.Choice(["max", "top_n_mean"], case_sensitive=True),
+    default="max",
+    help="How to combine the similarities of a style rule or word list term to the windows of a long passage: the max over windows, or the mean of the top 2 (default: max)."
+)
+@click.option("--concurrency", type=int, default=None, help="Number of concurrent AI service requests in the editing (across files), QA, and global review passes (default: 1, or the value tuned in a previous run with --autotune). Requests are sent longest first.")
+@click.option("--autotune", is_flag=True, help="Adjust concurrency during the run from observed latency, rate limit errors, and tokens-per-minute headroom, and a target passage size for the next run. Tuned settings are saved to autotune.json in the current directory and used as defaults in later runs.")
+@click.option("--max-concurrency", type=int, default=16, show_default=True, help="Max concurrency with --autotune.")
+@click.option("--tokens-per-minute", type=int, default=None, help="Tokens-per-minute limit of your AI service account. Requests are delayed to stay under it (estimated from prompt size), and with --autotune, concurrency is raised only while there's headroom under it.")
+@click.option("--requests-per-minute", type=int, default=None, help="Requests-per-minute limit of your AI service account. Requests are delayed to stay under it.")
+@click.option("--block-tokens", type=int, default=None, help="Target max token length of text passages (default: 1500, or the value tuned in a previous run with --autotune).")
+@click.option("--stream-responses", is_flag=True, help="Stream rewritten passages from the AI service, aborting and retrying responses that start with commentary, run much longer than the original, or add Markdown code fences or headings.")
+@click.option("--emit-patch", type=click.Path(dir_okay=False), default=None, help="Write the edits to a single unified diff at this path, rather than to the source files.")
+@click.option(
+    "--preceding-context",
+    type=click.Choice(["full", "tokens", "sentences", "summary"], case_sensitive=True),
+    default="full",
+    help="Context from the preceding passage included in each editing prompt, for continuity: the 'full' passage, its last 'tokens' or 'sentences' (see --preceding-context-size), or a 'summary' extracted locally of any list left open, acronyms already defined, and the last sentences (default: full)."
+)
+@click.option("--preceding-context-size", type=int, default=None, help="Number of tokens (default: 200) or sentences (default: 3) of preceding context with --preceding-context tokens or sentences.")
+@click.option(
+    "--preceding-context-source",
+    type=click.Choice(["edited", "original"], case_sensitive=True),
+    default="edited",
+    help="Take the preceding context from the 'edited' or 'original' text of the preceding passages. With 'original', the passages of a file don't wait on each other's edits, so are edited concurrently, per --concurrency (default: edited)."
+)
+@click.option("--edit-memory", is_flag=True, help="Memoize the final edits of each sentence in style_guides/.cache/edit_memory.json, and reuse them in later runs (e.g., for later editions, or passages repeated across books): passages whose sentences are all memoized are assembled locally, without the AI service, and for passages partly memoized, only the other sentences are sent. Memoized edits are reused only while the local style guide, word list, and prompts are unchanged.")
+@click.option("--local-consistency", is_flag=True, help="Check consistency across files locally, without the AI service, after the global review: variant spellings, hyphenation, and capitalization of terms (checked against the word list), heading case, and the style rules with consistency checks in the global style guide. Findings are added to the global review notes, and rules fully covered by a check are left out of the global review prompts. Not available with --streaming.")
+def cli(input_paths, load_data_from_json=None, disable_qa_pass=False, model="gpt-4o", pack_small_blocks=False, pack_block_max_tokens=300, output_format="full", pipeline=False, pipeline_queue_size=8, incremental=False, previous_state=None, since=None, routing_table=None, hedge_requests=False, streaming=False, streaming_window=4, state_dir=None, embedding_daemon=False, embedding_backend="st", embedding_threads=None, provider_config=None, style_rules_token_budget=1500, word_list_token_budget=500, mmr_lambda=0.7, similarity_aggregation="max", concurrency=None, autotune=False, max_concurrency=16, tokens_per_minute=None, requests_per_minute=None, block_tokens=None, stream_responses=False, emit_patch=None, preceding_context="full", preceding_context_size=None, preceding_context_source="edited", edit_memory=False, local_consistency=False, batch=None, yes=False):
+    """Script for using AI to edit documents in alignment with an editorial stylesheet."""    
+    
+    if batch and (input_paths or load_data_from_json or previous_state):
+        click.echo("--batch can't be combined with `input_paths`, --load-data-from-json, or --previous-state. Exiting.")
+        sys.exit(1)
+
+    if not input_paths and not batch:
+        click.echo("`input_paths` argument is required. Exiting.")
+        sys.exit(1)
+
+    cwd = Path(os.getcwd())
+    style_guide_dir = Path(cwd / 'style_guides')
+
+    if streaming and (pipeline or load_data_from_json or previous_state or local_consistency):
+        click.echo("--streaming can't be combined with --pipeline, --load-data-from-json, --previous-state, or --local-consistency. Exiting.")
+        sys.exit(1)
+
+    # default concurrency and block size to those tuned in a previous run, if any
+    autotune_filepath = Path(cwd / DEFAULT_AUTOTUNE_FILENAME)
+    tuned_settings = load_tuned_settings(autotune_filepath, model)
+    concurrency = concurrency or tuned_settings.get('concurrency', 1)
+    block_tokens = block_tokens or tuned_settings.get('target_block_tokens', 1500)
+
+    if tuned_settings:
+        click.echo(f"Using settings tuned in a previous run: concurrency {concurrency}, block size {block_tokens} tokens...")
+
+    provider = load_provider_config(provider_config) if provider_config else ProviderConfig()
+
+    # size connection pool to the number of concurrent requests
+    max_requests = streaming_window if streaming else 3 if pipeline else max(concurrency, max_concurrency if autotune else 1)
+    max_requests *= 2 if hedge_requests else 1
+    provider = provider.model_copy(update={'max_connections': max(provider.max_connections, max_requests)})
+
+    try:
+        get_provider_api_key(provider)
+    except EnvironmentError as e:
+        click.echo(f"{e} Exiting.")
+        sys.exit(1)
+
+    # handle user model selection
+    if model not in SUPPORTED_MODELS:
+        click.echo(f"Model {model} is not among supported models: {SUPPORTED_MODELS}. Exiting.")
+        sys.exit(1)
+
+    model_router = ModelRouter(load_routing_table(routing_table), model) if routing_table else None
+
+    autotuner = Autotuner(
+        concurrency=concurrency,
+        max_concurrency=max(concurrency, max_concurrency),
+        target_block_tokens=block_tokens,
+        tokens_per_minute_limit=tokens_per_minute
+    ) if autotune else None
+
+    rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute) if requests_per_minute or tokens_per_minute else None
+
+    # loaded once, on first use, and shared by all projects
+    pass_context = None
+
+    def get_pass_context() -> PassContext:
+        nonlocal pass_context
+        if pass_context is None:
+            pass_context = load_pass_context(
+                style_guide_dir,
+                model,
+                model_router=model_router,
+                hedge_requests=hedge_requests,
+                provider=provider,
+                request_observer=autotuner.observe if autotuner else None,
+                rate_limiter=rate_limiter,
+                response_cache=ResponseCache(),
+                embedding_backend=embedding_backend,
+                start_embedding_daemon=embedding_daemon,
+                embedding_threads=embedding_threads,
+                output_format=output_format,
+                pack_small_blocks=pack_small_blocks,
+                pack_block_max_tokens=pack_block_max_tokens,
+                style_rules_token_budget=style_rules_token_budget,
+                word_list_token_budget=word_list_token_budget,
+                mmr_lambda=mmr_lambda,
+                similarity_aggregation=similarity_aggregation,
+                stream_responses=stream_responses,
+                local_consistency=local_consistency,
+                context_policy=ContextPolicy(mode=preceding_context, size=preceding_context_size, source=preceding_context_source),
+                use_edit_memory=edit_memory
+            )
+        return pass_context
+
+    project_kwargs = dict(
+        model=model,
+        load_data_from_json=load_data_from_json,
+        disable_qa_pass=disable_qa_pass,
+        pipeline=pipeline,
+        pipeline_queue_size=pipeline_queue_size,
+        incremental=incremental,
+        previous_state=previous_state,
+        since=since,
+        streaming=streaming,
+        streaming_window=streaming_window,
+        state_dir=state_dir,
+        block_tokens=block_tokens,
+        concurrency=autotuner or concurrency,
+        emit_patch=emit_patch,
+        yes=yes,
+        parse_cache=ParseCache()
+    )
+
+    if batch:
+        results = run_batch(load_batch_manifest(batch), get_pass_context, cwd, **project_kwargs)
+        failed = [name for name, completed in results.items() if completed is False]
+        if failed:
+            click.echo(f"Projects not completed: {', '.join(failed)}.")
     else:
-        click.echo("Unable to update source files: editing or QA pass not completed.")
+        completed = run_project(input_paths, get_pass_context, cwd, **project_kwargs)
+        if completed is None:
+            sys.exit(0)
+
+    if autotuner:
+        autotuner.save(autotune_filepath, model)
+        click.echo(f"Tuned settings (concurrency {autotuner.concurrency}, block size {autotuner.target_block_tokens} tokens) saved to {autotune_filepath}...")
 
     click.echo("Script complete.")
 
+    if batch and failed:
+        sys.exit(1)
+
 
 if __name__ == '__main__':
-    cli()
\ No newline at end of file
+    cli()
@@ -0,0 +1,124 @@
+import logging
+import re
+from typing import List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# delimiters of listing, literal, passthrough, and comment blocks
+CODE_BLOCK_DELIMITER_PATTERN = re.compile(r'^(-{4,}|\.{4,}|\+{4,}|/{4,})$')
+
+BLOCK_MACRO_PATTERN = re.compile(r'^(image|include|video|audio)::')
+
+# lines with no prose: attributes, anchors, roles/options, comments
+NON_PROSE_LINE_PATTERN = re.compile(r'^(:[\w-]+!?:|\[\[.*\]\]$|\[[^\]]*\]$|//(?!/))')
+
+PLACEHOLDER_PATTERN = re.compile(r'@@CODE-(\d+)@@')
+
+
+def placeholder(n: int) -> str:
+    return f"@@CODE-{n}@@"
+
+
+def find_code_segments(lines: List[str]) -> List[Tuple[int, int]]:
+    """
+    Find line ranges (start, end, exclusive) of code blocks, delimiters
+    included, and block macros.
+
+    An unterminated code block runs to the end of the lines.
+    """
+    segments: List[Tuple[int, int]] = []
+    i = 0
+
+    while i < len(lines):
+        stripped = lines[i].strip()
+
+        if CODE_BLOCK_DELIMITER_PATTERN.match(stripped):
+            end = next((j for j in range(i + 1, len(lines)) if lines[j].strip() == stripped), len(lines) - 1)
+            segments.append((i, end + 1))
+            i = end + 1
+            continue
+
+        if BLOCK_MACRO_PATTERN.match(stripped):
+            segments.append((i, i + 1))
+
+        i += 1
+
+    return segments
+
+
+def is_prose_free(text: str) -> bool:
+    """
+    Check whether text contains no prose: i.e., only code blocks, block
+    macros, attribute/anchor/role lines, comments, and blank lines.
+    """
+    return get_prose_ratio(text) == 0.0
+
+
+def get_prose_ratio(text: str) -> float:
+    """
+    Return the share of non-blank characters in text that are prose
+    (i.e., outside code blocks, block macros, attribute lines, etc.).
+    """
+    lines = text.split('\n')
+    code_lines = {i for start, end in find_code_segments(lines) for i in range(start, end)}
+
+    total_chars = 0
+    prose_chars = 0
+
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        total_chars += len(stripped)
+        if i not in code_lines and stripped and not NON_PROSE_LINE_PATTERN.match(stripped):
+            prose_chars += len(stripped)
+
+    return prose_chars / total_chars if total_chars else 0.0
+
+
+def mask_code(text: str) -> Tuple[str, List[str]]:
+    """
+    Replace code blocks and block macros in text with placeholder lines.
+
+    Returns:
+        tuple of masked text and the list of masked segments, in order
+        (empty if nothing was masked)
+    """
+    if PLACEHOLDER_PATTERN.search(text):
+        # text already contains something that looks like a placeholder
+        return text, []
+
+    lines = text.split('\n')
+    segments = find_code_segments(lines)
+
+    if not segments:
+        return text, []
+
+    masked_lines: List[str] = []
+    masked_segments: List[str] = []
+    cursor = 0
+
+    for n, (start, end) in enumerate(segments, start=1):
+        masked_lines.extend(lines[cursor:start])
+        masked_lines.append(placeholder(n))
+        masked_segments.append('\n'.join(lines[start:end]))
+        cursor = end
+
+    masked_lines.extend(lines[cursor:])
+
+    return '\n'.join(masked_lines), masked_segments
+
+
+def unmask_code(text: str, segments: List[str]) -> Optional[str]:
+    """
+    Restore masked segments into text.
+
+    Returns None if the placeholders were not preserved: i.e., if any
+    is missing, duplicated, or out of order.
+    """
+    found = [int(n) for n in PLACEHOLDER_PATTERN.findall(text)]
+
+    if found != list(range(1, len(segments) + 1)):
+        logger.warning("Code placeholders not preserved in response.")
+        return None
+
+    return PLACEHOLDER_PATTERN.sub(lambda m: segments[int(m.group(1)) - 1], text)
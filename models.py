@@ -6,6 +6,19 @@ from typing import List, Literal, Optional, Union
 
 
 TextFileFormat = Literal["asciidoc"]
+ContextSource = Literal["edited", "original"]
+
+
+class PromptStats(BaseModel):
+    """
+    Token counts of the editing prompt sent for a text block.
+    """
+    prompt_tokens: int
+    style_guide_tokens: int
+    preceding_passage_tokens: int
+    passage_tokens: int
+    num_style_rules: int
+    num_word_list_terms: int
 
 
 class TextBlock(BaseModel):
@@ -17,6 +30,59 @@ class TextBlock(BaseModel):
     ai_qaed_content: str = ''
     is_edited: bool = False
     is_qaed: bool = False
+    prompt_stats: Optional[PromptStats] = None
+    join_with_next: Optional[str] = None # text between this block and the next (or end of file); None for blank line
+
+
+def keep_outer_whitespace(original: str, content: str) -> str:
+    """
+    Return content (e.g., AI output for original) stripped, with the
+    leading and trailing whitespace of original (e.g., the indent of a
+    literal paragraph). Unchanged content is returned as is.
+    """
+    if content == original:
+        return content
+    leading = original[:len(original) - len(original.lstrip())]
+    trailing = original[len(original.rstrip()):] if original.strip() else ''
+    return leading + content.strip() + trailing
+
+
+def join_text_blocks(text_blocks: List[TextBlock], contents: List[str], leading_text: str = '') -> str:
+    """
+    Join contents (one per text block) with the text between the text
+    blocks in the file, keeping the outer whitespace of each block's
+    original content. Blocks read without the text between them (e.g.,
+    from older backups) are separated by a blank line.
+    """
+    parts = [leading_text]
+    for i, (text_block, content) in enumerate(zip(text_blocks, contents)):
+        parts.append(keep_outer_whitespace(text_block.original_content, content))
+        if text_block.join_with_next is not None:
+            parts.append(text_block.join_with_next)
+        elif i < len(text_blocks) - 1:
+            parts.append('\n\n')
+    return ''.join(parts)
+
+
+class ContextPolicy(BaseModel):
+    """
+    What of the preceding text is included in an editing prompt, for
+    continuity:
+    - 'full': the whole preceding block
+    - 'tokens': the last size tokens of the preceding block
+    - 'sentences': the last size sentences of the preceding block
+    - 'summary': a compact summary extracted locally (see
+      preceding_context.py): any list left open, acronyms defined
+      earlier in the file, and the last sentences, for pronoun
+      antecedents
+
+    source is the text the context is taken from: the 'edited' text of
+    the preceding blocks, or their 'original' text, which lets the
+    blocks of a file be edited concurrently.
+    """
+    mode: Literal['full', 'tokens', 'sentences', 'summary'] = 'full'
+    size: Optional[int] = None # default depends on mode
+    source: ContextSource = 'edited'
 
 
 class TextFile(BaseModel):
@@ -24,7 +90,10 @@ class TextFile(BaseModel):
     file_format: TextFileFormat
     id: str
     filepath: Path
+    source_hash: str = '' # hash of file content at time of reading
+    leading_text: str = '' # text before the first block (e.g., blank lines)
     text_blocks: Optional[List[TextBlock]] = []
+    context_policy: Optional[ContextPolicy] = None # recorded when editing starts, so resumed runs keep it
 
     @property
     def is_fully_processed(self):
@@ -53,7 +122,11 @@ class TextFile(BaseModel):
         We fall back to original content if no ai_qaed or ai_edited content,
         because some text blocks may not receive edits.
         """
-        return '\n\n'.join([b.ai_qaed_content or b.ai_edited_content or b.original_content for b in self.text_blocks])
+        return join_text_blocks(
+            self.text_blocks,
+            [b.ai_qaed_content or b.ai_edited_content or b.original_content for b in self.text_blocks],
+            self.leading_text
+        )
 
 
 class AsciiBlock(TextBlock):
@@ -84,11 +157,38 @@ class StyleInsertionCondition(BaseModel):
                 raise InvalidPatternError(pattern, str(e))
         return self
 
+class ConsistencyCheck(BaseModel):
+    """
+    A mechanical check of a style rule, run locally over all files (see
+    consistency.py):
+    - 'consistent': only one of the variants (patterns) should be used
+      across all files, e.g., a.m. or A.M.
+    - 'forbidden': none of the variants should appear
+
+    If covers_rule is True, the check covers the whole rule, which is
+    then left out of the global review prompt.
+    """
+    type: Literal['consistent', 'forbidden']
+    variants: List[str]
+    ignore_case: bool = False
+    covers_rule: bool = True
+
+    @model_validator(mode='after')
+    def validate_variants(self):
+        for pattern in self.variants:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise InvalidPatternError(pattern, str(e))
+        return self
+
+
 class StyleRule(BaseModel):
     content: str
     scope: Literal['local', 'global']
     insertion_conditions: List[StyleInsertionCondition] = []
     always_insert: bool = False
+    consistency_check: Optional[ConsistencyCheck] = None
 
 
 class StyleCategory(BaseModel):
@@ -106,6 +206,7 @@ class StyleGuide(BaseModel):
         self,
         input_text: str,
         file_format: Literal['asciidoc'],
+        exclude_checked_rules: bool = False
     ) -> List[str]:
         """
         Return a list of StyleRule.content values where:
@@ -113,6 +214,9 @@ class StyleGuide(BaseModel):
         2. OR the rule itself has such insertion_conditions
         3. OR category.always_insert is True
         4. OR rule.always_insert is True
+
+        If exclude_checked_rules is True, rules fully covered by a local
+        consistency check are left out.
         """
         matched_rules: List[str] = []
 
@@ -123,6 +227,9 @@ class StyleGuide(BaseModel):
             )
 
             for rule in category.rules:
+                if exclude_checked_rules and rule.consistency_check and rule.consistency_check.covers_rule:
+                    continue
+
                 rule_matches = (
                     rule.always_insert or
                     matches_insertion_conditions(input_text, file_format, rule.insertion_conditions)
@@ -141,6 +248,17 @@ class Embedding(BaseModel):
     model: str
 
 
+class TextEdit(BaseModel):
+    original: str
+    replacement: str
+    context_before: str = ''
+    context_after: str = ''
+
+
+class TextEditList(BaseModel):
+    edits: List[TextEdit] = []
+
+
 def load_style_guide(path: Union[str, Path]) -> StyleGuide:
     with open(str(path), 'r', encoding='utf-8') as f:
         data = json.load(f)
@@ -0,0 +1,124 @@
+import logging
+import re
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+from helpers import count_token_length
+from models import TextBlock
+
+
+logger = logging.getLogger(__name__)
+
+# default token budget for all passages combined in a packed request
+DEFAULT_MAX_PACK_TOKENS = 1500
+
+# default max number of passages in a packed request
+DEFAULT_MAX_PACK_SIZE = 10
+
+
+def passage_begin_marker(tag: str, n: int) -> str:
+    return f"@@PASSAGE-{tag}-{n}-BEGIN@@"
+
+
+def passage_end_marker(tag: str, n: int) -> str:
+    return f"@@PASSAGE-{tag}-{n}-END@@"
+
+
+def group_blocks_for_packing(
+    text_blocks: List[TextBlock],
+    model: str,
+    max_block_tokens: int,
+    max_pack_tokens: int = DEFAULT_MAX_PACK_TOKENS,
+    max_pack_size: int = DEFAULT_MAX_PACK_SIZE
+) -> List[List[TextBlock]]:
+    """
+    Group adjacent text blocks into packs for editing in a single request.
+
+    A block is eligible for packing if it is not yet edited and its
+    content is no more than max_block_tokens. Ineligible blocks are
+    returned as single-block groups, so the returned groups cover all
+    blocks, in order.
+    """
+    groups: List[List[TextBlock]] = []
+    pack: List[TextBlock] = []
+    pack_tokens = 0
+
+    for text_block in text_blocks:
+        if text_block.is_edited or text_block.ai_edited_content:
+            block_tokens = None
+        else:
+            block_tokens = count_token_length(text_block.original_content, model=model)
+
+        if block_tokens is None or block_tokens > max_block_tokens:
+            if pack:
+                groups.append(pack)
+                pack, pack_tokens = [], 0
+            groups.append([text_block])
+            continue
+
+        if pack and (pack_tokens + block_tokens > max_pack_tokens or len(pack) >= max_pack_size):
+            groups.append(pack)
+            pack, pack_tokens = [], 0
+
+        pack.append(text_block)
+        pack_tokens += block_tokens
+
+    if pack:
+        groups.append(pack)
+
+    return groups
+
+
+def pack_passages(passages: List[str]) -> Tuple[str, str]:
+    """
+    Wrap each passage in delimiters unique to this request.
+
+    Returns:
+        tuple of packed text and the tag used in the delimiters
+    """
+    tag = uuid4().hex[:8]
+    packed = '\n\n'.join(
+        f"{passage_begin_marker(tag, n)}\n{passage.strip()}\n{passage_end_marker(tag, n)}"
+        for n, passage in enumerate(passages, start=1)
+    )
+    return packed, tag
+
+
+def unpack_passages(response: str, tag: str, count: int) -> Optional[List[str]]:
+    """
+    Split a packed response back into its passages.
+
+    Returns None if the delimiters were not preserved: i.e., if any
+    passage is missing, duplicated, out of order, or empty, or if the
+    response contains text outside the delimiters.
+    """
+    pattern = re.compile(
+        r'@@PASSAGE-' + re.escape(tag) + r'-(\d+)-BEGIN@@\n?(.*?)\n?@@PASSAGE-' + re.escape(tag) + r'-\1-END@@',
+        flags=re.DOTALL
+    )
+
+    passages: List[str] = []
+    cursor = 0
+
+    for n, match in enumerate(pattern.finditer(response), start=1):
+        if int(match.group(1)) != n:
+            logger.warning(f"Packed response passage {match.group(1)} found out of order.")
+            return None
+        if response[cursor:match.start()].strip():
+            logger.warning("Packed response contains text outside passage delimiters.")
+            return None
+        if not match.group(2).strip():
+            logger.warning(f"Packed response passage {n} is empty.")
+            return None
+        passages.append(match.group(2))
+        cursor = match.end()
+
+    if response[cursor:].strip():
+        logger.warning("Packed response contains text outside passage delimiters.")
+        return None
+
+    if len(passages) != count:
+        logger.warning(f"Packed response contains {len(passages)} of {count} passages.")
+        return None
+
+    return passages
@@ -0,0 +1,876 @@
+import atexit
+import click
+import logging
+from pathlib import Path
+from typing import Callable, Dict, List, Literal, Optional, Tuple, Union
+
+from ai_service import AIServiceCaller, Prompt, RateLimiter, ResponseCache
+from edit_lists import apply_edit_list, parse_edit_list
+from edit_memory import EditMemory, assemble_segments, get_run_text, get_unseen_runs, make_style_version
+from embedding_backends import DEFAULT_EMBEDDING_MODEL, EmbeddingBackend, get_embedding_backend
+from embeddings import CachedEmbeddingBackend, check_and_update_embedding_items, get_backend_cache_filepath, split_into_windows
+from helpers import clean_response, count_token_length, find_output_violation, get_json_file_content, get_text_file_content, validate_edited_text
+from masking import get_prose_ratio, mask_code, unmask_code
+from models import ContextPolicy, Embedding, PromptStats, StyleGuide, TextBlock, TextFile, load_style_guide
+from packing import group_blocks_for_packing, pack_passages, unpack_passages
+from preceding_context import build_preceding_context
+from prompts import (
+    ASCII_QA_EDIT_LIST_PROMPT_BASE_TEXT,
+    ASCII_QA_PROMPT_BASE_TEXT,
+    COPYEDIT_EDIT_LIST_PROMPT_BASE_TEXT,
+    COPYEDIT_PROMPT_BASE_TEXT,
+    GLOBAL_REVIEW_PROMPT_BASE_TEXT,
+    NO_ISSUE_STR,
+    PACKED_COPYEDIT_PROMPT_BASE_TEXT,
+    format_style_guide_text,
+    generate_prompt_text,
+    select_style_guide_items
+)
+from providers import ProviderConfig
+from routing import ModelRouter, PassType, RequestFeatures
+from scheduler import Autotuner, run_concurrently
+
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_MODELS = ["gpt-4o", "gpt-4.1", "o3"]
+
+MAX_TOKENS_BY_MODEL = {
+    'gpt-4o': { 'editing': 20000, 'qa': 10000, 'global_review': 100000 },
+    'gpt-4.1': { 'editing': 20000, 'qa': 10000, 'global_review': 100000 },
+    'o3': { 'editing': 20000, 'qa': 10000, 'global_review': 100000 }
+}
+
+
+class PassContext:
+    """
+    Shared settings and resources for the AI service passes.
+    """
+    def __init__(
+            self,
+            ai_service_caller: AIServiceCaller,
+            model: str,
+            max_tokens_editing: int,
+            max_tokens_qa: int,
+            max_tokens_global_review: int,
+            local_style_guide: StyleGuide,
+            global_style_guide: StyleGuide,
+            word_list_embeddings: Optional[List[Embedding]] = None,
+            local_style_embeddings: Optional[List[Embedding]] = None,
+            format_type: str = 'asciidoc',
+            output_format: Literal['full', 'edits'] = 'full',
+            pack_small_blocks: bool = False,
+            pack_block_max_tokens: int = 300,
+            embedding_backend: Optional[EmbeddingBackend] = None,
+            style_rules_token_budget: Optional[int] = 1500,
+            word_list_token_budget: Optional[int] = 500,
+            mmr_lambda: float = 0.7,
+            similarity_aggregation: Literal['max', 'top_n_mean'] = 'max',
+            stream_responses: bool = False,
+            local_consistency: bool = False,
+            context_policy: Optional[ContextPolicy] = None,
+            edit_memory: Optional[EditMemory] = None
+            ):
+        self.ai_service_caller = ai_service_caller
+        self.model = model
+        self.max_tokens_editing = max_tokens_editing
+        self.max_tokens_qa = max_tokens_qa
+        self.max_tokens_global_review = max_tokens_global_review
+        self.local_style_guide = local_style_guide
+        self.global_style_guide = global_style_guide
+        self.word_list_embeddings = word_list_embeddings
+        self.local_style_embeddings = local_style_embeddings
+        self.format_type = format_type
+        self.output_format = output_format
+        self.pack_small_blocks = pack_small_blocks
+        self.pack_block_max_tokens = pack_block_max_tokens
+        self.embedding_backend = embedding_backend or get_embedding_backend()
+        self.style_rules_token_budget = style_rules_token_budget
+        self.word_list_token_budget = word_list_token_budget
+        self.mmr_lambda = mmr_lambda
+        self.similarity_aggregation = similarity_aggregation
+        self.stream_responses = stream_responses
+        self.local_consistency = local_consistency
+        self.context_policy = context_policy or ContextPolicy()
+        self.edit_memory = edit_memory
+
+    def route_model(self, pass_type: PassType, text_passage: str, matched_rules: int = 0) -> str:
+        """
+        Select the model for a request on text_passage.
+        """
+        return self.ai_service_caller.route_model(RequestFeatures(
+            pass_type=pass_type,
+            tokens=count_token_length(text_passage, self.model),
+            prose_ratio=get_prose_ratio(text_passage),
+            matched_rules=matched_rules
+        ))
+
+    def select_style_guide_items(self, text_passage: str) -> Tuple[List[str], List[str]]:
+        """
+        Select the style rules and word list terms for text_passage, within
+        the token budgets.
+        """
+        deterministically_matched_local_style_rules = self.local_style_guide.get_matching_rule_contents(text_passage, self.format_type)
+
+        return select_style_guide_items(
+            text_passage=text_passage,
+            word_list_embeddings=(self.word_list_embeddings if self.word_list_embeddings else None),
+            local_style_rules_embeddings=(self.local_style_embeddings if self.local_style_embeddings else None),
+            embedding_backend=self.embedding_backend,
+            other_style_rules_to_inject=(deterministically_matched_local_style_rules if deterministically_matched_local_style_rules else None),
+            style_rules_token_budget=self.style_rules_token_budget,
+            word_list_token_budget=self.word_list_token_budget,
+            mmr_lambda=self.mmr_lambda,
+            aggregation=self.similarity_aggregation
+        )
+
+    def get_stream_check(self, original_text: str) -> Optional[Callable[[str], Optional[str]]]:
+        """
+        Check for streamed rewrites of original_text, if streaming
+        responses is enabled (see AIServiceCaller.call_ai_service).
+        """
+        if not self.stream_responses:
+            return None
+        return lambda output_text: find_output_violation(output_text, original_text)
+
+    def get_local_style_guide_text(self, text_passage: str) -> str:
+        return format_style_guide_text(*self.select_style_guide_items(text_passage))
+
+    def prefetch_passage_embeddings(self, text_passages: List[str]):
+        """
+        Embed the windows of all text_passages in a single batch, so that
+        later lookups for individual passages hit the embedding cache.
+        """
+        windows = list(dict.fromkeys(w for p in text_passages for w in split_into_windows(p)))
+        if windows:
+            self.embedding_backend.embed_batch(windows)
+
+
+def load_pass_context(
+    style_guide_dir: Union[str, Path],
+    model: str,
+    embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+    embedding_backend: str = 'st',
+    ai_service_caller: Optional[AIServiceCaller] = None,
+    model_router: Optional[ModelRouter] = None,
+    hedge_requests: bool = False,
+    provider: Optional[ProviderConfig] = None,
+    request_observer: Optional[Callable[[Optional[float], int, bool], None]] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    response_cache: Optional[ResponseCache] = None,
+    start_embedding_daemon: bool = False,
+    embedding_threads: Optional[int] = None,
+    use_edit_memory: bool = False,
+    **kwargs
+) -> PassContext:
+    """
+    Load style guides, word list, and their embeddings from
+    style_guide_dir, and build a PassContext for the selected model.
+
+    Embeddings are generated by the named embedding_backend (see
+    get_embedding_backend). Text passage embeddings are cached in the
+    .cache directory of style_guide_dir (which isn't tracked) and saved
+    on exit, as are the style guide and word list embeddings of backends
+    other than the default model.
+
+    model_router, hedge_requests, provider, request_observer,
+    rate_limiter, and response_cache are used only if ai_service_caller
+    isn't given.
+
+    If use_edit_memory is set, sentence-level edits are memoized in the
+    same .cache directory (see EditMemory) and saved on exit.
+    Remaining keyword arguments are passed to PassContext.
+    """
+    style_guide_dir = Path(style_guide_dir)
+    word_list_filepath = Path(style_guide_dir / 'wordlist.txt')
+    word_list_w_embeddings_filepath = Path(style_guide_dir / 'wordlist_w_embeddings.npz')
+    local_style_rules_filepath = Path(style_guide_dir / 'style_guide_local.json')
+    local_style_rules_w_embeddings_filepath = Path(style_guide_dir / 'style_local_w_embeddings.npz')
+    global_style_rules_filepath = Path(style_guide_dir / 'style_guide_global.json')
+    # state written by runs, kept apart from the tracked style guide files
+    cache_dir = Path(style_guide_dir / '.cache')
+    passage_embeddings_filepath = Path(cache_dir / 'passage_embeddings.npz')
+    edit_memory_filepath = Path(cache_dir / 'edit_memory.json')
+
+    if ai_service_caller is None:
+        ai_service_caller = AIServiceCaller(
+            responses_model=model,
+            model_router=model_router,
+            hedge_requests=hedge_requests,
+            provider=provider,
+            observer=request_observer,
+            rate_limiter=rate_limiter,
+            response_cache=response_cache
+        )
+
+    backend = get_embedding_backend(embedding_backend, embedding_model, start_embedding_daemon, embedding_threads)
+
+    cache_dir.mkdir(exist_ok=True)
+
+    # the tracked caches hold the default model's vectors (the reference of the
+    # drift benchmark), so other backends' vectors are cached apart, by backend
+    if backend.backend_id != DEFAULT_EMBEDDING_MODEL:
+        word_list_w_embeddings_filepath = get_backend_cache_filepath(cache_dir / word_list_w_embeddings_filepath.name, backend.backend_id)
+        local_style_rules_w_embeddings_filepath = get_backend_cache_filepath(cache_dir / local_style_rules_w_embeddings_filepath.name, backend.backend_id)
+    passage_embeddings_filepath = get_backend_cache_filepath(passage_embeddings_filepath, backend.backend_id)
+
+    click.echo("Loading word list embeddings...")
+
+    word_list = get_text_file_content(word_list_filepath).split('\n')
+
+    local_style_guide = load_style_guide(local_style_rules_filepath)
+    global_style_guide = load_style_guide(global_style_rules_filepath)
+
+    word_list_embeddings = check_and_update_embedding_items(word_list, word_list_w_embeddings_filepath, backend)
+
+    local_styles_list = [r["content"] for i in get_json_file_content(local_style_rules_filepath).get('categories', []) for r in i["rules"]]
+
+    local_style_embeddings = check_and_update_embedding_items(local_styles_list, local_style_rules_w_embeddings_filepath, backend)
+
+    cached_backend = CachedEmbeddingBackend(backend, passage_embeddings_filepath)
+    atexit.register(cached_backend.save)
+
+    edit_memory = None
+
+    if use_edit_memory:
+        # memoized edits are reused only while the style guide, word list, and prompts are unchanged
+        edit_memory = EditMemory(edit_memory_filepath, make_style_version(
+            get_text_file_content(local_style_rules_filepath),
+            get_text_file_content(word_list_filepath),
+            COPYEDIT_PROMPT_BASE_TEXT,
+            ASCII_QA_PROMPT_BASE_TEXT
+        ))
+        atexit.register(edit_memory.save)
+
+    return PassContext(
+        ai_service_caller=ai_service_caller,
+        model=model,
+        max_tokens_editing=MAX_TOKENS_BY_MODEL[model]['editing'],
+        max_tokens_qa=MAX_TOKENS_BY_MODEL[model]['qa'],
+        max_tokens_global_review=MAX_TOKENS_BY_MODEL[model]['global_review'],
+        local_style_guide=local_style_guide,
+        global_style_guide=global_style_guide,
+        word_list_embeddings=word_list_embeddings,
+        local_style_embeddings=local_style_embeddings,
+        embedding_backend=cached_backend,
+        edit_memory=edit_memory,
+        **kwargs
+    )
+
+
+def make_prompt_shrinker(
+    ctx: PassContext,
+    prompt_template: str,
+    template_kwargs: Dict[str, str],
+    fields_to_drop: List[str] = ['preceding_passage', 'style_guide']
+) -> Callable[[Prompt], Optional[Prompt]]:
+    """
+    Return a function that rebuilds a prompt with one more of
+    fields_to_drop emptied on each call, for retrying requests that
+    exceed the model's context length. The function returns None once
+    there's nothing left to drop.
+    """
+    template_kwargs = dict(template_kwargs)
+    remaining_fields = [f for f in fields_to_drop if template_kwargs.get(f)]
+
+    def shrink_prompt(prompt: Prompt) -> Optional[Prompt]:
+        if not remaining_fields:
+            return None
+        template_kwargs[remaining_fields.pop(0)] = ''
+        return ctx.ai_service_caller.create_prompt_object(prompt_template.format(**template_kwargs))
+
+    return shrink_prompt
+
+
+def request_edit_list(
+    ctx: PassContext,
+    prompt_text: str,
+    text: str,
+    model: Optional[str] = None,
+    shrink_prompt: Optional[Callable[[Prompt], Optional[Prompt]]] = None
+) -> Optional[str]:
+    """
+    Send an edit-list prompt to the AI service and apply the returned
+    edits to text locally.
+
+    Returns:
+        edited text, or None if the response could not be parsed or
+        any edit does not match the text
+    """
+    prompt = ctx.ai_service_caller.create_prompt_object(prompt_text)
+    response = ctx.ai_service_caller.call_ai_service(prompt, text_format={"type": "json_object"}, model=model, shrink_prompt=shrink_prompt)
+
+    if not response:
+        return None
+
+    edits = parse_edit_list(response)
+
+    if edits is None:
+        return None
+
+    return apply_edit_list(text, edits)
+
+
+def edit_text_block(
+    ctx: PassContext,
+    text_block: TextBlock,
+    preceding_passage: str = "",
+    mask: bool = True,
+    model: Optional[str] = None
+) -> Optional[str]:
+    """
+    Send a single text block to the AI service for copyediting.
+
+    Code blocks and block macros are replaced with placeholders before
+    sending (unless mask is False) and restored locally afterward,
+    retrying without masking if the placeholders aren't preserved.
+
+    If ctx.output_format is 'edits', the model is asked for a list of
+    edits, falling back to a full rewrite if the edits can't be applied.
+
+    The model is selected by ctx.route_model, unless given. Edited text
+    that fails validation (full rewrite or edit list) is retried with a
+    stronger model, if the model router provides one; text whose code
+    placeholders weren't preserved is retried unmasked, with the same
+    model.
+
+    Updates the text block on success.
+
+    Returns:
+        edited text, or None if the block could not be edited
+    """
+    original_content = text_block.original_content
+    passage, code_segments = mask_code(original_content) if mask else (original_content, [])
+
+    if model is None:
+        matched_rules = ctx.local_style_guide.get_matching_rule_contents(original_content, ctx.format_type)
+        model = ctx.route_model('edit', original_content, len(matched_rules))
+
+    style_rules, word_list_terms = ctx.select_style_guide_items(passage)
+
+    template_kwargs = {
+        "style_guide": format_style_guide_text(style_rules, word_list_terms),
+        "preceding_passage": preceding_passage,
+        "format_type": ctx.format_type,
+        "passage_to_be_edited": passage,
+    }
+
+    text_block.prompt_stats = PromptStats(
+        prompt_tokens=count_token_length(COPYEDIT_PROMPT_BASE_TEXT.format(**template_kwargs), ctx.model),
+        style_guide_tokens=count_token_length(template_kwargs["style_guide"], ctx.model),
+        preceding_passage_tokens=count_token_length(preceding_passage, ctx.model),
+        passage_tokens=count_token_length(passage, ctx.model),
+        num_style_rules=len(style_rules),
+        num_word_list_terms=len(word_list_terms)
+    )
+
+    edited_text = None
+
+    if ctx.output_format == 'edits':
+        prompt_text = generate_prompt_text(
+            prompt_template=COPYEDIT_EDIT_LIST_PROMPT_BASE_TEXT,
+            model=ctx.model,
+            max_tokens_per_prompt=ctx.max_tokens_editing,
+            template_kwargs=template_kwargs
+        )
+
+        shrink_prompt = make_prompt_shrinker(ctx, COPYEDIT_EDIT_LIST_PROMPT_BASE_TEXT, template_kwargs)
+        edited_text = request_edit_list(ctx, prompt_text, passage, model, shrink_prompt) if prompt_text else None
+
+        if edited_text is None:
+            logger.info("Edit list could not be applied. Falling back to full rewrite...")
+
+    if edited_text is None:
+        prompt_text = generate_prompt_text(
+            prompt_template=COPYEDIT_PROMPT_BASE_TEXT,
+            model=ctx.model,
+            max_tokens_per_prompt=ctx.max_tokens_editing,
+            template_kwargs=template_kwargs
+        )
+
+        if not prompt_text:
+            logger.warning("Unable to generate prompt text. Skipping...")
+            return None
+
+        prompt = ctx.ai_service_caller.create_prompt_object(prompt_text)
+        shrink_prompt = make_prompt_shrinker(ctx, COPYEDIT_PROMPT_BASE_TEXT, template_kwargs)
+        edited_text = ctx.ai_service_caller.call_ai_service(
+            prompt,
+            model=model,
+            shrink_prompt=shrink_prompt,
+            stream_check=ctx.get_stream_check(passage)
+        )
+
+        if not edited_text:
+            return None
+
+        edited_text = clean_response(edited_text, passage)
+
+    if not validate_edited_text(edited_text, passage):
+        if stronger_model := ctx.ai_service_caller.escalate_model(model):
+            logger.info(f"Edited text failed validation. Retrying with {stronger_model}...")
+            return edit_text_block(ctx, text_block, preceding_passage, mask, stronger_model)
+        logger.warning("Edited text failed validation, but no stronger model is available. Keeping edited text.")
+
+    if code_segments:
+        edited_text = unmask_code(edited_text, code_segments)
+
+        if edited_text is None:
+            # placeholders not preserved: a masking problem, so retry with the same model
+            logger.info("Retrying without masking code...")
+            return edit_text_block(ctx, text_block, preceding_passage, mask=False, model=model)
+
+    text_block.ai_edited_content = edited_text
+    text_block.is_edited = True
+
+    return edited_text
+
+
+def edit_packed_text_blocks(
+    ctx: PassContext,
+    text_blocks: List[TextBlock],
+    preceding_passage: str = ""
+) -> bool:
+    """
+    Send several small adjacent text blocks to the AI service for
+    copyediting in a single request, with each passage wrapped in
+    unique delimiters.
+
+    The text blocks are updated only if every passage is recovered
+    from the response and passes validation (see validate_edited_text).
+
+    Returns:
+        True if all text blocks were edited
+    """
+    masked_passages = [mask_code(b.original_content) for b in text_blocks]
+    original_contents = [passage for passage, _ in masked_passages]
+    packed_passages, tag = pack_passages(original_contents)
+
+    combined_original_content = '\n\n'.join(b.original_content for b in text_blocks)
+    matched_rules = ctx.local_style_guide.get_matching_rule_contents(combined_original_content, ctx.format_type)
+    model = ctx.route_model('edit', combined_original_content, len(matched_rules))
+
+    template_kwargs = {
+        "style_guide": ctx.get_local_style_guide_text('\n\n'.join(original_contents)),
+        "preceding_passage": preceding_passage,
+        "format_type": ctx.format_type,
+        "packed_passages": packed_passages,
+    }
+
+    prompt_text = generate_prompt_text(
+        prompt_template=PACKED_COPYEDIT_PROMPT_BASE_TEXT,
+        model=ctx.model,
+        max_tokens_per_prompt=ctx.max_tokens_editing,
+        template_kwargs=template_kwargs
+    )
+
+    if not prompt_text:
+        return False
+
+    prompt = ctx.ai_service_caller.create_prompt_object(prompt_text)
+    shrink_prompt = make_prompt_shrinker(ctx, PACKED_COPYEDIT_PROMPT_BASE_TEXT, template_kwargs)
+    response = ctx.ai_service_caller.call_ai_service(prompt, model=model, shrink_prompt=shrink_prompt)
+
+    if not response:
+        return False
+
+    edited_passages = unpack_passages(clean_response(response), tag, len(text_blocks))
+
+    if edited_passages is None:
+        return False
+
+    edited_passages = [clean_response(edited_text, passage) for edited_text, (passage, _) in zip(edited_passages, masked_passages)]
+
+    if not all(validate_edited_text(edited_text, passage) for edited_text, (passage, _) in zip(edited_passages, masked_passages)):
+        logger.info("Packed passage failed validation. Falling back to editing blocks one at a time...")
+        return False
+
+    edited_passages = [
+        unmask_code(edited_text, code_segments) if code_segments else edited_text
+        for edited_text, (_, code_segments) in zip(edited_passages, masked_passages)
+    ]
+
+    if any(edited_text is None for edited_text in edited_passages):
+        return False
+
+    for text_block, edited_text in zip(text_blocks, edited_passages):
+        text_block.ai_edited_content = edited_text
+        text_block.is_edited = True
+
+    return True
+
+
+def qa_text_block(
+    ctx: PassContext,
+    text_block: TextBlock,
+    mask: bool = True,
+    model: Optional[str] = None
+) -> bool:
+    """
+    Send original and edited text of a text block to the AI service to
+    check for and correct introduced formatting errors.
+
+    Code blocks and block macros are replaced with placeholders in both
+    texts before sending (unless mask is False, or the edited text's
+    code differs from the original's) and restored locally afterward.
+
+    If ctx.output_format is 'edits', the model is asked for a list of
+    corrections to the edited text, falling back to a full rewrite if
+    the corrections can't be applied.
+
+    The model is selected by ctx.route_model, unless given.
+
+    Text blocks left unchanged by editing are marked QAed without a
+    call to the AI service.
+
+    Updates the text block on success.
+
+    Returns:
+        True if the text block was QAed
+    """
+    if text_block.original_content == text_block.ai_edited_content:
+        text_block.is_qaed = True
+        return True
+
+    original_passage, code_segments = mask_code(text_block.original_content) if mask else (text_block.original_content, [])
+    edited_passage, edited_code_segments = mask_code(text_block.ai_edited_content) if code_segments else (text_block.ai_edited_content, [])
+
+    if edited_code_segments != code_segments:
+        original_passage, edited_passage, code_segments = text_block.original_content, text_block.ai_edited_content, []
+
+    if model is None:
+        model = ctx.route_model('qa', text_block.ai_edited_content)
+
+    qaed_text = None
+
+    if ctx.output_format == 'edits':
+        prompt_text = generate_prompt_text(
+            prompt_template=ASCII_QA_EDIT_LIST_PROMPT_BASE_TEXT,
+            model=ctx.model,
+            max_tokens_per_prompt=ctx.max_tokens_qa,
+            template_kwargs={
+                'original_text': original_passage,
+                'edited_text': edited_passage
+            }
+        )
+
+        qaed_text = request_edit_list(ctx, prompt_text, edited_passage, model) if prompt_text else None
+
+        if qaed_text is None:
+            logger.info("Edit list could not be applied. Falling back to full rewrite...")
+
+    if qaed_text is None:
+        prompt_text = generate_prompt_text(
+            prompt_template=ASCII_QA_PROMPT_BASE_TEXT,
+            model=ctx.model,
+            max_tokens_per_prompt=ctx.max_tokens_qa,
+            template_kwargs={
+                'no_issue_str': NO_ISSUE_STR,
+                'original_text': original_passage,
+                'edited_text': edited_passage
+            }
+        )
+
+        if not prompt_text:
+            logger.warning("Unable to generate prompt text. Skipping...")
+            return False
+
+        prompt = ctx.ai_service_caller.create_prompt_object(prompt_text)
+        response = ctx.ai_service_caller.call_ai_service(prompt, model=model, stream_check=ctx.get_stream_check(edited_passage))
+
+        if not response:
+            return False
+
+        response = clean_response(response, original_passage)
+
+        qaed_text = edited_passage if response.strip().lower() == NO_ISSUE_STR.lower() else response
+
+    if not validate_edited_text(qaed_text, edited_passage):
+        if stronger_model := ctx.ai_service_caller.escalate_model(model):
+            logger.info(f"QAed text failed validation. Retrying with {stronger_model}...")
+            return qa_text_block(ctx, text_block, mask, stronger_model)
+        logger.warning("QAed text failed validation, but no stronger model is available. Keeping QAed text.")
+
+    if code_segments:
+        qaed_text = unmask_code(qaed_text, code_segments)
+
+        if qaed_text is None:
+            # placeholders not preserved: a masking problem, so retry with the same model
+            logger.info("Retrying without masking code...")
+            return qa_text_block(ctx, text_block, mask=False, model=model)
+
+    if qaed_text != text_block.ai_edited_content:
+        text_block.ai_qaed_content = qaed_text
+    text_block.is_qaed = True
+
+    return True
+
+
+def apply_memoized_edits(ctx: PassContext, text_block: TextBlock) -> bool:
+    """
+    Assemble the edited text of text_block locally from ctx.edit_memory,
+    if every one of its sentences is memoized. If every sentence was
+    memoized from QAed text, the block is marked as QAed, too.
+
+    Returns:
+        True if the block was edited from memory
+    """
+    if not ctx.edit_memory:
+        return False
+
+    segments = ctx.edit_memory.lookup(text_block.original_content)
+
+    if get_unseen_runs(segments):
+        return False
+
+    edited_text = assemble_segments(segments)
+    text_block.ai_edited_content = edited_text
+    text_block.is_edited = True
+
+    if ctx.edit_memory.is_qaed(text_block.original_content):
+        text_block.ai_qaed_content = edited_text
+        text_block.is_qaed = True
+
+    return True
+
+
+def edit_unseen_sentences(ctx: PassContext, text_block: TextBlock, preceding_passage: str = "") -> bool:
+    """
+    Edit a block some of whose sentences are memoized in ctx.edit_memory
+    by sending only the runs of sentences not memoized (packed in one
+    request, if more than one), and assembling the edited text locally.
+
+    Returns:
+        True if the block was edited, or False if no sentence is
+        memoized or the runs couldn't be edited (so the whole block
+        should be sent)
+    """
+    if not ctx.edit_memory:
+        return False
+
+    segments = ctx.edit_memory.lookup(text_block.original_content)
+    runs = get_unseen_runs(segments)
+
+    if not runs or all(edited is None for sentence, _, edited in segments if sentence.strip()):
+        return False
+
+    click.echo(f"Sending only the {sum(end - start for start, end in runs)} sentences not in edit memory...")
+
+    run_blocks = [
+        TextBlock(
+            index=i,
+            file_id=text_block.file_id,
+            block_id=f"{text_block.block_id}-{i}",
+            original_content=get_run_text(segments, start, end)
+        )
+        for i, (start, end) in enumerate(runs)
+    ]
+
+    if len(run_blocks) == 1:
+        if edit_text_block(ctx, run_blocks[0], preceding_passage) is None:
+            return False
+        text_block.prompt_stats = run_blocks[0].prompt_stats
+    elif not edit_packed_text_blocks(ctx, run_blocks, preceding_passage):
+        return False
+
+    text_block.ai_edited_content = assemble_segments(segments, {
+        start: (end, run_block.ai_edited_content)
+        for (start, end), run_block in zip(runs, run_blocks)
+    })
+    text_block.is_edited = True
+
+    return True
+
+
+def get_context_policy(ctx: PassContext, text_file: TextFile) -> ContextPolicy:
+    """
+    Return the context policy for editing text_file: the policy recorded
+    in its state when editing started (so resumed runs stay consistent),
+    or else ctx.context_policy, which is then recorded.
+    """
+    if text_file.context_policy is None:
+        text_file.context_policy = ctx.context_policy
+    elif text_file.context_policy != ctx.context_policy:
+        logger.info(f"Using context policy recorded for {text_file.filepath.name}: {text_file.context_policy}")
+    return text_file.context_policy
+
+
+def edit_text_file(
+    ctx: PassContext,
+    text_file: TextFile,
+    on_block_done: Optional[Callable[[TextBlock, bool], None]] = None,
+    concurrency: Union[int, Autotuner] = 1
+):
+    """
+    Send the text blocks of a file to the AI service for copyediting,
+    packing small blocks if ctx.pack_small_blocks is set.
+
+    Each block is sent with context from the blocks preceding it, per
+    the file's context policy (see get_context_policy). If the context
+    is taken from the edited text, blocks are edited in order, each
+    after the previous block's edits; if from the original text, up to
+    concurrency blocks are edited at once.
+
+    on_block_done is called for every block once it has been handled,
+    with a flag indicating whether a request was sent for the block
+    (i.e., it wasn't skipped as already edited).
+    """
+    policy = get_context_policy(ctx, text_file)
+    text_blocks = text_file.text_blocks
+    num_text_blocks = len(text_blocks)
+
+    ctx.prefetch_passage_embeddings([
+        mask_code(b.original_content)[0] for b in text_blocks
+        if not (b.is_edited or b.ai_edited_content)
+    ])
+
+    if ctx.pack_small_blocks:
+        block_groups = group_blocks_for_packing(text_blocks, ctx.model, ctx.pack_block_max_tokens)
+    else:
+        block_groups = [[text_block] for text_block in text_blocks]
+
+    def get_context_text(text_block: TextBlock) -> str:
+        if policy.source == 'original':
+            return text_block.original_content
+        return text_block.ai_edited_content or text_block.original_content
+
+    def get_preceding_passage(position: int) -> str:
+        return build_preceding_context(policy, [get_context_text(b) for b in text_blocks[:position]], ctx.model)
+
+    def get_base_msg(position: int) -> str:
+        return f"text passage {position+1} of {num_text_blocks} passages ({text_file.filepath.name})"
+
+    def edit_block_group(item: Tuple[int, List[TextBlock]]):
+        position, block_group = item
+        pending = list(enumerate(block_group))
+
+        if len(block_group) > 1:
+            # blocks whose sentences are all memoized are left out of the pack
+            for offset, text_block in list(pending):
+                if apply_memoized_edits(ctx, text_block):
+                    click.echo(f"Assembled {get_base_msg(position + offset)} from edit memory...")
+                    pending.remove((offset, text_block))
+                    if on_block_done:
+                        on_block_done(text_block, True)
+
+        if len(pending) > 1:
+            click.echo(f"Sending text passages {position+pending[0][0]+1}-{position+pending[-1][0]+1} of {num_text_blocks} passages ({text_file.filepath.name}) for editing as a single request...")
+
+            if edit_packed_text_blocks(ctx, [b for _, b in pending], get_preceding_passage(position + pending[0][0])):
+                for _, text_block in pending:
+                    if on_block_done:
+                        on_block_done(text_block, True)
+                return
+
+            click.echo("Passage delimiters not preserved in response. Falling back to editing passages individually...")
+
+        for offset, text_block in pending:
+            base_msg = get_base_msg(position + offset)
+
+            if text_block.is_edited or text_block.ai_edited_content:
+                click.echo(f"Skipping {base_msg} (already edited)...")
+                if on_block_done:
+                    on_block_done(text_block, False)
+                continue
+
+            preceding_passage = get_preceding_passage(position + offset)
+
+            if apply_memoized_edits(ctx, text_block):
+                click.echo(f"Assembled {base_msg} from edit memory...")
+            else:
+                click.echo(f"Sending {base_msg} for editing...")
+                if not edit_unseen_sentences(ctx, text_block, preceding_passage):
+                    edit_text_block(ctx, text_block, preceding_passage)
+
+            if on_block_done:
+                on_block_done(text_block, True)
+
+    items = []
+    position = 0
+    for block_group in block_groups:
+        items.append((position, block_group))
+        position += len(block_group)
+
+    if policy.source == 'original':
+        run_concurrently(items, edit_block_group, concurrency)
+    else:
+        for item in items:
+            edit_block_group(item)
+
+
+def review_text_file(
+    ctx: PassContext,
+    text_file: TextFile
+) -> Optional[str]:
+    """
+    Send the QAed/edited content of a file to the AI service for
+    global review.
+
+    Returns:
+        review notes, "No issues noted." if the model found no issues,
+        or None if the review failed
+    """
+    edited_text = text_file.get_qaed_edited_content()
+
+    # we can update this to incorporate embedding comparison if/as needed,
+    # but for now all global rules are set to always_insert. rules checked
+    # by the local consistency analyzer are left out when it's enabled
+    deterministically_matched_global_style_rules = ctx.global_style_guide.get_matching_rule_contents(
+        edited_text,
+        ctx.format_type,
+        exclude_checked_rules=ctx.local_consistency
+    )
+
+    prompt_text = generate_prompt_text(
+        prompt_template=GLOBAL_REVIEW_PROMPT_BASE_TEXT,
+        model=ctx.model,
+        max_tokens_per_prompt=ctx.max_tokens_global_review,
+        template_kwargs={
+            'style_guide': deterministically_matched_global_style_rules,
+            'no_issue_str': NO_ISSUE_STR,
+            'passage_to_be_reviewed': edited_text,
+        }
+    )
+
+    if not prompt_text:
+        logger.warning("Unable to generate prompt text. Skipping...")
+        return None
+
+    prompt = ctx.ai_service_caller.create_prompt_object(prompt_text)
+    response = ctx.ai_service_caller.call_ai_service(prompt, model=ctx.route_model('global_review', edited_text))
+
+    if not response:
+        return None
+
+    response = clean_response(response, edited_text)
+
+    if response.strip().lower() != NO_ISSUE_STR.lower():
+        return response
+
+    return "No issues noted."
+
+
+def summarize_prompt_stats(text_files: List[TextFile]) -> Optional[str]:
+    """
+    Summarize the editing prompt token stats of all text blocks, for
+    tuning the style guide token budgets.
+    """
+    all_stats = [b.prompt_stats for f in text_files for b in f.text_blocks if b.prompt_stats]
+
+    if not all_stats:
+        return None
+
+    def mean(values):
+        return sum(values) / len(values)
+
+    prompt_tokens = sorted(s.prompt_tokens for s in all_stats)
+
+    return (
+        f"Editing prompts ({len(all_stats)} passages): "
+        f"mean {mean(prompt_tokens):.0f} tokens, "
+        f"p95 {prompt_tokens[min(len(prompt_tokens) - 1, int(len(prompt_tokens) * 0.95))]} tokens, "
+        f"max {prompt_tokens[-1]} tokens; "
+        f"style guide mean {mean([s.style_guide_tokens for s in all_stats]):.0f} tokens "
+        f"({mean([s.num_style_rules for s in all_stats]):.1f} rules, "
+        f"{mean([s.num_word_list_terms for s in all_stats]):.1f} word list terms)"
+    )
@@ -0,0 +1,123 @@
+import click
+import logging
+from pathlib import Path
+import queue
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from models import TextBlock, TextFile
+from passes import PassContext, edit_text_file, qa_text_block, review_text_file
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_text_file_complete(text_file: TextFile, disable_qa_pass: bool = False) -> bool:
+    """
+    Check whether all text blocks in file are edited and (unless the QA
+    pass is disabled) QAed.
+    """
+    return all(b.is_edited and (disable_qa_pass or b.is_qaed) for b in text_file.text_blocks)
+
+
+def run_pipeline(
+    ctx: PassContext,
+    text_files: List[TextFile],
+    checkpoint: Callable[[], None],
+    write_text_file: Callable[[TextFile], None],
+    disable_qa_pass: bool = False,
+    queue_size: int = 8
+) -> List[Tuple[Path, str]]:
+    """
+    Run the editing, QA, global review, and file-writing stages
+    concurrently, connected by bounded queues.
+
+    Each text block moves to QA as soon as it's edited. Each file moves
+    to global review as soon as all its blocks are QAed, and is written
+    as soon as its review is complete. checkpoint is called after every
+    block-level change.
+
+    Returns:
+        list of (filepath, review notes) tuples, in file order
+    """
+    qa_queue: "queue.Queue[Optional[Tuple[TextFile, Optional[TextBlock]]]]" = queue.Queue(maxsize=queue_size)
+    review_queue: "queue.Queue[Optional[TextFile]]" = queue.Queue(maxsize=queue_size)
+    checkpoint_lock = threading.Lock()
+    global_issues: List[Tuple[int, Path, str]] = []
+
+    def locked_checkpoint():
+        with checkpoint_lock:
+            checkpoint()
+
+    def edit_stage():
+        try:
+            for text_file in text_files:
+                def on_block_done(text_block: TextBlock, changed: bool, text_file=text_file):
+                    if changed:
+                        locked_checkpoint()
+                    qa_queue.put((text_file, text_block))
+
+                try:
+                    edit_text_file(ctx, text_file, on_block_done)
+                except Exception as e:
+                    logger.exception(f"Editing stage failed for {text_file.filepath}: {e}")
+
+                # signal end of file, so files with no blocks left to QA are still reviewed
+                qa_queue.put((text_file, None))
+        finally:
+            qa_queue.put(None)
+
+    def qa_stage():
+        queued_file_ids = set()
+        try:
+            while (item := qa_queue.get()) is not None:
+                text_file, text_block = item
+
+                if (
+                    text_block is not None
+                    and not disable_qa_pass
+                    and text_block.is_edited
+                    and not text_block.is_qaed
+                ):
+                    if text_block.original_content != text_block.ai_edited_content:
+                        click.echo(f"Sending text passage {text_block.index + 1} of {len(text_file.text_blocks)} passages ({text_file.filepath.name}) for QA...")
+                    try:
+                        if qa_text_block(ctx, text_block):
+                            locked_checkpoint()
+                    except Exception as e:
+                        logger.exception(f"QA stage failed for text passage in {text_file.filepath}: {e}")
+
+                if text_file.id not in queued_file_ids and is_text_file_complete(text_file, disable_qa_pass):
+                    queued_file_ids.add(text_file.id)
+                    review_queue.put(text_file)
+        finally:
+            review_queue.put(None)
+
+    def review_stage():
+        while (text_file := review_queue.get()) is not None:
+            try:
+                click.echo(f"Sending {text_file.filepath.name} for global review...")
+                review_notes = review_text_file(ctx, text_file)
+                if review_notes:
+                    global_issues.append((text_file.index, text_file.filepath, review_notes))
+
+                write_text_file(text_file)
+            except Exception as e:
+                logger.exception(f"Global review or writing stage failed for {text_file.filepath}: {e}")
+
+    stages = [
+        threading.Thread(target=edit_stage, name="edit-stage"),
+        threading.Thread(target=qa_stage, name="qa-stage"),
+        threading.Thread(target=review_stage, name="review-stage"),
+    ]
+
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+
+    incomplete_files = [f.filepath for f in text_files if not is_text_file_complete(f, disable_qa_pass)]
+    if incomplete_files:
+        logger.warning(f"Files not written, as editing or QA pass not completed: {', '.join(str(f) for f in incomplete_files)}")
+
+    return [(filepath, notes) for _, filepath, notes in sorted(global_issues, key=lambda i: i[0])]
@@ -0,0 +1,169 @@
+import re
+from typing import Dict, List, Optional
+
+from helpers import count_token_length, get_last_tokens
+from masking import NON_PROSE_LINE_PATTERN, find_code_segments
+from models import ContextPolicy
+from read_files import split_into_sentences
+
+
+DEFAULT_CONTEXT_TOKENS = 200
+
+DEFAULT_CONTEXT_SENTENCES = 3
+
+# number of sentences at the end of the preceding block included in a summary
+SUMMARY_SENTENCES = 2
+
+LIST_ITEM_PATTERN = re.compile(r'^(\*+|-|\.+|\d+\.|[a-zA-Z]\.)\s+(.*)$')
+
+DESCRIPTION_LIST_ITEM_PATTERN = re.compile(r'^(.+?)(:{2,4}|;;)(?:\s+(.*))?$')
+
+ACRONYM_DEFINITION_PATTERN = re.compile(r"((?:[A-Za-z][\w'-]*[ \t]+){1,12})\(([A-Z][A-Za-z0-9&]*[A-Z0-9])s?\)")
+
+MINOR_WORDS = {'a', 'an', 'and', 'for', 'in', 'of', 'on', 'the', 'to', 'with'}
+
+
+def get_prose_text(text: str) -> str:
+    """
+    Return text without code blocks and non-prose lines (e.g., attribute
+    entries and block attributes).
+    """
+    lines = text.split('\n')
+    code_lines = {i for start, end in find_code_segments(lines) for i in range(start, end)}
+    return '\n'.join(
+        line for i, line in enumerate(lines)
+        if i not in code_lines and not NON_PROSE_LINE_PATTERN.match(line.strip())
+    )
+
+
+def get_last_sentences(text: str, max_sentences: Optional[int] = None, max_tokens: Optional[int] = None, model: str = "gpt-4o") -> str:
+    """
+    Return the last sentences of text, up to max_sentences sentences
+    and max_tokens tokens. If even the last sentence is longer than
+    max_tokens, its last max_tokens tokens are returned.
+    """
+    sentences = [s for s, _ in split_into_sentences(text.strip()) if s.strip()]
+    selected: List[str] = []
+    num_tokens = 0
+
+    for sentence in reversed(sentences):
+        if max_sentences is not None and len(selected) >= max_sentences:
+            break
+        if max_tokens is not None:
+            sentence_tokens = count_token_length(sentence, model)
+            if num_tokens + sentence_tokens > max_tokens:
+                if not selected:
+                    selected.append(get_last_tokens(sentence, max_tokens, model))
+                break
+            num_tokens += sentence_tokens
+        selected.append(sentence)
+
+    return ' '.join(reversed(selected))
+
+
+def find_open_list(text: str) -> Optional[str]:
+    """
+    Describe the list that text ends in, if any (e.g., a list continued
+    in the next passage): its item marker, number of items, and last
+    item.
+    """
+    paragraphs = [p.strip() for p in re.split(r'\n[ \t]*\n', text.strip()) if p.strip()]
+    if not paragraphs:
+        return None
+
+    last_lines = paragraphs[-1].split('\n')
+    # the last item is the last line of the paragraph that starts an item
+    item_lines = [line for line in last_lines if LIST_ITEM_PATTERN.match(line) or DESCRIPTION_LIST_ITEM_PATTERN.match(line)]
+    if not item_lines or not (LIST_ITEM_PATTERN.match(last_lines[0]) or DESCRIPTION_LIST_ITEM_PATTERN.match(last_lines[0])):
+        return None
+
+    last_item = item_lines[-1]
+    if match := LIST_ITEM_PATTERN.match(last_item):
+        marker = match.group(1)
+        num_items = 0
+        # count the items of the list, back to the paragraph before it
+        for paragraph in reversed(paragraphs):
+            paragraph_lines = paragraph.split('\n')
+            if not (LIST_ITEM_PATTERN.match(paragraph_lines[0]) or paragraph_lines[0] == '+'):
+                break
+            num_items += sum(1 for line in paragraph_lines if (m := LIST_ITEM_PATTERN.match(line)) and m.group(1) == marker)
+        kind = 'ordered' if marker[0] == '.' or marker[0].isalnum() else 'unordered'
+        return f"The preceding passage ends in an {kind} list (items marked `{marker}`, {num_items} so far). Last item: {match.group(2)}"
+
+    match = DESCRIPTION_LIST_ITEM_PATTERN.match(last_item)
+    return f"The preceding passage ends in a description list (terms marked `{match.group(2)}`). Last term: {match.group(1)}"
+
+
+def find_acronym_definitions(text: str) -> Dict[str, str]:
+    """
+    Find acronyms defined in text, in the form "Domain Name System (DNS)".
+
+    Returns:
+        map of acronyms to the terms they stand for
+    """
+    definitions: Dict[str, str] = {}
+
+    for match in ACRONYM_DEFINITION_PATTERN.finditer(text):
+        words = match.group(1).split()
+        acronym = match.group(2)
+        max_words = len(re.findall(r'[A-Z]', acronym)) + 2
+
+        # shortest run of words before the acronym that starts with its first letter
+        for k in range(1, min(len(words), max_words) + 1):
+            term_words = words[-k:]
+            if term_words[0].lower() in MINOR_WORDS:
+                continue
+            if term_words[0][0].upper() == acronym[0] and (k > 1 or len(acronym) <= 2):
+                definitions[acronym] = ' '.join(term_words)
+                break
+
+    return definitions
+
+
+def summarize_preceding_text(preceding_texts: List[str], model: str = "gpt-4o") -> str:
+    """
+    Summarize the preceding text of a file for an editing prompt: any
+    list the last block ends in, the acronyms defined in all the
+    preceding blocks, and the last sentences of the last block (for
+    pronoun antecedents).
+    """
+    if not preceding_texts:
+        return ""
+
+    last_text = get_prose_text(preceding_texts[-1])
+    lines = []
+
+    if open_list := find_open_list(last_text):
+        lines.append(open_list)
+
+    acronyms: Dict[str, str] = {}
+    for text in preceding_texts:
+        acronyms.update(find_acronym_definitions(get_prose_text(text)))
+    if acronyms:
+        lines.append("Acronyms already defined: " + '; '.join(f"{a} ({term})" for a, term in acronyms.items()))
+
+    if last_sentences := get_last_sentences(last_text, max_sentences=SUMMARY_SENTENCES, max_tokens=DEFAULT_CONTEXT_TOKENS, model=model):
+        lines.append(f"Last sentences: {last_sentences}")
+
+    return '\n'.join(lines)
+
+
+def build_preceding_context(policy: ContextPolicy, preceding_texts: List[str], model: str = "gpt-4o") -> str:
+    """
+    Build the preceding passage of an editing prompt per policy, from
+    the texts of the blocks preceding the passage in its file (edited
+    or original, per policy.source).
+    """
+    if not preceding_texts:
+        return ""
+
+    if policy.mode == 'tokens':
+        return get_last_sentences(preceding_texts[-1], max_tokens=policy.size or DEFAULT_CONTEXT_TOKENS, model=model)
+
+    if policy.mode == 'sentences':
+        return get_last_sentences(preceding_texts[-1], max_sentences=policy.size or DEFAULT_CONTEXT_SENTENCES, model=model)
+
+    if policy.mode == 'summary':
+        return summarize_preceding_text(preceding_texts, model)
+
+    return preceding_texts[-1]
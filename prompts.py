@@ -1,7 +1,9 @@
+from functools import lru_cache
 import logging
-from typing import Callable, Dict, List, Union
+from typing import Dict, List, Literal, Optional, Tuple, Union
 
-from embeddings import filter_by_vector_similarity
+from embedding_backends import EmbeddingBackend
+from embeddings import select_by_mmr, split_into_windows
 from helpers import count_token_length
 from models import Embedding
 
@@ -9,6 +11,8 @@ from models import Embedding
 logger = logging.getLogger(__name__)
 
 
+NO_ISSUE_STR = 'NO_ISSUE'
+
 COPYEDIT_PROMPT_BASE_TEXT = """
 You are an expert copyeditor. Edit the text below for grammar, clarity, and style, using the provided style guide.
 
@@ -35,6 +39,65 @@ Preserve all formatting and markup consistent with {format_type}. Do not assume,
 Do NOT enclose your response in triple backticks (```) or add a language tag.
 """
 
+PACKED_COPYEDIT_PROMPT_BASE_TEXT = """
+You are an expert copyeditor. Edit each of the passages below for grammar, clarity, and style, using the provided style guide.
+
+[BEGIN STYLE GUIDE]
+{style_guide}
+[END STYLE GUIDE]
+
+Use the preceding passage (if available) to ensure continuity, e.g., resolve pronouns, maintain tone, or complete broken lists.
+
+[BEGIN PRECEDING PASSAGE]
+{preceding_passage}
+[END PRECEDING PASSAGE]
+
+The passages to edit are consecutive sections of the same document. Each passage is enclosed between a line of the form @@PASSAGE-<id>-<n>-BEGIN@@ and a line of the form @@PASSAGE-<id>-<n>-END@@.
+
+[BEGIN PASSAGES TO EDIT]
+{packed_passages}
+[END PASSAGES TO EDIT]
+
+Output every passage, in the same order, each enclosed in exactly the same BEGIN and END lines as in the input. Edit only the text between those lines. Do not merge, split, drop, or reorder passages, and do not add any text outside the BEGIN and END lines — no explanations, commentary, or notes.
+
+Preserve all formatting and markup consistent with {format_type}. Do not assume, infer, or substitute any other markup style under any circumstances. Do NOT use Markdown formatting; only {format_type}. Leave all formatting exactly as it appears in the input. Your only task is to edit the text for grammar, clarity, and style, in accordance with the style guide.
+
+Do NOT enclose your response in triple backticks (```) or add a language tag.
+"""
+
+COPYEDIT_EDIT_LIST_PROMPT_BASE_TEXT = """
+You are an expert copyeditor. Edit the text below for grammar, clarity, and style, using the provided style guide.
+
+[BEGIN STYLE GUIDE]
+{style_guide}
+[END STYLE GUIDE]
+
+Use the preceding passage (if available) to ensure continuity, e.g., resolve pronouns, maintain tone, or complete broken lists.
+
+[BEGIN PRECEDING PASSAGE]
+{preceding_passage}
+[END PRECEDING PASSAGE]
+
+Now edit the following passage:
+
+[BEGIN PASSAGE TO EDIT]
+{passage_to_be_edited}
+[END PASSAGE TO EDIT]
+
+Output only a JSON object listing your edits, in the following format — no explanations, commentary, or notes:
+
+{{"edits": [{{"original": "...", "replacement": "...", "context_before": "...", "context_after": "..."}}]}}
+
+Each edit must have:
+"original": the exact span of text to be replaced, copied character for character from the passage. Keep it as short as possible (e.g., a word or phrase, not the whole sentence).
+"replacement": the text that replaces the span.
+"context_before" and "context_after": optional short runs of text (a few words) immediately before and after the span, copied exactly from the passage, so the span can be located unambiguously. Use an empty string if not needed.
+
+List edits in the order they appear in the passage, and don't let edits overlap. If no edits are needed, respond with {{"edits": []}}.
+
+Preserve all formatting and markup consistent with {format_type}. Do not assume, infer, or substitute any other markup style under any circumstances. Do NOT use Markdown formatting; only {format_type}. Your only task is to edit the text for grammar, clarity, and style, in accordance with the style guide.
+"""
+
 ASCII_QA_PROMPT_BASE_TEXT = """
 You are an expert in AsciiDoc formatting.
 
@@ -65,6 +128,39 @@ Otherwise, return the entire corrected passage, and nothing else. Do not return
 Return either exactly {no_issue_str} or the fully corrected version of the edited passage. Do not explain, justify, or add instructions.
 """
 
+ASCII_QA_EDIT_LIST_PROMPT_BASE_TEXT = """
+You are an expert in AsciiDoc formatting.
+
+Compare the original and edited text shown below. The edited text must not introduce any formatting changes that are inconsistent with AsciiDoc syntax.
+
+If formatting errors have been introduced (e.g., AsciiDoc links changed to Markdown links, periods removed from image captions, AsciiDoc headings changed to Markdown headings), fix them — but only those formatting issues.
+
+Do not modify grammar or writing style.
+
+[BEGIN ORIGINAL]
+
+{original_text}
+
+[END ORIGINAL]
+
+[BEGIN EDITED]
+
+{edited_text}
+
+[END EDITED]
+
+Output only a JSON object listing your edits, in the following format — no explanations, commentary, or notes:
+
+{{"edits": [{{"original": "...", "replacement": "...", "context_before": "...", "context_after": "..."}}]}}
+
+Each edit must have:
+"original": the exact span of text to be replaced, copied character for character from the edited text. Keep it as short as possible (e.g., a word or phrase, not the whole sentence).
+"replacement": the text that replaces the span.
+"context_before" and "context_after": optional short runs of text (a few words) immediately before and after the span, copied exactly from the edited text, so the span can be located unambiguously. Use an empty string if not needed.
+
+List edits in the order they appear in the edited text, and don't let edits overlap. If no formatting issues have been introduced, respond with {{"edits": []}}.
+"""
+
 GLOBAL_REVIEW_PROMPT_BASE_TEXT = """
 You are an expert copyeditor. Review the passage below for problems of consistency or style, based on the accompanying style guide. Do not summarize or restate style rules unless the passage actively violates them. Only report issues that appear directly in the quoted text.
 
@@ -125,26 +221,98 @@ def generate_prompt_text(
     return prompt_text
 
 
+@lru_cache(maxsize=8192)
+def count_style_guide_item_tokens(content: str) -> int:
+    return count_token_length(content)
+
+
+def select_style_guide_items(
+    text_passage: str,
+    word_list_embeddings: List[Embedding],
+    local_style_rules_embeddings: List[Embedding],
+    embedding_backend: EmbeddingBackend,
+    other_style_rules_to_inject: Union[List[str], List] = [],
+    style_rules_token_budget: Optional[int] = None,
+    word_list_token_budget: Optional[int] = None,
+    mmr_lambda: float = 0.7,
+    aggregation: Literal['max', 'top_n_mean'] = 'max'
+    ) -> Tuple[List[str], List[str]]:
+    """
+    Select the style rules and word list terms relevant to text passage,
+    by embedding similarity, ranked by maximal marginal relevance and
+    limited to the token budget for each (if given).
+
+    The passage is embedded in windows of whole sentences (see
+    split_into_windows), and a candidate's similarity to the passage is
+    aggregated over the windows.
+
+    Deterministically matched rules (other_style_rules_to_inject) are
+    always included, and count against the style rules budget.
+
+    Return:
+        tuple of selected style rules and selected word list terms
+    """
+    text_passage_embeddings = embedding_backend.embed_batch(split_into_windows(text_passage)) or []
+    threshold = embedding_backend.similarity_threshold
+
+    injected_style_rules = list(dict.fromkeys(other_style_rules_to_inject or []))
+    if style_rules_token_budget is not None:
+        style_rules_token_budget = max(0, style_rules_token_budget - sum(count_style_guide_item_tokens(r) for r in injected_style_rules))
+
+    relevant_style_rules = select_by_mmr(
+        [e for e in local_style_rules_embeddings or [] if e.content not in injected_style_rules],
+        text_passage_embeddings,
+        threshold,
+        style_rules_token_budget,
+        count_style_guide_item_tokens,
+        mmr_lambda,
+        aggregation
+    )
+    relevant_word_list_terms = select_by_mmr(
+        word_list_embeddings or [],
+        text_passage_embeddings,
+        threshold,
+        word_list_token_budget,
+        count_style_guide_item_tokens,
+        mmr_lambda,
+        aggregation
+    )
+
+    return injected_style_rules + relevant_style_rules, relevant_word_list_terms
+
+
+def format_style_guide_text(style_rules: List[str], word_list_terms: List[str]) -> str:
+    style_rules_str = '=== Style Rules' + '\n' + '\n'.join(style_rules) if style_rules else ''
+    word_list_str = '=== Word List' + '\n' + '\n'.join(word_list_terms) if word_list_terms else ''
+    return style_rules_str + '\n' + word_list_str
+
+
 def generate_style_guide_text(
     text_passage: str,
     word_list_embeddings: List[Embedding],
     local_style_rules_embeddings: List[Embedding],
-    embed_function: Callable,
-    other_style_rules_to_inject: Union[List[str], List] = []
+    embedding_backend: EmbeddingBackend,
+    other_style_rules_to_inject: Union[List[str], List] = [],
+    style_rules_token_budget: Optional[int] = None,
+    word_list_token_budget: Optional[int] = None,
+    mmr_lambda: float = 0.7,
+    aggregation: Literal['max', 'top_n_mean'] = 'max'
     ):
     """
     Use embeddings of existing style rules, word list, and text passage
-    to generate style guide text. 
+    to generate style guide text (see select_style_guide_items).
 
     Return:
         string representing style guide portion of prompt
     """
-    text_passage_embedding = embed_function(text_passage)
-    relevant_word_list_terms = [i for i in filter_by_vector_similarity(word_list_embeddings, text_passage_embedding)]
-    relevant_style_rules = [i for i in filter_by_vector_similarity(local_style_rules_embeddings, text_passage_embedding)]
-    if other_style_rules_to_inject:
-         relevant_style_rules = list(set(relevant_style_rules) | set(other_style_rules_to_inject))
-    style_rules_str = '=== Style Rules' + '\n' + '\n'.join(relevant_style_rules) if relevant_style_rules else ''
-    word_list_str = '=== Word List' + '\n' + '\n'.join(relevant_word_list_terms) if relevant_word_list_terms else ''
-    style_guide_text_for_prompt = style_rules_str + '\n' + word_list_str
-    return style_guide_text_for_prompt
+    return format_style_guide_text(*select_style_guide_items(
+        text_passage,
+        word_list_embeddings,
+        local_style_rules_embeddings,
+        embedding_backend,
+        other_style_rules_to_inject,
+        style_rules_token_budget,
+        word_list_token_budget,
+        mmr_lambda,
+        aggregation
+    ))
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Dict, Literal, Optional, Union
+
+
+logger = logging.getLogger(__name__)
+
+ProviderApi = Literal['auto', 'responses', 'chat_completions']
+
+
+class ProviderConfig(BaseModel):
+    """
+    Settings for an OpenAI-compatible AI service.
+
+    api selects the endpoint: 'responses', 'chat_completions', or 'auto'
+    to use the Responses API, falling back to Chat Completions if the
+    server doesn't support it. models maps the script's model names
+    (e.g., gpt-4o) to the provider's names for them.
+    """
+    name: str = 'openai'
+    base_url: Optional[str] = None
+    api_key_env: str = 'OPENAI_API_KEY'
+    api: ProviderApi = 'auto'
+    models: Dict[str, str] = {}
+    timeout_base: float = 30.0 # seconds
+    timeout_per_1k_tokens: float = 10.0 # seconds per 1,000 prompt tokens
+    connect_timeout: float = 10.0 # seconds
+    max_connections: int = 10
+    http2: bool = False
+
+    def resolve_model(self, model: str) -> str:
+        return self.models.get(model, model)
+
+
+def load_provider_config(path: Union[str, Path]) -> ProviderConfig:
+    with open(str(path), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    return ProviderConfig.model_validate(data)
+
+
+def get_provider_api_key(provider: ProviderConfig) -> str:
+    """
+    Return the API key for provider from the environment. Servers at a
+    custom base URL (e.g., local inference servers) may not need one.
+    """
+    if provider.base_url is None:
+        from ai_service import get_api_key
+        return get_api_key(provider.api_key_env)
+
+    return os.getenv(provider.api_key_env) or 'none'
+
+
+def create_openai_client(provider: ProviderConfig, api_key: Optional[str] = None):
+    """
+    Create an OpenAI client for provider, with a shared keep-alive
+    connection pool of provider.max_connections connections.
+    """
+    import httpx
+    import openai
+
+    http_client = httpx.Client(
+        http2=provider.http2,
+        limits=httpx.Limits(
+            max_connections=provider.max_connections,
+            max_keepalive_connections=provider.max_connections
+        ),
+        timeout=httpx.Timeout(provider.timeout_base, connect=provider.connect_timeout)
+    )
+
+    return openai.OpenAI(
+        api_key=api_key or get_provider_api_key(provider),
+        base_url=provider.base_url,
+        http_client=http_client,
+        max_retries=0 # retries are handled by AIServiceCaller
+    )
@@ -1,9 +1,11 @@
 from pathlib import Path
 import re
-from typing import List, Optional, Union
-from uuid import uuid4
+import threading
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
-from helpers import count_token_length, detect_format, get_text_file_content
+from helpers import compute_hash, count_token_length, detect_format, get_text_file_content
+from incremental import apply_previous_edits
+from masking import find_code_segments, is_prose_free
 from models import AsciiBlock, AsciiFile, TextFileFormat
 
 
@@ -18,6 +20,45 @@ def is_section_heading(line: str) -> bool:
     # True if it’s a heading (min 1 =, space required), but not a block delimiter (like ====)
     return bool(re.match(r'^={1,6} [^\n]+$', line.strip()))
 
+
+def make_file_id(filepath: Union[str, Path], base_dir: Optional[Union[str, Path]] = None) -> str:
+    """
+    Derive a stable file ID from the file's path, relative to base_dir
+    if given (so IDs don't depend on where the project is checked out).
+    """
+    filepath = Path(filepath).resolve()
+    if base_dir is not None:
+        try:
+            filepath = filepath.relative_to(Path(base_dir).resolve())
+        except ValueError:
+            pass
+    return compute_hash(filepath.as_posix())[:16]
+
+
+def make_block_id(file_id: str, section_path: str, content: str, occurrence: int = 0) -> str:
+    """
+    Derive a stable block ID from the file ID, the path of headings
+    leading to the block's section, and the block content. occurrence
+    distinguishes blocks with identical content in the same section.
+    """
+    return compute_hash('\x1f'.join([file_id, section_path, compute_hash(content), str(occurrence)]))[:16]
+
+
+def get_section_path(section: str, heading_stack: List[str]) -> str:
+    """
+    Update heading_stack (headings by level) with the heading of
+    section, if any, and return the resulting path of headings.
+    """
+    for line in section.splitlines():
+        if is_section_heading(line):
+            markers, title = line.strip().split(' ', 1)
+            level = len(markers)
+            del heading_stack[level - 1:]
+            heading_stack.extend([''] * (level - 1 - len(heading_stack)))
+            heading_stack.append(title.strip())
+            break
+    return '/'.join(heading_stack)
+
 def split_into_sections(text: str) -> List[str]:
     """
     Splits AsciiDoc content into logical sections by headings,
@@ -54,6 +95,9 @@ def split_into_sections(text: str) -> List[str]:
                 pending_attrs = []
             current_section.append(line)
 
+    # keep trailing attribute lines (e.g., a fragment of only attribute entries)
+    current_section.extend(pending_attrs)
+
     if current_section:
         sections.append(current_section)
 
@@ -122,110 +166,318 @@ def group_snippets(lines: List[str]) -> List[str]:
     return [s for s in snippets if s.strip()]
 
 
+# end of a line that ends a sentence, optionally followed by closing quotes, parens, or inline markup
+SENTENCE_END_PATTERN = re.compile(r'[.!?:]["\')\]*_`]*$')
+
+# sentence-ending punctuation, then the whitespace between sentences (group 1), before a capital or digit
+SENTENCE_BOUNDARY_PATTERN = re.compile(r'[.!?]["\')\]*_`]*(\s+)(?=["\'(\[*_`]?[A-Z0-9])')
+
+
+def find_safe_line_boundaries(lines: List[str]) -> List[int]:
+    """
+    Find indexes of lines before which a snippet can be split without
+    breaking its markup: list items, table cells, lines following a
+    line that ends a sentence, and lines following a code block or block
+    macro. Never inside code blocks.
+    """
+    code_segments = find_code_segments(lines)
+    code_lines = {i for start, end in code_segments for i in range(start + 1, end)}
+    code_segment_ends = {end for _, end in code_segments}
+    boundaries = []
+    in_table = False
+
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+
+        if stripped == '|===':
+            in_table = not in_table
+            continue
+
+        if i == 0 or i in code_lines:
+            continue
+
+        if (
+            i in code_segment_ends
+            or is_list_item(line)
+            or (in_table and stripped.startswith('|'))
+            or ((i - 1) not in code_lines and SENTENCE_END_PATTERN.search(lines[i - 1].strip()))
+        ):
+            boundaries.append(i)
+
+    return boundaries
+
+
+def split_into_sentences(text: str) -> List[Tuple[str, str]]:
+    """
+    Split text into sentences.
+
+    Returns:
+        list of (sentence, whitespace following it) tuples
+    """
+    sentences = []
+    pos = 0
+    for match in SENTENCE_BOUNDARY_PATTERN.finditer(text):
+        sentences.append((text[pos:match.start(1)], match.group(1)))
+        pos = match.end(1)
+    sentences.append((text[pos:], ''))
+    return sentences
+
+
+def split_oversized_snippet(snippet: str, model: str, max_tokens: int) -> List[Tuple[str, str]]:
+    """
+    Split a snippet longer than max_tokens into pieces of at most
+    max_tokens, at safe boundaries (see find_safe_line_boundaries),
+    falling back to sentence boundaries within lines (outside code
+    blocks). Pieces that can't be split further may exceed max_tokens.
+
+    Joining each piece with the separator following it reproduces the
+    snippet exactly.
+
+    Returns:
+        list of (piece, separator following it) tuples; the last
+        piece's separator is ''
+    """
+    lines = snippet.split('\n')
+    starts = [0] + find_safe_line_boundaries(lines)
+    ends = starts[1:] + [len(lines)]
+
+    units: List[Tuple[str, str]] = []
+    for start, end in zip(starts, ends):
+        text = '\n'.join(lines[start:end])
+        separator = '\n' if end < len(lines) else ''
+
+        if count_token_length(text, model) > max_tokens and not find_code_segments(lines[start:end]):
+            sentences = split_into_sentences(text)
+            sentences[-1] = (sentences[-1][0], separator)
+            units.extend(sentences)
+        else:
+            units.append((text, separator))
+
+    pieces: List[Tuple[str, str]] = []
+    piece, piece_separator, piece_tokens = '', '', 0
+
+    for text, separator in units:
+        tokens = count_token_length(text + separator, model)
+        if piece and piece_tokens + tokens > max_tokens:
+            pieces.append((piece, piece_separator))
+            piece, piece_separator, piece_tokens = '', '', 0
+        piece += piece_separator + text
+        piece_separator = separator
+        piece_tokens += tokens
+
+    pieces.append((piece, piece_separator))
+
+    return pieces
+
+
 def extract_ascii_blocks(
     filepath: Union[str, Path],
     file_id: str,
     model: str = "gpt-4o",
-    max_tokens_per_block: int = 1500
+    max_tokens_per_block: int = 1500,
+    text: Optional[str] = None
 ) -> List[AsciiBlock]:
     """
     Parses an AsciiDoc file and emits token-bounded blocks that:
     - Respect section boundaries
     - Maintain block-level integrity for lists, code, admonitions
     - Group semantic snippets into <= max_tokens_per_block AsciiBlocks
+    - Split snippets longer than max_tokens_per_block (e.g., long lists
+      or tables) at safe boundaries (see split_oversized_snippet)
+
+    Block content is an exact slice of the file, and the text between
+    blocks is kept in join_with_next, so that unedited text is written
+    back unchanged.
+
+    Blocks with no prose (e.g., only code listings or block macros) are
+    marked as edited and QAed, so they're never sent to the AI service.
+
+    text is the file's content, if already read.
     """
     filepath = Path(filepath)
-    text = get_text_file_content(filepath)
+    if text is None:
+        text = get_text_file_content(filepath)
     sections = split_into_sections(text)
 
     all_blocks: List[AsciiBlock] = []
+    spans: List[Tuple[int, int]] = [] # offsets of blocks in text
     block_index = 0
+    heading_stack: List[str] = []
+    cursor = 0
 
     for section in sections:
-        lines = section.splitlines()
+        section_path = get_section_path(section, heading_stack)
+        occurrences: Dict[str, int] = {}
+
+        def next_block_id(content: str) -> str:
+            occurrence = occurrences.get(content, 0)
+            occurrences[content] = occurrence + 1
+            return make_block_id(file_id, section_path, content, occurrence)
+
+        def add_block(start: int, end: int):
+            nonlocal block_index
+            content = text[start:end]
+            all_blocks.append(AsciiBlock(
+                index=block_index,
+                file_id=file_id,
+                block_id=next_block_id(content),
+                original_content=content
+            ))
+            spans.append((start, end))
+            block_index += 1
+
+        lines = section.split('\n')
         snippets = group_snippets(lines)
 
-        buffer = ""
+        buffer_start = buffer_end = None
         buffer_tokens = 0
 
+        def flush_buffer():
+            nonlocal buffer_start, buffer_end, buffer_tokens
+            if buffer_start is not None:
+                add_block(buffer_start, buffer_end)
+                buffer_start = buffer_end = None
+                buffer_tokens = 0
+
         for snippet in snippets:
             snippet = snippet
             if not snippet:
                 continue
 
+            # locate snippet in the file, so blocks are exact slices of it
+            snippet_start = text.index(snippet, cursor)
+            snippet_end = cursor = snippet_start + len(snippet)
+
             snippet_tokens = count_token_length(snippet + "\n\n", model=model)
 
             if snippet_tokens > max_tokens_per_block:
                 # Flush buffer first
-                if buffer:
-                    all_blocks.append(AsciiBlock(
-                        index=block_index,
-                        file_id=file_id,
-                        block_id=str(uuid4()),
-                        original_content=buffer
-                    ))
-                    block_index += 1
-                    buffer = ""
-                    buffer_tokens = 0
-
-                all_blocks.append(AsciiBlock(
-                    index=block_index,
-                    file_id=file_id,
-                    block_id=str(uuid4()),
-                    original_content=snippet  # Let long snippet through unmodified
-                ))
-                block_index += 1
+                flush_buffer()
+
+                # Split long snippet at safe boundaries
+                piece_start = snippet_start
+                for piece, separator in split_oversized_snippet(snippet, model, max_tokens_per_block):
+                    add_block(piece_start, piece_start + len(piece))
+                    piece_start += len(piece) + len(separator)
                 continue
 
             if buffer_tokens + snippet_tokens > max_tokens_per_block:
                 # Flush current buffer as a block
-                all_blocks.append(AsciiBlock(
-                    index=block_index,
-                    file_id=file_id,
-                    block_id=str(uuid4()),
-                    original_content=buffer
-                ))
-                block_index += 1
-                buffer = snippet + "\n\n"
-                buffer_tokens = snippet_tokens
-            else:
-                buffer += snippet + "\n\n"
-                buffer_tokens += snippet_tokens
+                flush_buffer()
+
+            if buffer_start is None:
+                buffer_start = snippet_start
+            buffer_end = snippet_end
+            buffer_tokens += snippet_tokens
 
         # Final flush per section
-        if buffer:
-            all_blocks.append(AsciiBlock(
-                index=block_index,
-                file_id=file_id,
-                block_id=str(uuid4()),
-                original_content=buffer
-            ))
-            block_index += 1
+        flush_buffer()
+
+    # keep the exact text between blocks (and after the last), to restore it when writing
+    for block, (_, end), (next_start, _) in zip(all_blocks, spans, spans[1:] + [(len(text), None)]):
+        block.join_with_next = text[end:next_start]
+
+    # prose-free blocks (e.g., code listings) need no editing or QA
+    for block in all_blocks:
+        if is_prose_free(block.original_content):
+            block.ai_edited_content = block.original_content
+            block.is_edited = True
+            block.is_qaed = True
 
     return all_blocks
 
 
+class ParseCache:
+    """
+    Cache of the blocks parsed from files, keyed by resolved path and
+    modification time (and size), so each physical file is parsed once
+    while unchanged, e.g., by the projects of a batch that share files.
+    Cached blocks are copied in and out, so edits to them don't leak
+    into the cache.
+    """
+    def __init__(self):
+        self._entries: Dict[Path, Tuple[Tuple, List[AsciiBlock]]] = {}
+        self._lock = threading.Lock()
+
+    def get_blocks(self, filepath: Path, settings: Tuple, parse: Callable[[], List[AsciiBlock]]) -> List[AsciiBlock]:
+        """
+        Return the blocks of filepath parsed with settings (e.g., file ID,
+        model, and max block size), calling parse if not cached.
+        """
+        stat = filepath.stat()
+        key = (stat.st_mtime_ns, stat.st_size, settings)
+        resolved_path = filepath.resolve()
+
+        with self._lock:
+            entry = self._entries.get(resolved_path)
+
+        if entry and entry[0] == key:
+            blocks = entry[1]
+        else:
+            blocks = parse()
+            with self._lock:
+                self._entries[resolved_path] = (key, [b.model_copy(deep=True) for b in blocks])
+
+        return [b.model_copy(deep=True) for b in blocks]
+
+
 def read_files(
         filepaths: List[Union[str, Path]],
-        model: str
+        model: str,
+        base_dir: Optional[Union[str, Path]] = None,
+        previous_text_files: Optional[List[AsciiFile]] = None,
+        max_tokens_per_block: int = 1500,
+        parse_cache: Optional[ParseCache] = None
         ) -> Optional[List[AsciiFile]]:
     """
     From a list of filepaths, read text content into
     a list of AsciiFile and AsciiBlock model instances.
+
+    File and block IDs are derived from file paths (relative to
+    base_dir, if given) and content, so they're stable across runs.
+
+    If previous_text_files (e.g., from a previous run's backup) are
+    given, files whose content is unchanged are reused as is, without
+    parsing, and edits are reused for unchanged blocks of changed files.
+    Files already parsed in this run are reused from parse_cache, if
+    given.
     """
     filepaths = [Path(fp) for fp in filepaths]
     text_files: Optional[List[AsciiFile]] = []
+    previous_text_files_by_id = {f.id: f for f in (previous_text_files or [])}
 
     for i, path in enumerate(filepaths):
         text_file_format: TextFileFormat = detect_format(path)
         if text_file_format == 'asciidoc':
-            file_id = str(uuid4())
+            file_id = make_file_id(path, base_dir)
+            content = get_text_file_content(path)
+            source_hash = compute_hash(content)
+            previous_text_file = previous_text_files_by_id.get(file_id)
+
+            if previous_text_file and previous_text_file.source_hash == source_hash:
+                text_files.append(previous_text_file.model_copy(update={'index': i, 'filepath': path}))
+                continue
+
+            def parse():
+                return extract_ascii_blocks(path, file_id, model, max_tokens_per_block, text=content)
+
+            if parse_cache:
+                text_blocks = parse_cache.get_blocks(path, (file_id, model, max_tokens_per_block), parse)
+            else:
+                text_blocks = parse()
+
+            if previous_text_files:
+                apply_previous_edits(text_blocks, previous_text_files)
+
             text_files.append(
                 AsciiFile(
                    	index=i,
                     id=file_id,
                     filepath=path,
-                    text_blocks=extract_ascii_blocks(path, file_id, model)
+                    source_hash=source_hash,
+                    # blocks start after any leading whitespace
+                    leading_text=content[:len(content) - len(content.lstrip())],
+                    text_blocks=text_blocks
                 )
             )
         else:
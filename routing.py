@@ -0,0 +1,83 @@
+import json
+import logging
+from pathlib import Path
+from pydantic import BaseModel, model_validator
+from typing import Dict, List, Literal, Optional, Union
+
+
+logger = logging.getLogger(__name__)
+
+PassType = Literal['edit', 'qa', 'global_review']
+
+
+class RequestFeatures(BaseModel):
+    pass_type: PassType
+    tokens: int # token length of the passage
+    prose_ratio: float = 1.0 # share of passage that is prose, not code
+    matched_rules: int = 0 # number of deterministically matched style rules
+
+
+class RoutingRule(BaseModel):
+    """
+    Route requests matching all of the rule's conditions (conditions
+    that are None always match) to model.
+    """
+    model: str
+    pass_types: List[PassType] = []
+    max_tokens: Optional[int] = None
+    max_prose_ratio: Optional[float] = None
+    max_matched_rules: Optional[int] = None
+
+    def matches(self, features: RequestFeatures) -> bool:
+        return (
+            (not self.pass_types or features.pass_type in self.pass_types)
+            and (self.max_tokens is None or features.tokens <= self.max_tokens)
+            and (self.max_prose_ratio is None or features.prose_ratio <= self.max_prose_ratio)
+            and (self.max_matched_rules is None or features.matched_rules <= self.max_matched_rules)
+        )
+
+
+class RoutingTable(BaseModel):
+    """
+    Rules are checked in order, and the first match wins. Requests
+    matching no rule go to default_model (or the run's selected model).
+
+    escalation maps a model to a stronger model, used to retry requests
+    whose output fails validation.
+    """
+    rules: List[RoutingRule] = []
+    default_model: Optional[str] = None
+    escalation: Dict[str, str] = {}
+
+    @model_validator(mode='after')
+    def validate_escalation(self):
+        for start_model in self.escalation:
+            model = start_model
+            seen = {model}
+            while (model := self.escalation.get(model)) is not None:
+                if model in seen:
+                    raise ValueError(f"Escalation chain contains a cycle at model: '{model}'")
+                seen.add(model)
+        return self
+
+
+class ModelRouter:
+    def __init__(self, routing_table: RoutingTable, default_model: str):
+        self.routing_table = routing_table
+        self.default_model = routing_table.default_model or default_model
+
+    def route(self, features: RequestFeatures) -> str:
+        for rule in self.routing_table.rules:
+            if rule.matches(features):
+                return rule.model
+        return self.default_model
+
+    def escalate(self, model: str) -> Optional[str]:
+        return self.routing_table.escalation.get(model)
+
+
+def load_routing_table(path: Union[str, Path]) -> RoutingTable:
+    with open(str(path), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    return RoutingTable.model_validate(data)
@@ -0,0 +1,227 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import json
+import logging
+from pathlib import Path
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Optional, Tuple, TypeVar, Union
+
+from helpers import count_token_length
+from models import TextBlock, TextFile
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+DEFAULT_AUTOTUNE_FILENAME = 'autotune.json'
+
+
+def estimate_block_cost(text_block: TextBlock, model: str, pass_type: str = 'edit') -> int:
+    """
+    Estimate the cost of a request for text_block, in tokens: the
+    passage (twice, for QA, which includes the original and edited
+    text) plus the expected output, which is about the passage length.
+    """
+    tokens = count_token_length(text_block.original_content, model)
+    return tokens * 3 if pass_type == 'qa' else tokens * 2
+
+
+def estimate_file_cost(text_file: TextFile, model: str, pass_type: str = 'edit') -> int:
+    """
+    Estimate the cost of the requests for text_file, in tokens. For the
+    editing pass, this is the sum of its pending blocks; for global
+    review, the length of the file (output is short).
+    """
+    if pass_type == 'global_review':
+        return sum(count_token_length(b.original_content, model) for b in text_file.text_blocks)
+    return sum(estimate_block_cost(b, model, pass_type) for b in text_file.text_blocks if not b.is_edited)
+
+
+def order_longest_first(items: List[T], cost: Callable[[T], int]) -> List[T]:
+    """
+    Order items by estimated cost, largest first, so the longest
+    requests don't run last and stretch the total run time. Ties keep
+    their original order.
+    """
+    return sorted(items, key=lambda item: -cost(item))
+
+
+class Autotuner:
+    """
+    Adjusts the number of concurrent requests during a run, from observed
+    latency, rate limit (429) errors, and tokens-per-minute headroom:
+    concurrency is halved when rate limited, and raised by one while
+    latency holds steady and throughput is under the tokens-per-minute
+    limit (if given).
+
+    Also adjusts the target block size, from observed latency, for use
+    in the next run (blocks are extracted before any requests are sent).
+    """
+    def __init__(
+        self,
+        concurrency: int = 1,
+        min_concurrency: int = 1,
+        max_concurrency: int = 16,
+        target_block_tokens: int = 1500,
+        min_block_tokens: int = 500,
+        max_block_tokens: int = 3000,
+        tokens_per_minute_limit: Optional[int] = None,
+        latency_target: float = 60.0, # seconds
+        window: int = 20
+    ):
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_block_tokens = target_block_tokens
+        self.min_block_tokens = min_block_tokens
+        self.max_block_tokens = max_block_tokens
+        self.tokens_per_minute_limit = tokens_per_minute_limit
+        self.latency_target = latency_target
+        self.window = window
+        self.history: List[Dict] = []
+        self._observations: Deque[Tuple[float, Optional[float], int, bool]] = deque(maxlen=window)
+        self._baseline_latency: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def observe(self, latency: Optional[float], tokens: int = 0, rate_limited: bool = False):
+        """
+        Record the outcome of a request, and adjust settings once a full
+        window of requests has been observed.
+        """
+        with self._lock:
+            self._observations.append((time.monotonic(), latency, tokens, rate_limited))
+            if len(self._observations) >= self.window:
+                self._adjust()
+                self._observations.clear()
+
+    def _adjust(self):
+        observations = list(self._observations)
+        latencies = sorted(l for _, l, _, _ in observations if l is not None)
+        rate_limited_share = sum(1 for *_, r in observations if r) / len(observations)
+        elapsed_minutes = max(observations[-1][0] - observations[0][0], 1.0) / 60
+        tokens_per_minute = sum(t for _, _, t, _ in observations) / elapsed_minutes
+
+        median_latency = latencies[len(latencies) // 2] if latencies else None
+        p95_latency = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None
+        if self._baseline_latency is None:
+            self._baseline_latency = median_latency
+
+        previous = (self.concurrency, self.target_block_tokens)
+
+        has_headroom = self.tokens_per_minute_limit is None or tokens_per_minute < 0.8 * self.tokens_per_minute_limit
+        latency_steady = (
+            median_latency is not None
+            and self._baseline_latency is not None
+            and median_latency <= 1.5 * self._baseline_latency
+        )
+
+        if rate_limited_share > 0.05:
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+        elif has_headroom and latency_steady:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+        if p95_latency is not None:
+            if p95_latency > self.latency_target:
+                self.target_block_tokens = max(self.min_block_tokens, int(self.target_block_tokens * 0.8))
+            elif p95_latency < self.latency_target / 3 and rate_limited_share == 0:
+                self.target_block_tokens = min(self.max_block_tokens, int(self.target_block_tokens * 1.1))
+
+        self.history.append({
+            'median_latency': median_latency,
+            'p95_latency': p95_latency,
+            'rate_limited_share': rate_limited_share,
+            'tokens_per_minute': tokens_per_minute,
+            'concurrency': self.concurrency,
+            'target_block_tokens': self.target_block_tokens,
+        })
+
+        if (self.concurrency, self.target_block_tokens) != previous:
+            logger.info(
+                f"Autotuner: concurrency {previous[0]} -> {self.concurrency}, "
+                f"target block size {previous[1]} -> {self.target_block_tokens} tokens "
+                f"(median latency {median_latency}, 429 share {rate_limited_share:.0%}, {tokens_per_minute:.0f} tokens/min)"
+            )
+
+    def save(self, filepath: Union[str, Path], model: str):
+        """
+        Record the tuned settings for model, for reuse as defaults in the
+        next run.
+        """
+        filepath = Path(filepath)
+        data = load_autotune_file(filepath)
+        data[model] = {
+            'concurrency': self.concurrency,
+            'target_block_tokens': self.target_block_tokens,
+            'updated': int(time.time()),
+            'history': self.history[-20:],
+        }
+        with open(str(filepath), 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+
+def load_autotune_file(filepath: Union[str, Path]) -> Dict:
+    filepath = Path(filepath)
+    if not filepath.exists():
+        return {}
+    try:
+        with open(str(filepath), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable autotune file {filepath}: {e}")
+        return {}
+
+
+def load_tuned_settings(filepath: Union[str, Path], model: str) -> Dict:
+    """
+    Return settings recorded by the autotuner for model in a previous
+    run (concurrency and target_block_tokens), if any.
+    """
+    settings = load_autotune_file(filepath).get(model, {})
+    return {k: settings[k] for k in ('concurrency', 'target_block_tokens') if k in settings}
+
+
+def run_concurrently(
+    items: List[T],
+    fn: Callable[[T], None],
+    concurrency: Union[int, Autotuner] = 1
+):
+    """
+    Call fn on each item, in order, with up to concurrency calls in
+    flight. If concurrency is an Autotuner, its current concurrency is
+    checked before each call.
+
+    Exceptions raised by fn are logged, not raised.
+    """
+    def get_concurrency() -> int:
+        return concurrency.concurrency if isinstance(concurrency, Autotuner) else concurrency
+
+    max_workers = concurrency.max_concurrency if isinstance(concurrency, Autotuner) else concurrency
+
+    if max_workers <= 1:
+        for item in items:
+            try:
+                fn(item)
+            except Exception as e:
+                logger.exception(f"Failed to process item: {e}")
+        return
+
+    in_flight: Dict[Future, T] = {}
+
+    def collect(futures):
+        for future in futures:
+            in_flight.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                logger.exception(f"Failed to process item: {e}")
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scheduler") as executor:
+        for item in items:
+            while len(in_flight) >= max(1, get_concurrency()):
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[executor.submit(fn, item)] = item
+
+        collect(list(in_flight))
@@ -0,0 +1,167 @@
+import click
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from edit_memory import record_text_files
+from helpers import compute_hash, get_text_file_content
+from models import AsciiFile, TextBlock, TextFile
+from passes import PassContext, edit_text_file, qa_text_block, review_text_file
+from pipeline import is_text_file_complete
+from read_files import make_file_id, read_files
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_file_state_path(state_dir: Union[str, Path], file_id: str) -> Path:
+    return Path(state_dir) / f"{file_id}.json"
+
+
+def load_file_state(state_path: Path) -> Tuple[Optional[AsciiFile], Optional[str]]:
+    """
+    Read a file's saved state.
+
+    Returns:
+        tuple of the saved AsciiFile and the hash of the content written
+        to the source file (None if not yet written), or (None, None) if
+        there's no readable saved state
+    """
+    if not state_path.exists():
+        return None, None
+
+    try:
+        with open(str(state_path), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return AsciiFile.model_validate(data['text_file']), data.get('output_hash')
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable file state {state_path}: {e}")
+        return None, None
+
+
+def save_file_state(text_file: TextFile, state_path: Path, output_hash: Optional[str] = None):
+    """
+    Save a file's state, replacing any previous state atomically, so an
+    interrupted save never leaves a partial state file.
+    """
+    tmp_path = state_path.with_suffix('.json.tmp')
+    with open(str(tmp_path), 'w', encoding='utf-8') as f:
+        json.dump({'text_file': text_file.model_dump(mode="json"), 'output_hash': output_hash}, f)
+    os.replace(tmp_path, state_path)
+
+
+def run_streaming(
+    ctx: PassContext,
+    filepaths: List[Path],
+    model: str,
+    state_dir: Union[str, Path],
+    write_text_file: Callable[[TextFile], None],
+    review_notes_filepath: Union[str, Path],
+    base_dir: Optional[Union[str, Path]] = None,
+    disable_qa_pass: bool = False,
+    window_size: int = 4,
+    max_tokens_per_block: int = 1500
+) -> List[Path]:
+    """
+    Process files one at a time, with at most window_size files in
+    memory at once, rather than loading the whole project up front.
+
+    Each file is read, edited, QAed, reviewed, and written, and its state
+    is saved to its own JSON file in state_dir, after which it's released
+    from memory. Review notes are appended to review_notes_filepath as
+    each file completes.
+
+    Saved state is reused on later runs: files written in a previous run
+    and unchanged since are skipped, and edits are reused for unchanged
+    blocks of other files.
+
+    Returns:
+        list of filepaths not written, as editing or QA pass not completed
+    """
+    state_dir = Path(state_dir)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    notes_lock = threading.Lock()
+
+    def process_file(i: int, filepath: Path) -> bool:
+        file_id = make_file_id(filepath, base_dir)
+        state_path = get_file_state_path(state_dir, file_id)
+        previous_text_file, output_hash = load_file_state(state_path)
+
+        if output_hash and output_hash == compute_hash(get_text_file_content(filepath)):
+            click.echo(f"Skipping file {i+1} of {len(filepaths)} ({filepath.name}): already processed...")
+            return True
+
+        text_file = read_files(
+            [filepath],
+            model,
+            base_dir=base_dir,
+            previous_text_files=[previous_text_file] if previous_text_file else None,
+            max_tokens_per_block=max_tokens_per_block
+        )[0]
+        text_file.index = i
+
+        state_lock = threading.Lock()
+
+        def checkpoint(text_block: Optional[TextBlock] = None, changed: bool = True):
+            if changed:
+                with state_lock:
+                    save_file_state(text_file, state_path)
+
+        click.echo(f"Editing file {i+1} of {len(filepaths)} ({filepath.name})...")
+        edit_text_file(ctx, text_file, on_block_done=checkpoint)
+
+        if not disable_qa_pass and all(b.is_edited for b in text_file.text_blocks):
+            for text_block in text_file.text_blocks:
+                if not text_block.is_qaed and qa_text_block(ctx, text_block):
+                    checkpoint()
+
+        if not is_text_file_complete(text_file, disable_qa_pass):
+            checkpoint()
+            return False
+
+        if ctx.edit_memory:
+            record_text_files(ctx.edit_memory, [text_file], disable_qa_pass)
+
+        click.echo(f"Sending {filepath.name} for global review...")
+        review_notes = review_text_file(ctx, text_file)
+
+        if review_notes:
+            with notes_lock:
+                with open(str(review_notes_filepath), 'a', encoding='utf-8') as f:
+                    f.write(f"## {filepath}\n\n{review_notes}\n\n")
+
+        write_text_file(text_file)
+        save_file_state(text_file, state_path, output_hash=compute_hash(text_file.get_qaed_edited_content()))
+
+        return True
+
+    incomplete_filepaths: List[Path] = []
+    in_flight: Dict[Future, Path] = {}
+
+    def collect(futures):
+        for future in futures:
+            filepath = in_flight.pop(future)
+            try:
+                if not future.result():
+                    incomplete_filepaths.append(filepath)
+            except Exception as e:
+                logger.exception(f"Failed to process {filepath}: {e}")
+                incomplete_filepaths.append(filepath)
+
+    with ThreadPoolExecutor(max_workers=window_size) as executor:
+        for i, filepath in enumerate(filepaths):
+            if len(in_flight) >= window_size:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[executor.submit(process_file, i, filepath)] = filepath
+
+        collect(list(in_flight))
+
+    if incomplete_filepaths:
+        logger.warning(f"Files not written, as editing or QA pass not completed: {', '.join(str(f) for f in incomplete_filepaths)}")
+
+    return incomplete_filepaths
@@ -0,0 +1,251 @@
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import time
+from typing import Dict, List, Literal, Optional, Tuple, Union
+
+from models import AsciiBlock, AsciiFile, ContextSource
+
+
+logger = logging.getLogger(__name__)
+
+BlockStage = Literal['edit', 'qa', 'done', 'failed']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    file_index INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    block_id TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL REFERENCES files(file_id),
+    file_index INTEGER NOT NULL,
+    block_index INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL
+);
+CREATE INDEX IF NOT EXISTS blocks_by_stage ON blocks(stage, file_index, block_index);
+"""
+
+
+class WorkQueue:
+    """
+    Work queue of text blocks shared by worker processes, backed by a
+    SQLite state database.
+
+    Workers claim one block at a time under a lease. A lease that
+    expires (e.g., because its worker died) makes the block claimable
+    again.
+
+    NOTE: SQLite locking is reliable on local disks only, so all the
+    workers of a queue must run on the same host.
+    """
+    def __init__(self, db_path: Union[str, Path], timeout: float = 30.0):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path), timeout=timeout, isolation_level=None)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def set_settings(self, settings: Dict):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                [(k, json.dumps(v)) for k, v in settings.items()]
+            )
+
+    def get_settings(self) -> Dict:
+        return {k: json.loads(v) for k, v in self.conn.execute("SELECT key, value FROM settings")}
+
+    def reset(self):
+        """
+        Remove all queued files and blocks, and the settings.
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM blocks")
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("DELETE FROM settings")
+
+    def enqueue_text_files(self, text_files: List[AsciiFile], disable_qa_pass: bool = False):
+        """
+        Add text files and their blocks to the queue. Blocks already
+        edited (and QAed) are queued at the corresponding later stage.
+
+        Files and blocks already queued are left as they are (e.g.,
+        leased or completed by workers).
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for text_file in text_files:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO files (file_id, file_index, data) VALUES (?, ?, ?)",
+                    (text_file.id, text_file.index, text_file.model_dump_json(exclude={'text_blocks'}))
+                )
+                for text_block in text_file.text_blocks:
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO blocks (block_id, file_id, file_index, block_index, data, stage) VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            text_block.block_id,
+                            text_file.id,
+                            text_file.index,
+                            text_block.index,
+                            text_block.model_dump_json(),
+                            self._next_stage(text_block, disable_qa_pass)
+                        )
+                    )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _next_stage(text_block: AsciiBlock, disable_qa_pass: bool) -> BlockStage:
+        if not text_block.is_edited:
+            return 'edit'
+        if not disable_qa_pass and not text_block.is_qaed:
+            return 'qa'
+        return 'done'
+
+    def claim_block(
+        self,
+        worker_id: str,
+        lease_seconds: float = 300.0,
+        context_source: ContextSource = 'edited'
+    ) -> Optional[Tuple[AsciiBlock, BlockStage, List[str]]]:
+        """
+        Claim the next block waiting for editing or QA, in file and
+        block order.
+
+        If context_source is 'edited', a block is claimable for editing
+        only once the blocks preceding it in its file are edited (or
+        failed), so each block is edited after the edited text of the
+        block before it, as in a single process.
+
+        Returns:
+            tuple of the block, its stage, and the content of the
+            blocks preceding it in the same file, per context_source
+            (edited if available, else original; or original), or None
+            if no block is claimable
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                """
+                SELECT block_id, file_id, block_index, data, stage FROM blocks AS b
+                WHERE stage IN ('edit', 'qa')
+                AND (lease_owner IS NULL OR lease_expires < ?)
+                AND (? = 'original' OR stage != 'edit' OR NOT EXISTS (
+                    SELECT 1 FROM blocks AS p
+                    WHERE p.file_id = b.file_id AND p.block_index < b.block_index AND p.stage = 'edit'
+                ))
+                ORDER BY file_index, block_index
+                LIMIT 1
+                """,
+                (now, context_source)
+            ).fetchone()
+
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+
+            block_id, file_id, block_index, data, stage = row
+
+            self.conn.execute(
+                "UPDATE blocks SET lease_owner = ?, lease_expires = ? WHERE block_id = ?",
+                (worker_id, now + lease_seconds, block_id)
+            )
+
+            preceding_rows = self.conn.execute(
+                "SELECT data FROM blocks WHERE file_id = ? AND block_index < ? ORDER BY block_index",
+                (file_id, block_index)
+            ).fetchall()
+
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        preceding_texts = []
+        for (preceding_data,) in preceding_rows:
+            preceding_block = AsciiBlock.model_validate_json(preceding_data)
+            if context_source == 'original':
+                preceding_texts.append(preceding_block.original_content)
+            else:
+                preceding_texts.append(preceding_block.ai_edited_content or preceding_block.original_content)
+
+        return AsciiBlock.model_validate_json(data), stage, preceding_texts
+
+    def complete_block(
+        self,
+        worker_id: str,
+        text_block: AsciiBlock,
+        disable_qa_pass: bool = False
+    ) -> bool:
+        """
+        Save a processed block and release its lease, moving it to the
+        next stage.
+
+        Returns:
+            False if the worker no longer held the lease (e.g., it
+            expired and the block was claimed by another worker), in
+            which case nothing is saved
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                """
+                UPDATE blocks SET data = ?, stage = ?, lease_owner = NULL, lease_expires = NULL
+                WHERE block_id = ? AND lease_owner = ?
+                """,
+                (text_block.model_dump_json(), self._next_stage(text_block, disable_qa_pass), text_block.block_id, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def release_block(self, worker_id: str, block_id: str, max_attempts: int = 3):
+        """
+        Release the lease on a block that could not be processed. After
+        max_attempts failed attempts, the block is marked as failed.
+        """
+        with self.conn:
+            self.conn.execute(
+                """
+                UPDATE blocks SET
+                    attempts = attempts + 1,
+                    stage = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE stage END,
+                    lease_owner = NULL,
+                    lease_expires = NULL
+                WHERE block_id = ? AND lease_owner = ?
+                """,
+                (max_attempts, block_id, worker_id)
+            )
+
+    def get_stage_counts(self) -> Dict[str, int]:
+        return dict(self.conn.execute("SELECT stage, COUNT(*) FROM blocks GROUP BY stage").fetchall())
+
+    def load_text_files(self) -> List[AsciiFile]:
+        """
+        Load all text files, with their blocks in their current state.
+        """
+        text_files: List[AsciiFile] = []
+
+        for file_id, data in self.conn.execute("SELECT file_id, data FROM files ORDER BY file_index").fetchall():
+            text_file = AsciiFile.model_validate_json(data)
+            text_file.text_blocks = [
+                AsciiBlock.model_validate_json(block_data)
+                for (block_data,) in self.conn.execute(
+                    "SELECT data FROM blocks WHERE file_id = ? ORDER BY block_index", (file_id,)
+                ).fetchall()
+            ]
+            text_files.append(text_file)
+
+        return text_files
@@ -0,0 +1,267 @@
+import click
+import logging
+import os
+from pathlib import Path
+import socket
+import sys
+import time
+from uuid import uuid4
+
+from main import (
+    add_included_files,
+    read_json_file_list,
+    resolve_input_paths,
+    sort_chapter_files_by_json_file_list,
+    write_global_review_notes
+)
+from embedding_backends import EMBEDDING_BACKEND_NAMES
+from passes import SUPPORTED_MODELS, edit_text_block, load_pass_context, qa_text_block, review_text_file
+from models import ContextPolicy
+from pipeline import is_text_file_complete
+from preceding_context import build_preceding_context
+from providers import ProviderConfig, load_provider_config
+from read_files import read_files
+from routing import ModelRouter, load_routing_table
+from work_queue import WorkQueue
+from write_files import write_files
+
+
+logger = logging.getLogger(__name__)
+
+
+@click.group(help="""
+Split a project across several worker processes on one host, which
+share a state database.
+
+Run `init` once to queue the project's text passages, then start any
+number of `work` processes, then run `coordinate` to run the global
+review and write the edited files once all passages are processed.
+""")
+def cli():
+    pass
+
+
+@cli.command(help="Queue the text passages of the input files in a new state database (or, with --reset, an existing one).")
+@click.argument("input_paths", nargs=-1, required=True)
+@click.option("--db", "db_path", required=True, help="Path to the state database.")
+@click.option("--disable-qa-pass", "-q", is_flag=True, help="Disable QA pass of AI service calls.")
+@click.option(
+    "--model", "-m",
+    type=click.Choice(SUPPORTED_MODELS, case_sensitive=True),
+    default="gpt-4o",
+    help="Select your voice of AI model (default: gpt-4o)."
+)
+@click.option(
+    "--output-format", "-f",
+    type=click.Choice(["full", "edits"], case_sensitive=True),
+    default="full",
+    help="Response format for the editing and QA passes (default: full)."
+)
+@click.option("--routing-table", "-r", default=None, help="Provide the path to a JSON routing table to select a model per request.")
+@click.option(
+    "--embedding-backend",
+    type=click.Choice(EMBEDDING_BACKEND_NAMES, case_sensitive=True),
+    default="st",
+    help="Backend for the embeddings used to select style rules and word list terms (default: st)."
+)
+@click.option("--provider-config", default=None, help="Provide the path to a JSON provider config to use an OpenAI-compatible AI service other than OpenAI's.")
+@click.option(
+    "--preceding-context",
+    type=click.Choice(["full", "tokens", "sentences", "summary"], case_sensitive=True),
+    default="full",
+    help="Context from the preceding passage included in each editing prompt (see main.py; default: full)."
+)
+@click.option("--preceding-context-size", type=int, default=None, help="Number of tokens (default: 200) or sentences (default: 3) of preceding context with --preceding-context tokens or sentences.")
+@click.option(
+    "--preceding-context-source",
+    type=click.Choice(["edited", "original"], case_sensitive=True),
+    default="edited",
+    help="Take the preceding context from the 'edited' or 'original' text of the preceding passages (default: edited)."
+)
+@click.option("--reset", is_flag=True, help="Discard the project already queued in the state database, including passages processed by workers.")
+def init(input_paths, db_path, disable_qa_pass=False, model="gpt-4o", output_format="full", routing_table=None, embedding_backend="st", provider_config=None, preceding_context="full", preceding_context_size=None, preceding_context_source="edited", reset=False):
+    work_queue = WorkQueue(db_path)
+
+    is_queued = bool(work_queue.get_settings())
+
+    if is_queued and not reset:
+        click.echo(f"A project is already queued in {db_path}. Use --reset to discard it and start over. Exiting.")
+        sys.exit(1)
+
+    chapter_filepaths = resolve_input_paths(input_paths)
+    project_dir = chapter_filepaths[0].parent
+
+    atlas_json_filepath = Path(project_dir / "atlas.json")
+    atlas_filepaths = read_json_file_list(atlas_json_filepath) if atlas_json_filepath.exists() else None
+
+    sorted_filepaths = sort_chapter_files_by_json_file_list(chapter_filepaths, atlas_filepaths)
+    sorted_filepaths = add_included_files(sorted_filepaths)
+
+    click.echo("\nExtracting data from text files...\n")
+    all_text_files = read_files(sorted_filepaths, model, base_dir=project_dir)
+
+    # recorded in the files' state, as in main.py, as well as in the settings used by workers
+    context_policy = ContextPolicy(mode=preceding_context, size=preceding_context_size, source=preceding_context_source)
+    for text_file in all_text_files:
+        text_file.context_policy = context_policy
+
+    if is_queued:
+        click.echo(f"Discarding the project queued in {db_path}...")
+        work_queue.reset()
+
+    work_queue.set_settings({
+        'model': model,
+        'disable_qa_pass': disable_qa_pass,
+        'output_format': output_format,
+        'routing_table': str(Path(routing_table).resolve()) if routing_table else None,
+        'style_guide_dir': str(Path(os.getcwd()) / 'style_guides'),
+        'embedding_backend': embedding_backend,
+        'provider_config': str(Path(provider_config).resolve()) if provider_config else None,
+        'context_policy': context_policy.model_dump(),
+    })
+    work_queue.enqueue_text_files(all_text_files, disable_qa_pass)
+
+    num_text_blocks = sum(len(f.text_blocks) for f in all_text_files)
+    click.echo(f"Queued {num_text_blocks} text passages from {len(all_text_files)} files in {db_path}.")
+
+
+@cli.command(help="Claim and process queued text passages until none are left.")
+@click.option("--db", "db_path", required=True, help="Path to the state database.")
+@click.option("--worker-id", default=None, help="Unique ID for this worker (default: hostname and process ID).")
+@click.option("--api-key-env", default="OPENAI_API_KEY", show_default=True, help="Name of the environment variable holding the API key for this worker.")
+@click.option("--lease-seconds", type=float, default=300.0, show_default=True, help="Time after which a passage claimed by this worker can be claimed by another, if not completed.")
+@click.option("--max-attempts", type=int, default=3, show_default=True, help="Number of failed attempts after which a passage is marked as failed.")
+@click.option("--poll-interval", type=float, default=1.0, show_default=True, help="Interval (in seconds) at which to poll for passages while none can be claimed but some remain unfinished (e.g., passages waiting on the edits of the passages before them). If 0, exit instead.")
+def work(db_path, worker_id=None, api_key_env="OPENAI_API_KEY", lease_seconds=300.0, max_attempts=3, poll_interval=1.0):
+    from ai_service import AIServiceCaller
+
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:6]}"
+
+    work_queue = WorkQueue(db_path)
+    settings = work_queue.get_settings()
+
+    if not settings:
+        click.echo(f"No queued project found in {db_path}. Run `init` first. Exiting.")
+        sys.exit(1)
+
+    model = settings['model']
+    disable_qa_pass = settings['disable_qa_pass']
+
+    provider = load_provider_config(settings['provider_config']) if settings.get('provider_config') else ProviderConfig()
+
+    api_key = os.getenv(api_key_env)
+    if not api_key and provider.base_url is None:
+        click.echo(f"The environment variable {api_key_env} is not set. Exiting.")
+        sys.exit(1)
+
+    model_router = ModelRouter(load_routing_table(settings['routing_table']), model) if settings.get('routing_table') else None
+    context_policy = ContextPolicy.model_validate(settings.get('context_policy') or {})
+
+    pass_context = load_pass_context(
+        settings['style_guide_dir'],
+        model,
+        embedding_backend=settings.get('embedding_backend', 'st'),
+        ai_service_caller=AIServiceCaller(responses_model=model, api_key=api_key, model_router=model_router, provider=provider),
+        output_format=settings['output_format'],
+        context_policy=context_policy
+    )
+
+    num_processed = 0
+
+    while True:
+        claim = work_queue.claim_block(worker_id, lease_seconds, context_policy.source)
+
+        if claim is None:
+            counts = work_queue.get_stage_counts()
+            if poll_interval > 0 and (counts.get('edit', 0) or counts.get('qa', 0)):
+                time.sleep(poll_interval)
+                continue
+            break
+
+        text_block, stage, preceding_texts = claim
+        click.echo(f"[{worker_id}] Sending text passage {text_block.block_id} for {'editing' if stage == 'edit' else 'QA'}...")
+
+        try:
+            if stage == 'edit':
+                preceding_passage = build_preceding_context(context_policy, preceding_texts, model)
+                succeeded = edit_text_block(pass_context, text_block, preceding_passage) is not None
+            else:
+                succeeded = qa_text_block(pass_context, text_block)
+        except Exception as e:
+            logger.exception(f"Failed to process text passage {text_block.block_id}: {e}")
+            succeeded = False
+
+        if not succeeded:
+            work_queue.release_block(worker_id, text_block.block_id, max_attempts)
+            continue
+
+        if not work_queue.complete_block(worker_id, text_block, disable_qa_pass):
+            logger.warning(f"Lease on text passage {text_block.block_id} expired before completion. Result discarded.")
+            continue
+
+        num_processed += 1
+
+    click.echo(f"[{worker_id}] No text passages left to claim. Processed {num_processed} passages. Exiting.")
+
+
+@cli.command(help="Run the global review and write edited files once all passages are processed.")
+@click.option("--db", "db_path", required=True, help="Path to the state database.")
+@click.option("--wait", "wait_interval", type=float, default=0, show_default=True, help="If greater than 0, wait for workers to finish, polling at this interval (in seconds).")
+def coordinate(db_path, wait_interval=0):
+    work_queue = WorkQueue(db_path)
+    settings = work_queue.get_settings()
+
+    if not settings:
+        click.echo(f"No queued project found in {db_path}. Run `init` first. Exiting.")
+        sys.exit(1)
+
+    while True:
+        counts = work_queue.get_stage_counts()
+        remaining = counts.get('edit', 0) + counts.get('qa', 0)
+        if not remaining or wait_interval <= 0:
+            break
+        click.echo(f"Waiting for {remaining} text passages to be processed...")
+        time.sleep(wait_interval)
+
+    click.echo(f"Text passages by stage: {counts}")
+
+    if remaining or counts.get('failed', 0):
+        click.echo("Unable to run global review or update source files: editing or QA pass not completed.")
+        sys.exit(1)
+
+    all_text_files = work_queue.load_text_files()
+    disable_qa_pass = settings['disable_qa_pass']
+
+    if not all(is_text_file_complete(f, disable_qa_pass) for f in all_text_files):
+        click.echo("Unable to run global review or update source files: editing or QA pass not completed.")
+        sys.exit(1)
+
+    model_router = ModelRouter(load_routing_table(settings['routing_table']), settings['model']) if settings.get('routing_table') else None
+
+    pass_context = load_pass_context(
+        settings['style_guide_dir'],
+        settings['model'],
+        embedding_backend=settings.get('embedding_backend', 'st'),
+        model_router=model_router,
+        provider=load_provider_config(settings['provider_config']) if settings.get('provider_config') else None,
+        output_format=settings['output_format']
+    )
+
+    global_issues = []
+    click.echo("Sending edited text to AI service for global review...")
+    for i, text_file in enumerate(all_text_files):
+        click.echo(f"Sending {i+1} of {len(all_text_files)} text files for global review...")
+        review_notes = review_text_file(pass_context, text_file)
+        if review_notes:
+            global_issues.append((text_file.filepath, review_notes))
+
+    write_global_review_notes(global_issues, Path(os.getcwd()) / f"global_review_{int(time.time())}.md")
+
+    click.echo("Writing edited text to source files...")
+    write_files(all_text_files)
+
+    click.echo("Script complete.")
+
+
+if __name__ == '__main__':
+    cli()
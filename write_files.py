@@ -1,20 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+import difflib
 import logging
-from typing import List
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import List, Optional, Union
 
-from helpers import write_text_to_file
-from models import AsciiFile
+from helpers import compute_hash
+from models import AsciiFile, TextFile, join_text_blocks
 
 
 logger = logging.getLogger(__name__)
 
 
-def write_files(text_files: List[AsciiFile]):
+def read_source_text(filepath: Union[str, Path]) -> str:
+	"""
+	Read a file's content as is, without translating line endings.
+	"""
+	with open(str(filepath), 'r', encoding='utf-8', newline='') as f:
+		return f.read()
+
+
+def match_line_endings(text: str, source_text: str) -> str:
+	"""
+	Convert text's line endings to those of source_text.
+	"""
+	if '\r\n' in source_text:
+		text = text.replace('\r\n', '\n').replace('\n', '\r\n')
+	return text
+
+
+def get_output_text(text_file: TextFile, source_text: str) -> str:
+	"""
+	Get a file's edited content, with the line endings of source_text.
+	"""
+	return match_line_endings(text_file.get_qaed_edited_content(), source_text)
+
+
+def can_write_text_file(text_file: TextFile, source_text: str) -> bool:
+	"""
+	Check that a file has text blocks, and that joining their original
+	content reproduces source_text exactly, so that writing the edited
+	text can't drop or alter text no block covers (e.g., a file parsed
+	with an older version, or changed since it was read).
+	"""
+	filepath = text_file.filepath
+	if not text_file.text_blocks:
+		logger.info(f"No text blocks to write to file: {filepath}")
+		return False
+
+	original_text = join_text_blocks(
+		text_file.text_blocks,
+		[b.original_content for b in text_file.text_blocks],
+		text_file.leading_text
+	)
+	if match_line_endings(original_text, source_text) != source_text:
+		logger.warning(f"Text blocks don't reproduce the content of {filepath}; skipping it, to avoid losing text.")
+		return False
+
+	return True
+
+
+def write_text_to_file_atomically(filepath: Union[str, Path], text_content: str):
+	"""
+	Write text to a temp file next to filepath, then rename it over
+	filepath, so the file is never left partly written.
+	"""
+	filepath = Path(filepath)
+	fd, tmp_path = tempfile.mkstemp(dir=str(filepath.parent), prefix=f".{filepath.name}.", suffix='.tmp')
+	try:
+		with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+			f.write(text_content)
+		if filepath.exists():
+			shutil.copymode(str(filepath), tmp_path)
+		os.replace(tmp_path, str(filepath))
+	except BaseException:
+		os.unlink(tmp_path)
+		raise
+
+
+def write_text_file(text_file: TextFile) -> bool:
+	"""
+	Write a file's edited text, if it differs from the file's current
+	content.
+
+	Returns:
+		True if the file was written
+	"""
+	filepath = text_file.filepath
+	source_text = read_source_text(filepath)
+	if not can_write_text_file(text_file, source_text):
+		return False
+
+	edited_text = get_output_text(text_file, source_text)
+
+	if compute_hash(edited_text) == compute_hash(source_text):
+		logger.info(f"No changes to write to file: {filepath}")
+		return False
+
+	write_text_to_file_atomically(filepath, edited_text)
+	logger.info(f"Edited text written to file: {filepath}")
+	return True
+
+
+def write_files(text_files: List[AsciiFile], max_workers: int = 8) -> int:
 	"""
 	For list of AsciiFiles, write edited text
-	to file.
+	to file, skipping unchanged files.
+
+	Returns:
+		number of files written
+	"""
+	with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="write-files") as executor:
+		return sum(executor.map(write_text_file, text_files))
+
+
+def split_lines(text: str) -> List[str]:
+	"""
+	Split text into lines at newlines only, keeping line endings.
+	"""
+	lines = [line + '\n' for line in text.split('\n')]
+	lines[-1] = lines[-1][:-1]
+	return lines if lines[-1] else lines[:-1]
+
+
+def make_file_diff(text_file: TextFile, base_dir: Optional[Union[str, Path]] = None) -> str:
+	"""
+	Make a unified diff of a file's current content and its edited
+	text, with paths relative to base_dir (if given), as for git.
+	"""
+	filepath = Path(text_file.filepath)
+	source_text = read_source_text(filepath)
+	if not can_write_text_file(text_file, source_text):
+		return ''
+
+	edited_text = get_output_text(text_file, source_text)
+
+	if edited_text == source_text:
+		return ''
+
+	path = filepath.resolve()
+	if base_dir is not None:
+		try:
+			path = path.relative_to(Path(base_dir).resolve())
+		except ValueError:
+			pass
+
+	diff_lines = []
+	for line in difflib.unified_diff(
+		split_lines(source_text),
+		split_lines(edited_text),
+		fromfile=f"a/{path.as_posix().lstrip('/')}",
+		tofile=f"b/{path.as_posix().lstrip('/')}"
+	):
+		diff_lines.append(line)
+		if not line.endswith('\n'):
+			diff_lines.append('\n\\ No newline at end of file\n')
+
+	return ''.join(diff_lines)
+
+
+def write_patch(diffs: List[str], patch_filepath: Union[str, Path]):
+	"""
+	Write file diffs (see make_file_diff) to a single patch file.
 	"""
-	for text_file in text_files:
-		filepath = text_file.filepath
-		edited_text = text_file.get_qaed_edited_content()
-		write_text_to_file(filepath, edited_text)
-		logger.info(f"Edited text written to file: {filepath}")
+	with open(str(patch_filepath), 'w', encoding='utf-8', newline='') as f:
+		f.write(''.join(diffs))